@@ -0,0 +1,149 @@
+"""Content-addressed local cache of Google Earth Engine responses"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+import zlib
+
+
+class CacheMissError(Exception):
+    """Raised in cache-only mode for a request that is not cached"""
+
+
+class GeeCache:
+    """Disk cache of ``getInfo`` responses keyed by the request
+
+    The key is the SHA-256 of the serialized request, which holds the
+    product, filters, geometry, scale and crs, so any change of the request
+    is a new entry. Responses are stored as zlib compressed pickles and the
+    least recently used ones are evicted above ``max_bytes``.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory of the cache.
+    max_bytes : int, optional
+        The maximum size of the cache on disk. The default is 2 GB.
+    cache_only : bool, optional
+        Offline mode, raise ``CacheMissError`` instead of sending a request
+        that is not cached. The default is False.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, cache_only=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_only = cache_only
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.entries = self._scan()  # key -> [size, last access]
+        self.size = sum(size for size, _ in self.entries.values())
+
+    def _scan(self):
+        entries = {}
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith('.bin'):
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    entries[file_name[:-4]] = [stat.st_size, stat.st_mtime]
+        return entries
+
+    @staticmethod
+    def key(computed_object):
+        """Returns the cache key of a GEE request"""
+        return hashlib.sha256(computed_object.serialize().encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.bin')
+
+    def get(self, key):
+        """Returns the cached response of a key
+
+        Returns
+        -------
+        tuple
+            (True, response) for a hit, (False, None) for a miss.
+        """
+        with self.lock:
+            path = self._path(key)
+            if key not in self.entries or not os.path.exists(path):
+                if key in self.entries:  # removed from the disk by another process
+                    self.size -= self.entries.pop(key)[0]
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            os.utime(path)  # the file mtime keeps the last access across sessions
+            self.entries[key][1] = time.time()
+            with open(path, 'rb') as file_in:
+                data = file_in.read()
+        return True, pickle.loads(zlib.decompress(data))
+
+    def put(self, key, response):
+        """Stores a response and evicts the least recently used entries above the size limit"""
+        data = zlib.compress(pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '%s.%s.tmp' % (path, threading.get_ident())
+        with open(temp_path, 'wb') as file_out:
+            file_out.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries[key][0]
+            self.entries[key] = [len(data), time.time()]
+            self.size += len(data)
+            self._evict()
+
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self.entries.items(), key=lambda entry: entry[1][1]):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            del self.entries[key]
+            self.size -= size
+            self.evictions += 1
+
+    def get_info(self, computed_object, request):
+        """Returns the cached response of a request or runs and caches it
+
+        Parameters
+        ----------
+        computed_object : ee.ComputedObject
+            The GEE object to evaluate.
+        request : function
+            Runs ``getInfo`` on the object, e.g. with retries.
+        Returns
+        -------
+        object
+            The response.
+        """
+        key = self.key(computed_object)
+        hit, response = self.get(key)
+        if hit:
+            return response
+        if self.cache_only:
+            raise CacheMissError('Request not cached: %s' % key)
+        response = request(computed_object)
+        self.put(key, response)
+        return response
+
+    def stats(self):
+        """Returns the hits, misses, evictions, entries and size of the cache"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.0, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.size}
@@ -0,0 +1,250 @@
+"""Concurrent, rate limited executor for Google Earth Engine requests"""
+
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+import pandas as pd
+
+from Tracer import span
+
+# messages of the Earth Engine errors worth retrying (quota, rate limit and transient server/network errors)
+RETRYABLE_MESSAGES = ('too many requests', 'too many concurrent', 'quota', 'rate limit', '429', 'timed out',
+                      'timeout', 'deadline', 'internal error', 'service unavailable', '503', '502', 'incompleteread',
+                      'connection', 'temporarily', 'try again')
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError, socket.timeout, http.client.IncompleteRead)
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(text in message for text in RETRYABLE_MESSAGES)
+    return False
+
+
+def response_rows(result):
+    # the features of a FeatureCollection or the rows of a getRegion table
+    if isinstance(result, dict) and 'features' in result:
+        return len(result['features'])
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+
+class RateLimiter:
+    """Token bucket limiting the requests per second across threads
+
+    Parameters
+    ----------
+    requests_per_second : float
+        The sustained request rate, None for no limit.
+    burst : int, optional
+        The number of requests that can be sent at once. The default is 1.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, requests_per_second, burst=1):
+        self.rate = requests_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeeRequestExecutor:
+    """Executor the extractors route their ``getInfo`` calls through
+
+    Keeps up to ``max_in_flight`` requests running, enforces a requests per
+    second quota, retries quota and transient errors with jittered
+    exponential backoff and records the latency of every request.
+
+    Parameters
+    ----------
+    max_in_flight : int, optional
+        The maximum number of concurrent requests. The default is 8.
+    requests_per_second : float, optional
+        The request quota, None for no limit. The default is 10.
+    max_retries : int, optional
+        The number of retries of a failed request. The default is 5.
+    base_delay : float, optional
+        The backoff of the first retry in s. The default is 1.
+    max_delay : float, optional
+        The maximum backoff in s. The default is 60.
+    cache : GeeCache, optional
+        The cache of the responses. The default is None, no cache.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, max_in_flight=8, requests_per_second=10, max_retries=5, base_delay=1.0, max_delay=60.0,
+                 cache=None):
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = RateLimiter(requests_per_second, burst=max_in_flight)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.records = []
+        self.records_lock = threading.Lock()
+        self.sleep = time.sleep
+
+    def backoff(self, attempt):
+        """Full jitter backoff of a retry"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def get_info(self, computed_object, label=''):
+        """Runs ``getInfo`` on a GEE object in the calling thread
+
+        Parameters
+        ----------
+        computed_object : ee.ComputedObject
+            The GEE object to evaluate.
+        label : str, optional
+            A label of the request for the latency records.
+        Returns
+        -------
+        object
+            The result of ``getInfo``.
+        """
+        with span('gee.request', label=label) as stage:
+            if self.cache is None:
+                result = self._request(computed_object, label)
+            else:
+                sent = []
+
+                def request(uncached_object):
+                    sent.append(uncached_object)
+                    return self._request(uncached_object, label)
+
+                result = self.cache.get_info(computed_object, request)
+                stage.add(cache_hits=0 if sent else 1)
+            if stage:  # the size of the result serialised again as JSON, not the bytes received, only when traced
+                stage.add(response_json_bytes=len(json.dumps(result, default=str)), rows=response_rows(result))
+            return result
+
+    def _request(self, computed_object, label):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            with self.in_flight:
+                try:
+                    result = computed_object.getInfo()
+                    error = None
+                except Exception as request_error:
+                    error = request_error
+            self._record(label, time.perf_counter() - start, attempt, error)
+            if error is None:
+                return result
+            if attempt >= self.max_retries or not is_retryable(error):
+                raise error
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def _record(self, label, latency, attempt, error):
+        with self.records_lock:
+            self.records.append({'label': label, 'latency': latency, 'attempt': attempt,
+                                 'error': None if error is None else type(error).__name__})
+
+    def map(self, function, items):
+        """Runs a function over items on a thread pool
+
+        The function is expected to send its requests through
+        ``get_info``, at most ``max_in_flight`` of them run at once.
+
+        Parameters
+        ----------
+        function : function
+            The function applied to each item.
+        items : list
+            The items.
+        Returns
+        -------
+        list
+            The results, in the order of the items.
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(items))) as executor:
+            return list(executor.map(function, items))
+
+    def get_info_many(self, computed_objects, label=''):
+        """Runs ``getInfo`` on many GEE objects concurrently
+
+        Returns
+        -------
+        list
+            The results, in the order of the objects.
+        """
+        return self.map(lambda computed_object: self.get_info(computed_object, label), computed_objects)
+
+    def latency_records(self):
+        """Returns the latency of every request sent
+
+        Returns
+        -------
+        Pandas data frame
+            The label, latency in s, attempt number and error type of
+            each request.
+        """
+        with self.records_lock:
+            return pd.DataFrame(self.records, columns=['label', 'latency', 'attempt', 'error'])
+
+    def latency_summary(self):
+        """Summarises the latency of the requests by label
+
+        Returns
+        -------
+        Pandas data frame
+            The number of requests, retries and failures and the mean,
+            median and 95th percentile latency of each label.
+        """
+        records = self.latency_records()
+        return records.groupby('label').agg(requests=('latency', 'size'),
+                                            retries=('attempt', lambda attempt: (attempt > 0).sum()),
+                                            errors=('error', 'count'), mean=('latency', 'mean'),
+                                            p50=('latency', 'median'),
+                                            p95=('latency', lambda latency: latency.quantile(0.95)))
+
+
+_default_executor = None
+
+
+def default_executor():
+    """Returns the executor shared by the extractors created without one"""
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = GeeRequestExecutor()
+    return _default_executor
+
+
+def set_default_executor(executor):
+    """Sets the executor shared by the extractors created without one"""
+    global _default_executor
+    _default_executor = executor
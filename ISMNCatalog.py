@@ -0,0 +1,172 @@
+"""Persistent catalog of a raw ISMN download"""
+
+import os
+import re
+import pandas as pd
+
+# network_network_station_variable_depthfrom_depthto_sensor_startdate_enddate.stm
+STM_NAME_PATTERN = re.compile(r'_([a-z]+)_(-?\d+\.\d+)_(-?\d+\.\d+)_(.+)_(\d{8})_(\d{8})\.stm$')
+CATALOG_COLUMNS = ['network', 'station', 'variable', 'depth_from', 'depth_to', 'sensor', 'size', 'mtime', 'dir',
+                   'path']
+
+
+class ISMNCatalog:
+    """Catalog of the .stm files of a raw ISMN download
+
+    The catalog is built in one scan of the archive and saved next to it.
+    Later refreshes only list the directories whose mtime has changed, so
+    adding a network or a station does not rescan the whole archive.
+
+    Parameters
+    ----------
+    network_dir : str
+        The root directory of the ISMN download (``<network>/<station>/*.stm``).
+    catalog_file : str, optional
+        The file the catalog is saved to. The default is
+        ``<network_dir>_catalog.pkl`` next to the download, so that saving
+        the catalog does not change the mtime of the scanned directory.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, network_dir, catalog_file=None):
+        self.network_dir = os.path.abspath(network_dir)
+        if catalog_file is None:
+            catalog_file = self.network_dir + '_catalog.pkl'
+        self.catalog_file = catalog_file
+        self.files = pd.DataFrame(columns=CATALOG_COLUMNS)
+        self.dirs = {}  # dir -> (mtime, list of sub directories)
+        self.load()
+
+    def load(self):
+        """Loads the catalog saved by a previous scan, if any
+
+        Returns
+        -------
+        None.
+        """
+        if os.path.exists(self.catalog_file):
+            saved = pd.read_pickle(self.catalog_file)
+            self.files = saved['files']
+            self.dirs = saved['dirs']
+
+    def save(self):
+        """Saves the catalog atomically
+
+        Returns
+        -------
+        None.
+        """
+        temp_file = self.catalog_file + '.tmp'
+        pd.to_pickle({'files': self.files, 'dirs': self.dirs}, temp_file)
+        os.replace(temp_file, self.catalog_file)
+
+    def refresh(self, save=True):
+        """Updates the catalog, rescanning only the directories whose mtime changed
+
+        Parameters
+        ----------
+        save : bool, optional
+            Save the updated catalog. The default is True.
+        Returns
+        -------
+        ISMNCatalog
+            The catalog itself.
+        """
+        old_files = {dir_name: group for dir_name, group in self.files.groupby('dir', sort=False)}
+        dirs = {}
+        frames = []
+        pending = [self.network_dir]
+        while pending:
+            dir_name = pending.pop()
+            mtime = os.stat(dir_name).st_mtime
+            if dir_name in self.dirs and self.dirs[dir_name][0] == mtime:  # unchanged, reuse the previous scan
+                sub_dirs = self.dirs[dir_name][1]
+                if dir_name in old_files:
+                    frames.append(old_files[dir_name])
+            else:
+                sub_dirs, records = self._scan_dir(dir_name)
+                if records:
+                    frames.append(pd.DataFrame(records, columns=CATALOG_COLUMNS))
+            dirs[dir_name] = (mtime, sub_dirs)
+            pending.extend(sub_dir for sub_dir in sub_dirs if os.path.isdir(sub_dir))
+        self.dirs = dirs
+        if frames:
+            self.files = pd.concat(frames, ignore_index=True)
+        else:
+            self.files = pd.DataFrame(columns=CATALOG_COLUMNS)
+        if save:
+            self.save()
+        return self
+
+    def _scan_dir(self, dir_name):
+        sub_dirs = []
+        records = []
+        rel_parts = os.path.relpath(dir_name, self.network_dir).split(os.sep)
+        network = rel_parts[0] if len(rel_parts) >= 1 and rel_parts[0] != '.' else ''
+        station = rel_parts[1] if len(rel_parts) >= 2 else ''
+        with os.scandir(dir_name) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    sub_dirs.append(entry.path)
+                    continue
+                name_match = STM_NAME_PATTERN.search(entry.name)
+                if name_match is None:
+                    continue
+                variable, depth_from, depth_to, sensor = name_match.groups()[:4]
+                stat = entry.stat()
+                records.append([network, station, variable, float(depth_from), float(depth_to), sensor,
+                                stat.st_size, stat.st_mtime, dir_name, entry.path])
+        return sub_dirs, records
+
+    def select(self, variable=None, max_depth=None, network=None, station=None):
+        """Selects files from the catalog
+
+        Parameters
+        ----------
+        variable : str, optional
+            The ISMN variable, e.g. ``sm`` or ``ts``.
+        max_depth : float, optional
+            The maximum bottom depth of the sensor in m.
+        network : str, optional
+            The network name.
+        station : str, optional
+            The station name.
+        Returns
+        -------
+        Pandas data frame
+            The catalog records of the selected files.
+        """
+        mask = pd.Series(True, index=self.files.index)
+        if variable is not None:
+            mask &= self.files['variable'] == variable
+        if max_depth is not None:
+            mask &= self.files['depth_to'] <= max_depth
+        if network is not None:
+            mask &= self.files['network'] == network
+        if station is not None:
+            mask &= self.files['station'] == station
+        return self.files[mask]
+
+    def pair(self, file_paths, variable='ts'):
+        """Finds the file of another variable measured by the same sensor at the same depth
+
+        Parameters
+        ----------
+        file_paths : list
+            The paths of catalogued files, e.g. the sm files.
+        variable : str, optional
+            The paired variable. The default is ``ts``.
+        Returns
+        -------
+        list
+            The paired file path, or None where there is no such file.
+        """
+        keys = ['dir', 'depth_from', 'depth_to', 'sensor']
+        paired = self.files[self.files['variable'] == variable].drop_duplicates(keys)
+        paired = paired.set_index(keys)['path']
+        records = self.files.set_index('path').loc[list(file_paths)]
+        lookup = pd.MultiIndex.from_frame(records[keys])
+        matched = paired.reindex(lookup)
+        return [None if pd.isna(path) else path for path in matched]
@@ -0,0 +1,462 @@
+"""Local GeoTIFF/COG mirrors of Google Earth Engine collections"""
+
+import glob
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal, osr
+
+from PixelIndex import PixelGrid
+from TimeseriesExtractor import MAX_FEATURES, db_to_linear, linear_to_db
+
+gdal.UseExceptions()
+
+TILE_INDEX_FILE = '_tile_index.parquet'  # in the directory of the mirror
+# the acquisition time in the tile names: Sentinel-1 scene ids, GEE image ids (e.g. MODIS 2017_01_01) and dates
+TIME_PATTERNS = [(r'\d{8}T\d{6}', '%Y%m%dT%H%M%S'), (r'\d{4}_\d{2}_\d{2}', '%Y_%m_%d'), (r'\d{8}', '%Y%m%d')]
+INDEX_COLUMNS = ['path', 'mtime', 'id', 'time', 'crs', 'geographic', 'transform', 'bands', 'data_type', 'min_x',
+                 'max_x', 'min_y', 'max_y']
+MAX_WINDOW_PIXELS = 1 << 20  # the points of a tile are read in one window up to this size, one window each above
+METRES_PER_DEGREE = 111320.0  # the buffers of the tiles in geographic coordinates
+
+
+def tile_time(file_name):
+    """Returns the acquisition time of a tile in ms from its name, None without a date"""
+    for pattern, date_format in TIME_PATTERNS:
+        match = re.search(pattern, file_name)
+        if match:
+            return pd.to_datetime(match.group(), format=date_format).value // 10 ** 6
+    return None
+
+
+def read_tile_info(path):
+    """Reads the header of a tile
+
+    The GEE exports keep the band names as the band descriptions. The
+    image properties (e.g. ``orbitProperties_pass``) are the metadata
+    items of the file, ``system:index`` and ``system:time_start`` items
+    override the id and time taken from the file name.
+
+    Parameters
+    ----------
+    path : str
+        The path of the GeoTIFF.
+    Returns
+    -------
+    dict
+        The ``INDEX_COLUMNS`` (but the path) and the properties.
+    """
+    dataset = gdal.Open(path)
+    properties = dict(dataset.GetMetadata() or {})
+    name = os.path.splitext(os.path.basename(path))[0]
+    image_id = properties.pop('system:index', name)
+    time_start = properties.pop('system:time_start', None)
+    srs = osr.SpatialReference(wkt=dataset.GetProjection())
+    try:
+        srs.AutoIdentifyEPSG()
+    except RuntimeError:  # e.g. the MODIS sinusoidal projection
+        pass
+    code = srs.GetAuthorityCode(None)
+    ulx, x_res, x_skew, uly, y_skew, y_res = dataset.GetGeoTransform()
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    first_band = dataset.GetRasterBand(1)
+    bands = [dataset.GetRasterBand(number).GetDescription() or 'B%d' % number
+             for number in range(1, dataset.RasterCount + 1)]
+    info = {'mtime': os.path.getmtime(path),
+            'id': image_id,
+            'time': int(time_start) if time_start is not None else tile_time(name),
+            'crs': 'EPSG:' + code if code else srs.ExportToProj4().strip(),
+            'geographic': bool(srs.IsGeographic()),
+            'transform': [x_res, x_skew, ulx, y_skew, y_res, uly],  # the GEE crs_transform
+            'bands': ','.join(bands),
+            'data_type': 'float' if 'Float' in gdal.GetDataTypeName(first_band.DataType) else 'int',
+            'min_x': ulx, 'max_x': ulx + width * x_res, 'min_y': uly + height * y_res, 'max_y': uly}
+    info.update(properties)
+    return info
+
+
+def build_tile_index(data_dir, pattern='*.tif', n_workers=None):
+    """Indexes the tiles of a mirror by image, date and extent
+
+    The index is saved in the mirror (``TILE_INDEX_FILE``), only the tiles
+    added or modified since are opened again.
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory of the mirror, searched recursively.
+    pattern : str, optional
+        The file name pattern of the tiles. The default is '*.tif'.
+    n_workers : int, optional
+        The number of headers read in parallel. The default is None.
+    Returns
+    -------
+    Pandas data frame
+        One row per tile, the ``INDEX_COLUMNS`` with the path relative to
+        ``data_dir`` and a column per property.
+    """
+    index_file = os.path.join(data_dir, TILE_INDEX_FILE)
+    paths = sorted(glob.glob(os.path.join(data_dir, '**', pattern), recursive=True))
+    mtimes = {os.path.relpath(path, data_dir): os.path.getmtime(path) for path in paths}
+    index = pd.read_parquet(index_file) if os.path.exists(index_file) else pd.DataFrame(columns=INDEX_COLUMNS)
+    unchanged = [mtimes.get(path) == mtime for path, mtime in zip(index['path'], index['mtime'])]
+    kept = index[np.array(unchanged, dtype=bool)]
+    new_paths = sorted(set(mtimes) - set(kept['path']))
+    if not new_paths and len(kept) == len(index):
+        return index
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        rows = list(executor.map(read_tile_info, [os.path.join(data_dir, path) for path in new_paths]))
+    new_index = pd.DataFrame(rows, columns=None if rows else INDEX_COLUMNS[1:])
+    new_index.insert(0, 'path', new_paths)
+    index = pd.concat([kept, new_index], ignore_index=True) if len(kept) else new_index
+    temp_file = '%s.%s.tmp' % (index_file, uuid.uuid4().hex[:8])
+    index.to_parquet(temp_file, index=False)
+    os.replace(temp_file, index_file)
+    return index
+
+
+def _read_window(dataset, band_numbers, row_start, row_end, col_start, col_end):
+    # (bands x rows x columns) values of a window, the ends included, NaN for nodata
+    values = np.empty((len(band_numbers), row_end - row_start + 1, col_end - col_start + 1))
+    for pos, number in enumerate(band_numbers):
+        band = dataset.GetRasterBand(number)
+        data = band.ReadAsArray(int(col_start), int(row_start), int(col_end - col_start + 1),
+                                int(row_end - row_start + 1)).astype(np.float64)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            data[data == nodata] = np.nan
+        values[pos] = data
+    return values
+
+
+def read_tile(path, band_numbers, x, y, buffer=0):
+    """Reads the pixels of points from one tile with windowed reads
+
+    The points close together are read in one window, the others in a
+    window each, so only the blocks holding them are read from a COG.
+
+    Parameters
+    ----------
+    path : str
+        The path of the GeoTIFF.
+    band_numbers : list
+        The numbers (from 1) of the bands to read.
+    x : numpy array
+        The x of the points in the projection of the tile.
+    y : numpy array
+        The y of the points.
+    buffer : float, optional
+        The radius around the points, in the units of the projection. The
+        default is 0, the pixel holding each point.
+    Returns
+    -------
+    tuple
+        The position of the point of each pixel, the x and y of the pixel
+        centres and the (pixels x bands) values, NaN for nodata. A point
+        keeps the pixel holding it when no pixel centre is in the buffer.
+    """
+    dataset = gdal.Open(path)
+    ulx, x_res, _, uly, _, y_res = dataset.GetGeoTransform()
+    y_res = -y_res
+    last_col, last_row = dataset.RasterXSize - 1, dataset.RasterYSize - 1
+    col = np.clip(np.floor((x - ulx) / x_res).astype(np.int64), 0, last_col)
+    row = np.clip(np.floor((uly - y) / y_res).astype(np.int64), 0, last_row)
+    col_start = np.clip(np.floor((x - buffer - ulx) / x_res).astype(np.int64), 0, last_col)
+    col_end = np.clip(np.floor((x + buffer - ulx) / x_res).astype(np.int64), 0, last_col)
+    row_start = np.clip(np.floor((uly - y - buffer) / y_res).astype(np.int64), 0, last_row)
+    row_end = np.clip(np.floor((uly - y + buffer) / y_res).astype(np.int64), 0, last_row)
+    window = None
+    if (row_end.max() - row_start.min() + 1) * (col_end.max() - col_start.min() + 1) <= MAX_WINDOW_PIXELS:
+        window = _read_window(dataset, band_numbers, row_start.min(), row_end.max(), col_start.min(), col_end.max())
+    points, pixel_x, pixel_y, values = [], [], [], []
+    for pos in range(len(x)):
+        rows, cols = np.mgrid[row_start[pos]:row_end[pos] + 1, col_start[pos]:col_end[pos] + 1]
+        centre_x = ulx + (cols + 0.5) * x_res
+        centre_y = uly - (rows + 0.5) * y_res
+        inside = (centre_x - x[pos]) ** 2 + (centre_y - y[pos]) ** 2 <= buffer ** 2
+        if not buffer or not inside.any():
+            inside = (rows == row[pos]) & (cols == col[pos])
+        if window is None:
+            point_window = _read_window(dataset, band_numbers, row_start[pos], row_end[pos], col_start[pos],
+                                        col_end[pos])
+        else:
+            point_window = window[:, row_start[pos] - row_start.min():row_end[pos] - row_start.min() + 1,
+                                  col_start[pos] - col_start.min():col_end[pos] - col_start.min() + 1]
+        points.append(np.full(inside.sum(), pos))
+        pixel_x.append(centre_x[inside])
+        pixel_y.append(centre_y[inside])
+        values.append(point_window[:, inside].T)
+    if not points:
+        return np.empty(0, np.int64), np.empty(0), np.empty(0), np.empty((0, len(band_numbers)))
+    return np.concatenate(points), np.concatenate(pixel_x), np.concatenate(pixel_y), np.concatenate(values)
+
+
+class LocalRasterBackend:
+    """Reads the images of a query from local mirrors of GEE products
+
+    A mirror is a directory of GeoTIFF/COG tiles, one or more per image,
+    indexed by ``build_tile_index``. The tiles of the query dates and
+    properties holding the sites are read with windowed reads on a thread
+    pool (GDAL releases the GIL while reading) and the rows have the
+    layout of the GEE backend, so the extractors produce the same data
+    frames from either backend. The pixels are read on the native grid of
+    the tiles, the scale and projection of the extract are not used.
+
+    Parameters
+    ----------
+    mirrors : dict
+        The directory of the mirror of each GEE product name.
+    fallback : GeeBackend, optional
+        The backend of the products without a mirror and of the sites out
+        of the tiles of a mirror. The default is None, such sites get no
+        rows.
+    pattern : str, optional
+        The file name pattern of the tiles. The default is '*.tif'.
+    n_workers : int, optional
+        The number of tiles read in parallel. The default is None.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, mirrors, fallback=None, pattern='*.tif', n_workers=None):
+        self.mirrors = mirrors
+        self.fallback = fallback
+        self.pattern = pattern
+        self.n_workers = n_workers
+        self.indexes = {}
+        self.grids = {}
+
+    def index(self, product):
+        """Returns the tile index of a mirrored product, built once per session"""
+        if product not in self.indexes:
+            self.indexes[product] = build_tile_index(self.mirrors[product], self.pattern, self.n_workers)
+        return self.indexes[product]
+
+    def _fallback(self, product):
+        if self.fallback is None:
+            raise ValueError('%s has no local mirror and no fallback backend' % product)
+        return self.fallback
+
+    def _grid(self, crs):
+        # the projection of the points to the tiles of a crs, the transform is built once
+        if crs not in self.grids:
+            self.grids[crs] = PixelGrid.from_band_info({'crs': crs, 'crs_transform': [1, 0, 0, 0, -1, 0]})
+        return self.grids[crs]
+
+    def _project(self, crs, lon, lat):
+        return self._grid(crs).project(lon, lat)
+
+    def _unproject(self, crs, x, y):
+        grid = self._grid(crs)
+        if grid.point_geometry is None:  # geographic tiles
+            return x, y
+        return grid.point_geometry.inverse_project_points(x, y)
+
+    def band_info(self, product, bands):
+        """Returns the ``bands`` information of the first tile of a product, in the GEE layout"""
+        if product not in self.mirrors:
+            return self._fallback(product).band_info(product, bands)
+        tiles = self.index(product)
+        tiles = tiles[np.array([set(bands) <= set(tile_bands.split(',')) for tile_bands in tiles['bands']], dtype=bool)]
+        if not len(tiles):
+            raise ValueError('No tile of %s holds the bands %s' % (product, bands))
+        tile = tiles.iloc[0]
+        return [{'id': band, 'crs': tile['crs'], 'crs_transform': [float(value) for value in tile['transform']],
+                 'data_type': {'precision': tile['data_type']}} for band in bands]
+
+    def native_projection(self, query):
+        """Returns the projection of the extract of the fallback, the tiles are read on their native grid"""
+        if self.fallback is None:
+            return None
+        return self.fallback.native_projection(query)
+
+    def select(self, query):
+        """Returns the tiles of the images of a query
+
+        Raises
+        ------
+        ValueError
+            A property of the query is not a metadata item of the tiles.
+        """
+        tiles = self.index(query.product)
+        start = pd.Timestamp(query.start_date).value // 10 ** 6
+        end = pd.Timestamp(query.end_date).value // 10 ** 6
+        keep = (tiles['time'] >= start).to_numpy() & (tiles['time'] < end).to_numpy()
+        keep &= np.array([set(query.bands) <= set(tile_bands.split(',')) for tile_bands in tiles['bands']], dtype=bool)
+        names = list(query.properties) + [name for name, _ in query.property_bands.values()]
+        for name in names:
+            if name not in tiles:
+                raise ValueError('The tiles of %s have no %s property' % (query.product, name))
+        for name, value in query.properties.items():
+            keep &= (tiles[name].astype(str) == str(value)).to_numpy()
+        return tiles[keep]
+
+    def covered(self, product, lon, lat):
+        """Flags the points inside the tiles of a mirror, of any date"""
+        inside = np.zeros(len(lon), dtype=bool)
+        extents = self.index(product).drop_duplicates(['crs', 'min_x', 'max_x', 'min_y', 'max_y'])
+        for crs, crs_tiles in extents.groupby('crs', sort=False):
+            x, y = self._project(crs, lon, lat)
+            for min_x, max_x, min_y, max_y in crs_tiles[['min_x', 'max_x', 'min_y', 'max_y']].to_numpy():
+                inside |= (x >= min_x) & (x < max_x) & (y > min_y) & (y <= max_y)
+        return inside
+
+    def _extract(self, query, tiles, lon, lat, buffer, reducer):
+        # the pixels ('pixels') or their 'mean' or 'median' at the points of all tiles, with the 'point' position
+        data_dir = self.mirrors[query.product]
+        tasks = []
+        for crs, crs_tiles in tiles.groupby('crs', sort=False):
+            x, y = self._project(crs, lon, lat)
+            for tile in crs_tiles.to_dict('records'):
+                inside = np.flatnonzero((x >= tile['min_x']) & (x < tile['max_x']) & (y > tile['min_y'])
+                                        & (y <= tile['max_y']))
+                if len(inside):
+                    bands = tile['bands'].split(',')
+                    units = buffer / METRES_PER_DEGREE if tile['geographic'] else buffer
+                    tasks.append((tile, inside, [bands.index(band) + 1 for band in query.bands], x[inside],
+                                  y[inside], units))
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            results = list(executor.map(lambda task: read_tile(os.path.join(data_dir, task[0]['path']), *task[2:]),
+                                        tasks))
+        frames = []
+        for (tile, inside, _, _, _, _), (point, pixel_x, pixel_y, values) in zip(tasks, results):
+            # the points the tile has no data at are out of its footprint, not covered by the image
+            has_data = np.bincount(point, weights=~np.isnan(values).all(axis=1), minlength=len(inside)) > 0
+            if reducer == 'pixels':
+                keep = has_data[point]
+                longitude, latitude = self._unproject(tile['crs'], pixel_x[keep], pixel_y[keep])
+                frame = pd.DataFrame(values[keep], columns=query.bands)
+                frame.insert(0, 'point', inside[point[keep]])
+                frame.insert(1, 'longitude', longitude)
+                frame.insert(2, 'latitude', latitude)
+            else:
+                frame = pd.DataFrame(values, columns=query.bands)
+                for band in query.linear_bands:
+                    frame[band] = db_to_linear(frame[band])
+                frame = frame.groupby(point).agg(reducer).loc[np.flatnonzero(has_data)]
+                for band in query.linear_bands:
+                    frame[band] = linear_to_db(frame[band])
+                frame.insert(0, 'point', inside[frame.index.to_numpy()])
+                frame = frame.reset_index(drop=True)
+            frame['id'] = tile['id']
+            frame['time'] = tile['time']
+            for band, (name, codes) in query.property_bands.items():
+                frame[band] = codes.index(tile[name]) if tile[name] in codes else np.nan
+            frames.append(frame)
+        columns = ['point', 'longitude', 'latitude'] if reducer == 'pixels' else ['point']
+        columns += query.bands + ['id', 'time'] + list(query.property_bands)
+        data_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        if reducer != 'pixels':  # an image split in overlapping tiles
+            data_df = data_df.drop_duplicates(['point', 'id'])
+        return data_df
+
+    def size(self, query):
+        """Returns the number of images of a query, over the whole mirror"""
+        if query.product not in self.mirrors:
+            return self._fallback(query.product).size(query)
+        return self.select(query)['id'].nunique()
+
+    def region(self, query, location, scale=None, projection=None):
+        """Returns the pixels of all images over a location, see ``GeeBackend.region``
+
+        Parameters
+        ----------
+        query : CollectionQuery
+            The images.
+        location : tuple
+            The (lon, lat) or (lon, lat, buffer in m) of the location, the
+            pixels whose centre is within the buffer are returned.
+        scale : float, optional
+            Not used, the native pixels are read.
+        projection : str, optional
+            Not used.
+        Returns
+        -------
+        data_df : Pandas data frame
+            The ``id``, ``longitude``, ``latitude``, ``time`` and band
+            values of the pixels.
+        """
+        if query.product not in self.mirrors:
+            return self._fallback(query.product).region(query, location, scale, projection)
+        if not isinstance(location, (tuple, list)):
+            raise TypeError('A local backend needs the (lon, lat, buffer) of the location, not a GEE geometry')
+        lon, lat = np.array([location[0]], dtype=float), np.array([location[1]], dtype=float)
+        if self.fallback is not None and not self.covered(query.product, lon, lat)[0]:
+            return self.fallback.region(query, location, scale, projection)
+        buffer = location[2] if len(location) > 2 else 0
+        data_df = self._extract(query, self.select(query), lon, lat, buffer, 'pixels')
+        return data_df[['id', 'longitude', 'latitude', 'time'] + query.bands + list(query.property_bands)]
+
+    def reduce_region(self, query, location, reducer='mean', scale=None, projection=None):
+        """Reduces each image over a location, see ``GeeBackend.reduce_region``
+
+        Parameters
+        ----------
+        query : CollectionQuery
+            The images.
+        location : tuple
+            The (lon, lat) or (lon, lat, buffer in m) of the location.
+        reducer : str, optional
+            'mean', 'median' or 'first'. The default is 'mean'.
+        scale : float, optional
+            Only passed to the fallback.
+        projection : str, optional
+            Only passed to the fallback.
+        Returns
+        -------
+        Pandas data frame
+            The ``id``, ``time`` in ms and the bands of the images with a
+            value over the location.
+        """
+        if query.product not in self.mirrors:
+            return self._fallback(query.product).reduce_region(query, location, reducer, scale, projection)
+        if not isinstance(location, (tuple, list)):
+            raise TypeError('A local backend needs the (lon, lat, buffer) of the location, not a GEE geometry')
+        lon, lat = np.array([location[0]], dtype=float), np.array([location[1]], dtype=float)
+        if self.fallback is not None and not self.covered(query.product, lon, lat)[0]:
+            return self.fallback.reduce_region(query, location, reducer, scale, projection)
+        site = pd.DataFrame({'site_id': [0], 'lon': lon, 'lat': lat})
+        data_df = self.sample(query, site, buffer=location[2] if len(location) > 2 else 0, reducer=reducer,
+                              not_null=query.bands)
+        return data_df.drop(columns='site_id').reset_index(drop=True)
+
+    def sample(self, query, sites, id_column='site_id', lon_column='lon', lat_column='lat', buffer=0,
+               reducer='first', scale=None, projection=None, not_null=None, max_rows=MAX_FEATURES, chunk_size=50):
+        """Reduces all images over many sites, see ``GeeBackend.sample``
+
+        The 'first' reducer takes the pixel holding each site, 'mean' and
+        'median' reduce the pixels whose centre is within the buffer. The
+        scale, projection, max_rows and chunk_size are only passed to the
+        fallback.
+
+        Returns
+        -------
+        Pandas data frame
+            One row per image and site with the ``site_id``, the image
+            ``id``, its ``time`` in ms and the bands.
+        """
+        if query.product not in self.mirrors:
+            return self._fallback(query.product).sample(query, sites, id_column, lon_column, lat_column, buffer,
+                                                        reducer, scale, projection, not_null, max_rows, chunk_size)
+        if reducer not in ('first', 'mean', 'median'):
+            raise ValueError("reducer must be 'first', 'mean' or 'median', not %r" % reducer)
+        lon = sites[lon_column].to_numpy(dtype=float)
+        lat = sites[lat_column].to_numpy(dtype=float)
+        covered = self.covered(query.product, lon, lat)
+        data_df = self._extract(query, self.select(query), lon[covered], lat[covered],
+                                0 if reducer == 'first' else buffer, 'mean' if reducer == 'first' else reducer)
+        site_ids = sites[id_column].to_numpy()[covered]
+        data_df.insert(0, 'site_id', site_ids[data_df.pop('point').to_numpy(dtype=np.int64)])
+        data_df = data_df[['site_id', 'id', 'time'] + query.bands + list(query.property_bands)]
+        if not_null is not None:
+            data_df = data_df.dropna(subset=not_null)
+        if self.fallback is not None and not covered.all():
+            fallback_df = self.fallback.sample(query, sites[~covered], id_column, lon_column, lat_column, buffer,
+                                               reducer, scale, projection, not_null, max_rows, chunk_size)
+            data_df = pd.concat([data_df, fallback_df], ignore_index=True) if len(fallback_df) else data_df
+        return data_df
@@ -0,0 +1,533 @@
+"""Columnar storage of the pipeline outputs on Parquet"""
+
+import glob
+import json
+import os
+import time
+import uuid
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from Tracer import span
+
+# typed schema of the known columns, the other columns keep the type inferred from pandas
+FIELD_TYPES = {
+    'time': pa.timestamp('ms'),
+    'Excel_day': pa.int32(),
+    'DoY': pa.int16(),
+    'sm': pa.float64(),
+    'ts': pa.float64(),
+    'sm_count': pa.int32(),
+    'VV': pa.float64(),
+    'VH': pa.float64(),
+    'angle': pa.float64(),
+    'platform': pa.int8(),
+    'relative_orbit': pa.int16(),
+    'orbit_pass': pa.int8(),
+    'NDVI': pa.float64(),
+    'EVI': pa.float64(),
+    'SMAP': pa.float64(),
+}
+PARTITION_KEYS = ['network', 'station']
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'  # the hive name of a missing network or station
+HIGH_WATER_MARK_FILE = '_high_water_mark'  # hidden from the readers by its _ prefix
+CHECKPOINT_DIR = '_checkpoints'  # the completed tasks of the pipeline runner
+
+
+def to_table(df):
+    """Converts a data frame to an Arrow table with the typed schema
+
+    A ``time`` index is stored as a column. Integer columns holding NaN
+    (e.g. after an outer join on the dates) are stored as nullable
+    integers.
+
+    Parameters
+    ----------
+    df : Pandas data frame
+        The data frame.
+    Returns
+    -------
+    pyarrow.Table
+        The table.
+    """
+    if df.index.name is not None:
+        df = df.reset_index()
+    columns = {}
+    for name in df.columns:
+        values = pa.array(df[name], from_pandas=True)
+        field_type = FIELD_TYPES.get(name)
+        if field_type is not None and values.type != field_type:
+            values = values.cast(field_type)
+        columns[str(name)] = values
+    return pa.table(columns)
+
+
+def _unify(schemas):
+    # the schema of files holding different columns, the partition keys last as in a discovered dataset
+    schema = pa.unify_schemas(schemas, promote_options='permissive')
+    names = [name for name in schema.names if name not in PARTITION_KEYS]
+    return pa.schema([schema.field(name) for name in names + [key for key in PARTITION_KEYS if key in schema.names]])
+
+
+def _time_max(parquet_file):
+    # the last time of a Parquet file from the statistics of its row groups, None when they are missing
+    names = parquet_file.schema_arrow.names
+    if 'time' not in names:
+        return None
+    column = names.index('time')
+    last = None
+    for group in range(parquet_file.metadata.num_row_groups):
+        statistics = parquet_file.metadata.row_group(group).column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            return None
+        last = statistics.max if last is None else max(last, statistics.max)
+    return None if last is None else pd.Timestamp(last)
+
+
+def _partition_value(value):
+    return NULL_PARTITION if value is None or value == '' else quote(str(value), safe='')
+
+
+class PipelineStore:
+    """Parquet store of the per-site time series and the site tables
+
+    Each dataset (e.g. ``daily_ave``, ``input`` or ``SMAP``) is a directory
+    of Parquet files partitioned by network and station
+    (``<dataset>/network=<network>/station=<station>/part-*.parquet``), or
+    of unpartitioned files for the datasets that are not per site. Reads
+    only decode the requested columns and use the row group statistics and
+    the partitions to skip the dates and sites out of the query, the files
+    are memory mapped. Every write goes to a temporary file renamed into
+    place, so a reader never sees a partial file. Each site (or
+    unpartitioned dataset) records a high-water mark, the last day its data
+    covers, so that updates only extract the days after it.
+
+    Parameters
+    ----------
+    root_dir : str
+        The root directory of the store.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        if not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._schemas = {}  # the unified schema of each dataset and the files it covers
+
+    def dataset_dir(self, dataset, network=None, station=None):
+        """Returns the directory of a dataset, or of a site partition of it"""
+        dir_name = os.path.join(self.root_dir, dataset)
+        if network is None and station is None:
+            return dir_name
+        return os.path.join(dir_name, 'network=' + _partition_value(network),
+                            'station=' + _partition_value(station))
+
+    def _write_file(self, table, dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+        base_name = 'part-%d-%s.parquet' % (time.time_ns(), uuid.uuid4().hex[:8])
+        file_name = os.path.join(dir_name, base_name)
+        temp_file = os.path.join(dir_name, '.' + base_name)  # hidden from the readers until renamed
+        pq.write_table(table, temp_file)
+        os.replace(temp_file, file_name)
+        return file_name
+
+    def write(self, dataset, df, network=None, station=None, mode='overwrite', high_water_mark=None):
+        """Writes the data of a site, or of an unpartitioned dataset
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset.
+        df : Pandas data frame
+            The data, a ``time`` index is stored as a column.
+        network : str, optional
+            The network of the site. The default is None.
+        station : str, optional
+            The station of the site. The default is None.
+        mode : str, optional
+            'overwrite' replaces the previous data of the site, 'append'
+            adds a file next to it. The default is 'overwrite'.
+        high_water_mark : str, optional
+            The last day covered by the data once written. The default is
+            None, the mark is left unchanged.
+        Returns
+        -------
+        str
+            The path of the written file.
+        """
+        if mode not in ('overwrite', 'append'):
+            raise ValueError("mode must be 'overwrite' or 'append', not %r" % mode)
+        dir_name = self.dataset_dir(dataset, network, station)
+        old_files = glob.glob(os.path.join(dir_name, 'part-*.parquet')) if mode == 'overwrite' else []
+        with span('store.write', None if station is None else '%s_%s' % (network, station), dataset=dataset) as stage:
+            table = to_table(df)
+            file_name = self._write_file(table, dir_name)
+            stage.add(rows=table.num_rows, bytes=table.nbytes)
+        for old_file in old_files:  # the new data is in place before the old one is removed
+            os.remove(old_file)
+        cached = self._schemas.get(dataset)
+        if cached is not None:  # the written file joins the cached schema, the other files are not opened again
+            schema, seen = cached
+            self._schemas[dataset] = (_unify([schema, table.schema]),
+                                      (seen - {os.path.abspath(old_file) for old_file in old_files})
+                                      | {os.path.abspath(file_name)})
+        if high_water_mark is not None:
+            self.set_high_water_mark(dataset, high_water_mark, network, station)
+        return file_name
+
+    def high_water_mark(self, dataset, network=None, station=None):
+        """Returns the last day covered by a site, None if it was never written with a mark"""
+        file_name = os.path.join(self.dataset_dir(dataset, network, station), HIGH_WATER_MARK_FILE)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name) as file_in:
+            return pd.Timestamp(file_in.read().strip())
+
+    def set_high_water_mark(self, dataset, date, network=None, station=None):
+        """Records the last day covered by a site
+
+        Returns
+        -------
+        None.
+        """
+        dir_name = self.dataset_dir(dataset, network, station)
+        os.makedirs(dir_name, exist_ok=True)
+        file_name = os.path.join(dir_name, HIGH_WATER_MARK_FILE)
+        temp_file = '%s.%s.tmp' % (file_name, uuid.uuid4().hex[:8])
+        with open(temp_file, 'w') as file_out:
+            file_out.write(pd.Timestamp(date).strftime('%Y-%m-%d'))
+        os.replace(temp_file, file_name)
+
+    def update_window(self, dataset, start_date, end_date, network=None, station=None):
+        """Returns the days a site misses up to the end of the study period
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset.
+        start_date : str
+            The start of the study period.
+        end_date : str
+            The last day of the study period.
+        network : str, optional
+            The network of the site. The default is None.
+        station : str, optional
+            The station of the site. The default is None.
+        Returns
+        -------
+        tuple
+            The (start, end) day strings to extract and the write mode.
+            The start is None when the site is up to date. A site without
+            a mark is extracted from ``start_date`` and overwritten, the
+            other sites are extracted from the day after their mark and
+            appended.
+        """
+        end = pd.Timestamp(end_date).strftime('%Y-%m-%d')
+        mark = self.high_water_mark(dataset, network, station)
+        if mark is None:
+            return pd.Timestamp(start_date).strftime('%Y-%m-%d'), end, 'overwrite'
+        if mark >= pd.Timestamp(end_date):
+            return None, end, 'append'
+        return (mark + pd.Timedelta(days=1)).strftime('%Y-%m-%d'), end, 'append'
+
+    def truncate(self, dataset, date, network=None, station=None):
+        """Drops the data of a site from a date on
+
+        Only the files holding such dates are rewritten, as found from the
+        row group statistics of their ``time`` column, e.g. the last
+        appended file before the recomputed tail of an update is appended.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset.
+        date : str
+            The first date to drop.
+        network : str, optional
+            The network of the site. The default is None.
+        station : str, optional
+            The station of the site. The default is None.
+        Returns
+        -------
+        int
+            The number of rows dropped.
+        """
+        bound = pd.Timestamp(date)
+        dropped = 0
+        old_files, new_files = [], []
+        for file_name in self._files(dataset, network, station):
+            with pq.ParquetFile(file_name) as parquet_file:  # closed before the file is removed
+                last = _time_max(parquet_file)
+                if last is not None and last < bound:
+                    continue
+                table = parquet_file.read()
+            if 'time' not in table.column_names:
+                continue
+            keep = pc.less(table['time'], pa.scalar(bound, type=table.schema.field('time').type))
+            kept = table.filter(pc.fill_null(keep, True))
+            if kept.num_rows == table.num_rows:
+                continue
+            if kept.num_rows:
+                new_files.append(self._write_file(kept, os.path.dirname(file_name)))
+            os.remove(file_name)
+            old_files.append(file_name)
+            dropped += table.num_rows - kept.num_rows
+        cached = self._schemas.get(dataset)
+        if cached is not None and old_files:
+            schema, seen = cached
+            self._schemas[dataset] = (schema, (seen - {os.path.abspath(file_name) for file_name in old_files})
+                                      | {os.path.abspath(file_name) for file_name in new_files})
+        return dropped
+
+    def clear(self, dataset, network=None, station=None):
+        """Drops all the data and the high-water mark of a site
+
+        The mark is removed first, a site left half cleared is extracted
+        again from the start and overwritten.
+
+        Returns
+        -------
+        int
+            The number of files removed.
+        """
+        mark_file = os.path.join(self.dataset_dir(dataset, network, station), HIGH_WATER_MARK_FILE)
+        if os.path.exists(mark_file):
+            os.remove(mark_file)
+        old_files = self._files(dataset, network, station)
+        for file_name in old_files:
+            os.remove(file_name)
+        cached = self._schemas.get(dataset)
+        if cached is not None and old_files:
+            schema, seen = cached
+            self._schemas[dataset] = (schema, seen - {os.path.abspath(file_name) for file_name in old_files})
+        return len(old_files)
+
+    def exists(self, dataset, network=None, station=None):
+        """Checks whether a dataset, or a site of it, holds any data"""
+        for _, _, file_names in os.walk(self.dataset_dir(dataset, network, station)):
+            if any(name.startswith('part-') and name.endswith('.parquet') for name in file_names):
+                return True
+        return False
+
+    def _files(self, dataset, network=None, station=None):
+        # the data files of a dataset, or only of the partition of a site
+        dir_name = self.dataset_dir(dataset, network, station)
+        if network is not None or station is not None:
+            return sorted(glob.glob(os.path.join(dir_name, 'part-*.parquet')))
+        return sorted(glob.glob(os.path.join(dir_name, '**', 'part-*.parquet'), recursive=True))
+
+    def _file_dataset(self, dataset, files, schema=None):
+        # the partition values are inferred from the paths, or typed as in the schema of the dataset
+        partitioning = 'hive'
+        if schema is not None:
+            partitioning = ds.partitioning(pa.schema([schema.field(name) for name in PARTITION_KEYS
+                                                      if name in schema.names]), flavor='hive')
+        return ds.dataset([os.path.abspath(file_name) for file_name in files], schema=schema, format='parquet',
+                          filesystem=self.filesystem, partitioning=partitioning,
+                          partition_base_dir=os.path.abspath(self.dataset_dir(dataset)))
+
+    def _schema(self, dataset, files):
+        # the files of the sites may hold different columns, e.g. a band missing at a site. The schema unifies all the
+        # files of the dataset: they are all opened once, then only the footers of the files not seen yet are read
+        if dataset not in self._schemas:
+            data = self._file_dataset(dataset, self._files(dataset))
+            schemas = [fragment.physical_schema for fragment in data.get_fragments()] + [data.schema]
+            self._schemas[dataset] = (_unify(schemas), set(data.files))
+        schema, seen = self._schemas[dataset]
+        new_files = [file_name for file_name in files if os.path.abspath(file_name) not in seen]
+        if new_files:
+            schemas = [schema] + [pq.read_schema(file_name, memory_map=True) for file_name in new_files]
+            schema = _unify(schemas)
+            self._schemas[dataset] = (schema, seen | {os.path.abspath(file_name) for file_name in new_files})
+        return schema
+
+    def _dataset(self, dataset, files=None):
+        # the files of a dataset (all of them by default) with the schema of the dataset
+        if files is None:
+            files = self._files(dataset)
+        return self._file_dataset(dataset, files, self._schema(dataset, files))
+
+    def read(self, dataset, columns=None, start=None, end=None, network=None, station=None):
+        """Reads a dataset, only decoding the selected columns, dates and sites
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset.
+        columns : list, optional
+            The columns to read. The default is None, all columns.
+        start : str, optional
+            The first date to read. The default is None.
+        end : str, optional
+            The last date to read. The default is None.
+        network : str or list, optional
+            The networks to read. The default is None, all networks.
+        station : str or list, optional
+            The stations to read. The default is None, all stations.
+        Returns
+        -------
+        Pandas data frame
+            The data indexed by ``time``. The ``network`` and ``station``
+            columns are dropped when a single station is read, only the
+            partition of a single site is opened.
+        """
+        if isinstance(network, str) and isinstance(station, str):
+            files = self._files(dataset, network, station)
+        else:
+            files = self._files(dataset)
+        if not files and not self.exists(dataset):
+            return pd.DataFrame()
+        data = self._dataset(dataset, files)  # without files of the site, the empty columns of the dataset
+        names = data.schema.names
+        expression = None
+        for name, value in (('network', network), ('station', station)):
+            if value is None or name not in names:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            condition = ds.field(name).isin(values)
+            expression = condition if expression is None else expression & condition
+        if 'time' in names:
+            for value, compare in ((start, 'ge'), (end, 'le')):
+                if value is None:
+                    continue
+                bound = pa.scalar(pd.Timestamp(value), type=data.schema.field('time').type)
+                condition = ds.field('time') >= bound if compare == 'ge' else ds.field('time') <= bound
+                expression = condition if expression is None else expression & condition
+        single_site = isinstance(station, str)
+        if columns is None:
+            columns = [name for name in names if not (single_site and name in PARTITION_KEYS)]
+        elif 'time' in names and 'time' not in columns:
+            columns = ['time'] + list(columns)
+        with span('store.read', '%s_%s' % (network, station) if single_site else None, dataset=dataset) as stage:
+            table = data.to_table(columns=columns, filter=expression)
+            df = table.to_pandas()
+            if 'time' in df:
+                df = df.set_index('time').sort_index(kind='stable')
+            stage.add(rows=table.num_rows, bytes=table.nbytes)
+        return df
+
+    def sites(self, dataset):
+        """Lists the (network, station) sites of a partitioned dataset
+
+        Returns
+        -------
+        Pandas data frame
+            The ``network`` and ``station`` of each site.
+        """
+        if not self.exists(dataset):
+            return pd.DataFrame(columns=PARTITION_KEYS)
+        fragments = self._dataset(dataset).get_fragments()
+        keys = [ds.get_partition_keys(fragment.partition_expression) for fragment in fragments]
+        return pd.DataFrame(keys, columns=PARTITION_KEYS).drop_duplicates(ignore_index=True)
+
+    def write_table(self, name, df):
+        """Replaces a site table (e.g. ``site_info``) atomically
+
+        Returns
+        -------
+        None.
+        """
+        temp_file = os.path.join(self.root_dir, name + '.parquet.tmp')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), temp_file)
+        os.replace(temp_file, os.path.join(self.root_dir, name + '.parquet'))
+
+    def read_table(self, name, columns=None):
+        """Reads a site table, an empty data frame if it was never written"""
+        file_name = os.path.join(self.root_dir, name + '.parquet')
+        if not os.path.exists(file_name):
+            return pd.DataFrame()
+        return pq.read_table(file_name, columns=columns, memory_map=True).to_pandas()
+
+    def _checkpoint_file(self, stage, task):
+        return os.path.join(self.root_dir, CHECKPOINT_DIR, stage, _partition_value(task) + '.json')
+
+    def checkpoint(self, stage, task):
+        """Returns the checkpoint of a task, None if it never completed
+
+        Returns
+        -------
+        dict
+            The ``key`` of the inputs the task completed with, its
+            ``record`` and the ``time`` it completed.
+        """
+        file_name = self._checkpoint_file(stage, task)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name) as file_in:
+            return json.load(file_in)
+
+    def checkpoints(self, stage):
+        """Returns the checkpoints of all the completed tasks of a stage, by task"""
+        dir_name = os.path.join(self.root_dir, CHECKPOINT_DIR, stage)
+        if not os.path.isdir(dir_name):
+            return {}
+        tasks = [unquote(name[:-len('.json')]) for name in os.listdir(dir_name) if name.endswith('.json')]
+        return {task: self.checkpoint(stage, task) for task in tasks}
+
+    def set_checkpoint(self, stage, task, key, record=None):
+        """Records the completion of a task atomically
+
+        Parameters
+        ----------
+        stage : str
+            The stage of the task.
+        task : str
+            The task, e.g. a site.
+        key : str
+            The hash of the inputs and parameters of the task.
+        record : dict, optional
+            The output of the task kept with the checkpoint, e.g. the
+            attributes of a site. The default is None.
+        Returns
+        -------
+        None.
+        """
+        file_name = self._checkpoint_file(stage, task)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        temp_file = '%s.%s.tmp' % (file_name, uuid.uuid4().hex[:8])
+        with open(temp_file, 'w') as file_out:
+            json.dump({'key': key, 'record': record, 'time': time.time()}, file_out, default=str)
+        os.replace(temp_file, file_name)
+
+    def export_csv(self, dataset, out_dir, **read_args):
+        """Exports a dataset to the csv layout of the pipeline
+
+        A partitioned dataset is written as one ``<network>_<station>.csv``
+        per site, an unpartitioned one as ``<dataset>.csv``.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset.
+        out_dir : str
+            The directory of the csv files.
+        **read_args
+            The selection passed to ``read``.
+        Returns
+        -------
+        list
+            The paths of the csv files.
+        """
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        df = self.read(dataset, **read_args)
+        if not set(PARTITION_KEYS).issubset(df.columns):
+            file_name = os.path.join(out_dir, dataset + '.csv')
+            df.drop(columns=[name for name in PARTITION_KEYS if name in df]).to_csv(file_name)
+            return [file_name]
+        file_names = []
+        for (network, station), site_df in df.groupby(PARTITION_KEYS, sort=False):
+            file_name = os.path.join(out_dir, '%s_%s.csv' % (network, station))
+            site_df.drop(columns=PARTITION_KEYS).to_csv(file_name)
+            file_names.append(file_name)
+        return file_names
@@ -0,0 +1,197 @@
+"""Spatial index of the sites on the native pixel grid of a product"""
+
+import numpy as np
+import pandas as pd
+
+from TimeseriesExtractor import EASE_EPSG, EASE_GRIDS, EASE_ULX, EASE_ULY, PointGeometry
+
+SOURCE_EPSG = 4326  # the sites are located by longitude and latitude
+# the projections GEE names without an EPSG code
+KNOWN_CRS = {'SR-ORG:6974': '+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +R=6371007.181 +units=m +no_defs'}  # MODIS sinusoidal
+
+
+class PixelGrid:
+    """A regular grid of pixels in a projection
+
+    Parameters
+    ----------
+    crs : int or str
+        The EPSG code or the proj4 string of the projection.
+    cell_size : float
+        The pixel width, in the units of the projection.
+    ulx : float
+        The x of the upper left corner of the grid.
+    uly : float
+        The y of the upper left corner of the grid.
+    cell_height : float, optional
+        The pixel height. The default is None, square pixels.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, crs, cell_size, ulx, uly, cell_height=None):
+        self.crs = crs
+        self.cell_size = cell_size
+        self.cell_height = cell_size if cell_height is None else cell_height
+        self.ulx = ulx
+        self.uly = uly
+        self.point_geometry = None
+
+    @staticmethod
+    def from_band_info(band):
+        """Builds the grid of a GEE band from its ``crs`` and ``crs_transform``
+
+        Parameters
+        ----------
+        band : dict
+            A band of the ``getInfo`` of an image.
+        Returns
+        -------
+        PixelGrid
+            The native grid of the band.
+        """
+        crs = band['crs']
+        if crs in KNOWN_CRS:
+            crs = KNOWN_CRS[crs]
+        elif crs.upper().startswith('EPSG:'):
+            crs = int(crs.split(':')[1])
+        elif not crs.startswith('+proj'):  # the proj4 string of a local tile
+            raise ValueError('Unsupported projection %s' % crs)
+        transform = band['crs_transform']
+        return PixelGrid(crs, abs(transform[0]), transform[2], transform[5], abs(transform[4]))
+
+    @staticmethod
+    def ease(resolution='36km'):
+        """Returns the EASE 2.0 grid of the SMAP products"""
+        return PixelGrid(EASE_EPSG, EASE_GRIDS[resolution], EASE_ULX, EASE_ULY)
+
+    @staticmethod
+    def footprint(tolerance=10):
+        """Returns an equal area grid matching the sites closer than a tolerance in m
+
+        Products without a fixed grid (e.g. Sentinel-1 in the UTM zone of
+        each scene) are keyed on it, the default is the Sentinel-1 pixel.
+        """
+        return PixelGrid(EASE_EPSG, tolerance, EASE_ULX, EASE_ULY)
+
+    def project(self, lon, lat):
+        """Returns the projected x and y of points"""
+        if self.crs == SOURCE_EPSG:
+            return np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        if self.point_geometry is None:
+            self.point_geometry = PointGeometry(SOURCE_EPSG, self.crs)
+        return self.point_geometry.re_project_points(lon, lat)
+
+    def cells(self, lon, lat):
+        """Returns the row and column of the pixels holding points
+
+        Parameters
+        ----------
+        lon : array like
+            The longitudes.
+        lat : array like
+            The latitudes.
+        Returns
+        -------
+        tuple
+            The arrays of the rows and columns.
+        """
+        x, y = self.project(lon, lat)
+        column = np.floor((x - self.ulx) / self.cell_size).astype(np.int64)
+        row = np.floor((self.uly - y) / self.cell_height).astype(np.int64)
+        return row, column
+
+
+class PixelIndex:
+    """Groups the sites by the pixel of a product they fall in
+
+    Each pixel is extracted once, at the location of its first site, and
+    the result is shared by all its sites.
+
+    Parameters
+    ----------
+    sites : Pandas data frame
+        The sites, with an id, longitude and latitude column.
+    grid : PixelGrid
+        The native grid of the product.
+    id_column : str, optional
+        The column of the site ids. The default is 'site_id'.
+    lon_column : str, optional
+        The column of the longitudes. The default is 'lon'.
+    lat_column : str, optional
+        The column of the latitudes. The default is 'lat'.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, sites, grid, id_column='site_id', lon_column='lon', lat_column='lat'):
+        self.grid = grid
+        self.sites = sites
+        self.id_column = id_column
+        self.lon_column = lon_column
+        self.lat_column = lat_column
+        row, column = grid.cells(sites[lon_column].to_numpy(), sites[lat_column].to_numpy())
+        self.site_pixels = pd.Series(['r%dc%d' % cell for cell in zip(row, column)], index=sites[id_column].to_numpy(),
+                                     name='pixel')
+        first = ~self.site_pixels.duplicated().to_numpy()
+        self.pixels = sites[first].assign(pixel=self.site_pixels.to_numpy()[first])
+
+    @property
+    def n_sites(self):
+        return len(self.site_pixels)
+
+    @property
+    def n_pixels(self):
+        return len(self.pixels)
+
+    @property
+    def dedup_ratio(self):
+        """The number of sites per extracted pixel"""
+        return self.n_sites / self.n_pixels if self.n_pixels else 1.0
+
+    def subset(self, site_ids):
+        """Returns the index of some of the sites"""
+        sites = self.sites[self.sites[self.id_column].isin(list(site_ids))]
+        return PixelIndex(sites, self.grid, self.id_column, self.lon_column, self.lat_column)
+
+    def groups(self):
+        """Returns the site ids of each pixel"""
+        return {pixel: list(site_ids) for pixel, site_ids in
+                self.site_pixels.index.to_series().groupby(self.site_pixels.to_numpy(), sort=False)}
+
+    def fan_out(self, pixel_results):
+        """Shares the result of each pixel with its sites
+
+        Parameters
+        ----------
+        pixel_results : dict
+            The result of each pixel.
+        Returns
+        -------
+        dict
+            The result of each site id, the sites of a pixel share the
+            same object.
+        """
+        return {site_id: pixel_results[pixel] for site_id, pixel in self.site_pixels.items() if pixel in pixel_results}
+
+    def apply(self, function):
+        """Extracts the pixels and fans the results out to the sites
+
+        Parameters
+        ----------
+        function : function
+            Called with the ``pixels`` table (one site per pixel and a
+            ``pixel`` column), returns a dict of the result of each pixel.
+        Returns
+        -------
+        dict
+            The result of each site id.
+        """
+        return self.fan_out(function(self.pixels))
+
+    def report(self, label=''):
+        """Prints the number of sites, pixels and the dedup ratio"""
+        print('%s%d sites in %d pixels, dedup ratio %.2f' % (label + ': ' if label else '', self.n_sites,
+                                                               self.n_pixels, self.dedup_ratio))
@@ -0,0 +1,242 @@
+"""SMAP L3 (SPL3SMP) soil moisture extractor"""
+
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from SiteCube import Calendar, SiteCube
+from Tracer import init_worker_tracer, span, worker_tracer_args
+
+AM_GROUP = 'Soil_Moisture_Retrieval_Data_AM'
+PM_GROUP = 'Soil_Moisture_Retrieval_Data_PM'
+SOIL_MOISTURE_AM = AM_GROUP + '/soil_moisture'
+SOIL_MOISTURE_PM = PM_GROUP + '/soil_moisture_pm'  # the PM datasets carry a _pm suffix
+QUALITY_FLAG_AM = AM_GROUP + '/retrieval_qual_flag'
+QUALITY_FLAG_PM = PM_GROUP + '/retrieval_qual_flag_pm'
+BULK_DENSITY = AM_GROUP + '/bulk_density'
+FILL_VALUE = -9999
+
+
+def build_file_index(data_dir, pattern='*.h5'):
+    """Indexes the SMAP granules of a directory by date
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory of the raw SMAP granules.
+    pattern : str, optional
+        The file name pattern of the granules. The default is '*.h5'.
+    Returns
+    -------
+    dict
+        The granule path for each date, keyed by ``YYYYMMDD``.
+    """
+    file_index = {}
+    for h5_file in sorted(glob.glob(os.path.join(data_dir, pattern))):
+        date_match = re.search(r'\d{8}', os.path.basename(h5_file))
+        if date_match:
+            file_index.setdefault(date_match.group(), h5_file)  # keep the first version of a date
+    return file_index
+
+
+def read_granule(h5_file, variables, rows, columns):
+    """Reads the required cells of several variables from one granule
+
+    Only the rows holding the cells are read, limited to the column window
+    covering them.
+
+    Parameters
+    ----------
+    h5_file : str
+        The path of the granule.
+    variables : list
+        The ``group/dataset`` names of the variables.
+    rows : numpy array
+        The EASE grid rows of the cells.
+    columns : numpy array
+        The EASE grid columns of the cells.
+    Returns
+    -------
+    numpy array
+        A (cells x variables) float32 array, fill values are NaN.
+    """
+    unique_rows, row_pos = np.unique(rows, return_inverse=True)
+    col_start = columns.min()
+    col_end = columns.max() + 1
+    values = np.full((len(rows), len(variables)), np.nan, dtype=np.float32)
+    with span('smap.read_granule', granule=os.path.basename(h5_file)) as stage, h5py.File(h5_file, 'r') as ds:
+        for var_idx, variable in enumerate(variables):
+            dataset = ds[variable]
+            fill_value = dataset.attrs.get('_FillValue', FILL_VALUE)
+            if len(unique_rows) == unique_rows[-1] - unique_rows[0] + 1:  # contiguous rows, read the window
+                window = dataset[unique_rows[0]:unique_rows[-1] + 1, col_start:col_end]
+            else:
+                window = dataset[unique_rows, col_start:col_end]
+            cell_values = window[row_pos, columns - col_start]
+            values[:, var_idx] = np.where(cell_values == fill_value, np.nan, cell_values)
+            stage.add(bytes=window.nbytes)
+        stage.add(rows=len(rows))
+    return values
+
+
+class SMAPExtractor:
+    """SMAP L3 soil moisture extractor
+
+    Extracts several variables over a list of EASE 2.0 grid cells from the
+    daily SPL3SMP granules, opening each granule once.
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory of the raw SMAP granules.
+    cells : list
+        A list of (row, column) EASE grid cells.
+    variables : list
+        The ``group/dataset`` names of the variables, e.g.
+        ``SOIL_MOISTURE_AM`` or ``QUALITY_FLAG_PM``.
+    start_date : str
+        The start date for the time series.
+    end_date : str
+        The end date for the time series.
+    n_workers : int, optional
+        The number of granules read in parallel. The default is None,
+        the number of processors.
+    use_processes : bool, optional
+        Read the granules on a process pool, h5py serialises the reads of
+        a thread pool. The default is True.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, data_dir, cells, variables, start_date, end_date, n_workers=None, use_processes=True):
+        self.data_dir = data_dir
+        cells = np.asarray(cells, dtype=int).reshape(-1, 2)
+        self.rows = cells[:, 0]
+        self.columns = cells[:, 1]
+        self.variables = list(variables)
+        self.dates = pd.date_range(start=start_date, end=end_date, freq='d').rename('time')
+        self.n_workers = n_workers
+        self.use_processes = use_processes
+        self.file_index = build_file_index(data_dir)
+
+    def cell_names(self):
+        return ['r%sc%s' % (row, column) for row, column in zip(self.rows, self.columns)]
+
+    def required_files(self, dates=None):
+        """Selects the granules within the date range
+
+        Parameters
+        ----------
+        dates : Pandas DatetimeIndex, optional
+            The dates of the granules. The default is None, all the dates
+            of the extractor.
+        Returns
+        -------
+        list
+            (date position, granule path) pairs.
+        """
+        dates = self.dates if dates is None else dates
+        date_pos = {date: pos for pos, date in enumerate(dates.strftime('%Y%m%d'))}
+        return [(date_pos[date], h5_file) for date, h5_file in self.file_index.items() if date in date_pos]
+
+    def extract(self):
+        """Extracts all variables over all cells
+
+        Returns
+        -------
+        numpy array
+            A (dates x cells x variables) float32 array, NaN where no
+            granule or a fill value.
+        """
+        if not self.required_files() or not len(self.rows):
+            return self._extract(self.dates, None)
+        with self._pool() as executor:
+            return self._extract(self.dates, executor)
+
+    def extract_blocks(self, days=90):
+        """Extracts all variables over all cells, a block of days at a time
+
+        Only the array of one block is held, the memory does not grow
+        with the date range. The granules of all blocks are read by the
+        same pool.
+
+        Parameters
+        ----------
+        days : int, optional
+            The number of days of a block. The default is 90.
+        Yields
+        ------
+        dates : Pandas DatetimeIndex
+            The dates of the block.
+        values : numpy array
+            A (dates x cells x variables) float32 array of the block, as
+            returned by ``extract``.
+        """
+        with self._pool() as executor:
+            for start in range(0, len(self.dates), days):
+                dates = self.dates[start:start + days]
+                yield dates, self._extract(dates, executor)
+
+    def _pool(self):
+        # the workers of a process pool append their spans to the file of the default tracer, also when spawned
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.n_workers, initializer=init_worker_tracer,
+                                       initargs=worker_tracer_args())
+        return ThreadPoolExecutor(max_workers=self.n_workers)
+
+    def _extract(self, dates, executor):
+        values = np.full((len(dates), len(self.rows), len(self.variables)), np.nan, dtype=np.float32)
+        files = self.required_files(dates)
+        if not files or not len(self.rows):
+            return values
+        with span('smap.extract', granules=len(files)) as stage:
+            n_files = len(files)
+            granules = executor.map(read_granule, [h5_file for _, h5_file in files], [self.variables] * n_files,
+                                    [self.rows] * n_files, [self.columns] * n_files)
+            for (pos, _), granule in zip(files, granules):
+                values[pos] = granule
+            stage.add(rows=n_files * len(self.rows))
+        return values
+
+    def to_frames(self, values, dates=None):
+        """Converts the extracted array to one data frame per variable
+
+        Parameters
+        ----------
+        values : numpy array
+            The array returned by ``extract``, or a block of
+            ``extract_blocks``.
+        dates : Pandas DatetimeIndex, optional
+            The dates of a block. The default is None, all the dates of the
+            extractor.
+        Returns
+        -------
+        dict
+            A data frame for each variable. The columns are the cells
+            (``r<row>c<column>``) and the index is the dates.
+        """
+        dates = self.dates if dates is None else dates
+        return {variable: pd.DataFrame(values[:, :, var_idx], index=dates, columns=self.cell_names())
+                for var_idx, variable in enumerate(self.variables)}
+
+    def to_cube(self, values):
+        """Converts the extracted array to a cube of the cells
+
+        Parameters
+        ----------
+        values : numpy array
+            The array returned by ``extract``.
+        Returns
+        -------
+        SiteCube
+            The cube, the sites are the cells (``r<row>c<column>``) and the
+            variables the ``group/dataset`` names.
+        """
+        calendar = Calendar.cached(self.dates[0], self.dates[-1])
+        return SiteCube(calendar, self.cell_names(), self.variables, np.ascontiguousarray(values.transpose(2, 1, 0)))
@@ -0,0 +1,277 @@
+"""Dense site x day x variable array of the daily time series"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from TimeseriesExtractor import DateTool
+
+DATE_COLUMNS = ['Excel_day', 'DoY']
+_calendars = {}
+
+
+class Calendar:
+    """Daily day axis shared by all the sources of a date range
+
+    The dates, Excel days and days of year are computed once, a date is
+    located by its integer day offset from the start.
+
+    Parameters
+    ----------
+    start_date : str
+        The first day.
+    end_date : str
+        The last day.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, start_date, end_date):
+        start_date, end_date = _day_string(start_date), _day_string(end_date)
+        self.dates = pd.date_range(start=start_date, end=end_date, freq='d').rename('time')
+        self.start = self.dates[0]
+        self.date_df = DateTool(self.dates).get_all_date_df()
+        self.excel_day = self.date_df['Excel_day'].to_numpy()
+        self.doy = self.date_df['DoY'].to_numpy()
+
+    @staticmethod
+    def cached(start_date, end_date):
+        """Returns the calendar of a date range, built once per session"""
+        key = (_day_string(start_date), _day_string(end_date))
+        if key not in _calendars:
+            _calendars[key] = Calendar(start_date, end_date)
+        return _calendars[key]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def day_index(self, dates):
+        """Returns the day offsets of dates, -1 for the dates out of the calendar
+
+        Parameters
+        ----------
+        dates : array like
+            The dates.
+        Returns
+        -------
+        numpy array
+            The integer day offsets.
+        """
+        days = (np.asarray(dates, dtype='datetime64[D]') - self.start.to_datetime64().astype('datetime64[D]'))
+        days = days.astype(np.int64)
+        days[(days < 0) | (days >= len(self.dates))] = -1
+        return days
+
+    def day_slice(self, start_date=None, end_date=None):
+        """Returns the slice of the days of a date range"""
+        start = 0 if start_date is None else max(int((pd.Timestamp(start_date) - self.start).days), 0)
+        end = len(self.dates) if end_date is None else int((pd.Timestamp(end_date) - self.start).days) + 1
+        return slice(start, max(min(end, len(self.dates)), start))
+
+
+class SiteCube:
+    """Daily values of several variables over many sites in one float32 array
+
+    The values are stored as ``(variables, sites, days)``, so a variable
+    plane is contiguous and selecting sites or a date range is a view.
+    Joining sources on the dates becomes indexing on the shared calendar.
+
+    Parameters
+    ----------
+    calendar : Calendar
+        The day axis.
+    sites : list
+        The site names.
+    variables : list
+        The variable names.
+    values : numpy array, optional
+        The ``(variables, sites, days)`` values. The default is None, all
+        NaN.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, calendar, sites, variables, values=None):
+        self.calendar = calendar
+        self.sites = list(sites)
+        self.variables = list(variables)
+        if values is None:
+            values = np.full((len(self.variables), len(self.sites), len(calendar)), np.nan, dtype=np.float32)
+        self.values = values
+        self.site_pos = {site: pos for pos, site in enumerate(self.sites)}
+        self.var_pos = {variable: pos for pos, variable in enumerate(self.variables)}
+
+    @property
+    def dates(self):
+        return self.calendar.dates
+
+    def plane(self, variable):
+        """Returns the (sites x days) values of a variable"""
+        return self.values[self.var_pos[variable]]
+
+    def site_index(self, sites):
+        """Returns the positions of sites on the site axis"""
+        return np.array([self.site_pos[site] for site in sites], dtype=np.int64)
+
+    def select(self, sites=None, start_date=None, end_date=None, variables=None):
+        """Selects sites, a date range and variables
+
+        A date range is a view of the values, sites and variables are
+        copied unless they are contiguous.
+
+        Returns
+        -------
+        SiteCube
+            The selected cube.
+        """
+        days = self.calendar.day_slice(start_date, end_date)
+        calendar = self.calendar
+        if days != slice(0, len(calendar)):
+            calendar = Calendar.cached(calendar.dates[days.start], calendar.dates[days.stop - 1])
+        values = self.values[:, :, days]
+        if sites is not None:
+            values = values[:, _contiguous(self.site_index(sites))]
+        if variables is not None:
+            values = values[_contiguous(np.array([self.var_pos[variable] for variable in variables]))]
+        return SiteCube(calendar, self.sites if sites is None else sites,
+                        self.variables if variables is None else variables, values)
+
+    def set_frame(self, site, df, variables=None):
+        """Writes the daily values of a data frame to a site
+
+        Parameters
+        ----------
+        site : str
+            The site name.
+        df : Pandas data frame
+            The values, indexed by the dates. Dates out of the calendar
+            are dropped.
+        variables : list, optional
+            The columns to write. The default is None, all the columns
+            that are variables of the cube.
+        Returns
+        -------
+        None.
+        """
+        if variables is None:
+            variables = [column for column in df.columns if column in self.var_pos]
+        days = self.calendar.day_index(df.index)
+        inside = days >= 0
+        site_pos = self.site_pos[site]
+        for variable in variables:
+            column = pd.to_numeric(df[variable], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            self.values[self.var_pos[variable], site_pos, days[inside]] = column[inside]
+
+    @classmethod
+    def from_frames(cls, frames, variables=None, calendar=None):
+        """Builds a cube from the data frame of each site
+
+        Parameters
+        ----------
+        frames : dict
+            The data frame of each site, indexed by the dates.
+        variables : list, optional
+            The variables. The default is None, all the columns of the
+            frames but the Excel day and day of year.
+        calendar : Calendar, optional
+            The day axis. The default is None, the dates of the frames.
+        Returns
+        -------
+        SiteCube
+            The cube.
+        """
+        if variables is None:
+            variables = []
+            for df in frames.values():
+                variables.extend(column for column in df.columns
+                                 if column not in DATE_COLUMNS and column not in variables)
+        if calendar is None:
+            starts = [df.index.min() for df in frames.values() if len(df)]
+            ends = [df.index.max() for df in frames.values() if len(df)]
+            calendar = Calendar.cached(min(starts), max(ends))
+        cube = cls(calendar, list(frames), variables)
+        for site, df in frames.items():
+            cube.set_frame(site, df, [variable for variable in variables if variable in df.columns])
+        return cube
+
+    def to_frame(self, site, date_columns=True, dropna=False):
+        """Converts the values of a site to a data frame
+
+        Parameters
+        ----------
+        site : str
+            The site name.
+        date_columns : bool, optional
+            Include the Excel day and day of year. The default is True.
+        dropna : bool, optional
+            Drop the days without any value. The default is False.
+        Returns
+        -------
+        Pandas data frame
+            The variables (float64) indexed by the dates.
+        """
+        values = self.values[:, self.site_pos[site]].T.astype(np.float64)
+        df = pd.DataFrame(values, index=self.dates, columns=self.variables)
+        if dropna:
+            df = df[~np.isnan(values).all(axis=1)]
+        if date_columns:
+            df = pd.concat([self.calendar.date_df.loc[df.index], df], axis=1)
+        return df
+
+    def to_frames(self, **frame_args):
+        """Converts the cube to one data frame per site, see ``to_frame``"""
+        return {site: self.to_frame(site, **frame_args) for site in self.sites}
+
+    def save(self, dir_name):
+        """Saves the cube as ``values.npy`` and ``cube.json`` in a directory
+
+        Returns
+        -------
+        None.
+        """
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        temp_file = os.path.join(dir_name, 'values.tmp.npy')
+        np.save(temp_file, np.ascontiguousarray(self.values))
+        os.replace(temp_file, os.path.join(dir_name, 'values.npy'))
+        meta = {'start_date': _day_string(self.dates[0]), 'end_date': _day_string(self.dates[-1]),
+                'sites': self.sites, 'variables': self.variables}
+        with open(os.path.join(dir_name, 'cube.json'), 'w') as file_out:
+            json.dump(meta, file_out)
+
+    @classmethod
+    def load(cls, dir_name, mmap_mode='r'):
+        """Loads a saved cube, memory mapped by default
+
+        Parameters
+        ----------
+        dir_name : str
+            The directory of the cube.
+        mmap_mode : str, optional
+            The ``numpy.load`` memory map mode, None reads the values in
+            memory. The default is 'r'.
+        Returns
+        -------
+        SiteCube
+            The cube.
+        """
+        with open(os.path.join(dir_name, 'cube.json')) as file_in:
+            meta = json.load(file_in)
+        values = np.load(os.path.join(dir_name, 'values.npy'), mmap_mode=mmap_mode)
+        return cls(Calendar.cached(meta['start_date'], meta['end_date']), meta['sites'], meta['variables'], values)
+
+
+def _day_string(date):
+    # dates, timestamps and strings of the same day share one calendar
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+def _contiguous(positions):
+    # a run of consecutive positions is selected as a slice, which keeps the view
+    if len(positions) and np.all(np.diff(positions) == 1):
+        return slice(positions[0], positions[-1] + 1)
+    return positions
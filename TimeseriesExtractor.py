@@ -4,7 +4,10 @@ import ee
 import numpy as np
 import os
 import pandas as pd
+import threading
 from osgeo import osr
+from GeeRequestExecutor import default_executor
+from Tracer import span
 
 os.environ['HTTP_PROXY'] = 'http://127.0.0.1:41091'
 os.environ['HTTPS_PROXY'] = 'http://127.0.0.1:41091'
@@ -14,6 +17,15 @@ set https_proxy=http://127.0.0.1:41091
 earthengine authenticate
 '''
 
+# The projection bounds and grid size of EASE 2.0 used in SMAP products, https://nsidc.org/ease/ease-grid-projection-gt
+EASE_EPSG = 6933
+EASE_ULX = -17367530.44516138
+EASE_ULY = 7314540.830638545
+EASE_GRIDS = {'36km': 36032.220840584,  # cell size in m of the global EASE 2.0 grids, 964 x 406 for 36 km
+              '9km': 9008.055210146,
+              '3km': 3002.6850700487,
+              '1km': 1000.89502334956}
+
 
 class PointGeometry:
     # used for reprojection, build point with rectangle buffer
@@ -21,8 +33,9 @@ class PointGeometry:
         self.source_EPSG = source_EPSG
         self.target_proj = target_proj
         self.transform = self.build_geo_transform()
+        self.inverse_transform = None
 
-    def build_geo_transform(self):
+    def build_geo_transform(self, inverse=False):
         source = osr.SpatialReference()
         source.ImportFromEPSG(self.source_EPSG)
         target = osr.SpatialReference()
@@ -30,6 +43,8 @@ class PointGeometry:
             target.ImportFromEPSG(self.target_proj)
         else:
             target.ImportFromProj4(self.target_proj)
+        if inverse:
+            return osr.CoordinateTransformation(target, source)
         return osr.CoordinateTransformation(source, target)
 
     def create_point_geo(self, x, y, buffer):
@@ -56,6 +71,86 @@ class PointGeometry:
         location = self.transform.TransformPoint(y, x)
         return location
 
+    def re_project_points(self, x, y):
+        """
+        :param x: array of Longitude or x
+        :param y: array of Latitude or y
+        :return: arrays of the projected x and y, all points are transformed in one call
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        if len(x) == 0:
+            return np.empty(0), np.empty(0)
+        with span('geometry.reproject', target=self.target_proj) as stage:
+            locations = np.asarray(self.transform.TransformPoints(np.column_stack([y, x])))
+            stage.add(rows=len(x))
+        return locations[:, 0], locations[:, 1]
+
+    def inverse_project_points(self, x, y):
+        """
+        :param x: array of the projected x
+        :param y: array of the projected y
+        :return: arrays of Longitude (or x) and Latitude (or y) in the source projection
+        """
+        if self.inverse_transform is None:
+            self.inverse_transform = self.build_geo_transform(inverse=True)
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        if len(x) == 0:
+            return np.empty(0), np.empty(0)
+        with span('geometry.inverse_reproject', target=self.target_proj) as stage:
+            locations = np.asarray(self.inverse_transform.TransformPoints(np.column_stack([x, y])))
+            stage.add(rows=len(x))
+        return locations[:, 1], locations[:, 0]
+
+    def ease_grid_cells(self, x, y, resolution='36km'):
+        """
+        :param x: array of Longitude
+        :param y: array of Latitude
+        :param resolution: the EASE 2.0 grid, '36km', '9km', '3km' or '1km'
+        :return: arrays of the row and column of the EASE 2.0 cells holding the points
+        """
+        if self.target_proj != EASE_EPSG:
+            print('Error: ease_grid_cells requires the target EPSG %s' % EASE_EPSG)
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        cell_size = EASE_GRIDS[resolution]
+        ease_x, ease_y = self.re_project_points(x, y)
+        column = np.floor((ease_x - EASE_ULX) / cell_size).astype(int)
+        row = np.floor((EASE_ULY - ease_y) / cell_size).astype(int)
+        return row, column
+
+    def ease_cell_centers(self, row, column, resolution='36km'):
+        """
+        :param row: array of EASE 2.0 rows
+        :param column: array of EASE 2.0 columns
+        :param resolution: the EASE 2.0 grid, '36km', '9km', '3km' or '1km'
+        :return: arrays of the Longitude and Latitude of the cell centres
+        """
+        if self.target_proj != EASE_EPSG:
+            print('Error: ease_cell_centers requires the target EPSG %s' % EASE_EPSG)
+            return np.empty(0), np.empty(0)
+        cell_size = EASE_GRIDS[resolution]
+        ease_x = EASE_ULX + (np.asarray(column) + 0.5) * cell_size
+        ease_y = EASE_ULY - (np.asarray(row) + 0.5) * cell_size
+        return self.inverse_project_points(ease_x, ease_y)
+
+    def create_point_geos(self, x, y, buffer):
+        """
+        :param buffer: buffer of the points
+        :param x: array of Longitude or x
+        :param y: array of Latitude or y
+        :return: list of GEE point geometries
+        """
+        if type(self.target_proj) == int:
+            location_x, location_y = self.re_project_points(x, y)
+            proj = 'EPSG:' + str(self.target_proj)
+            gee_point_geometries = [ee.Geometry.Point([loc_x, loc_y], proj).buffer(buffer)
+                                    for loc_x, loc_y in zip(location_x, location_y)]
+        else:
+            print('Error: Create_point_geo only support EPSG')
+            gee_point_geometries = []
+        return gee_point_geometries
+
     def create_polygon_geo(self, x, y, buffer):
         """
         :param buffer: buffer of a point
@@ -80,6 +175,520 @@ class PointGeometry:
         return gee_polygon_geometry
 
 
+MAX_FEATURES = 5000  # Earth Engine aborts collection queries accumulating more elements than this
+
+
+def sites_feature_collection(sites, id_column='site_id', lon_column='lon', lat_column='lat', buffer=0):
+    """Builds a GEE FeatureCollection of site points tagged with the site id
+
+    Parameters
+    ----------
+    sites : Pandas data frame
+        A table of sites with an id, longitude and latitude column.
+    id_column : str, optional
+        The column of the site ids. The default is 'site_id'.
+    lon_column : str, optional
+        The column of the longitudes. The default is 'lon'.
+    lat_column : str, optional
+        The column of the latitudes. The default is 'lat'.
+    buffer : float, optional
+        The buffer of the points in m. The default is 0, no buffer.
+    Returns
+    -------
+    ee.FeatureCollection
+        The site features with a ``site_id`` property.
+    """
+    features = []
+    for site_id, lon, lat in zip(sites[id_column].tolist(), sites[lon_column].tolist(), sites[lat_column].tolist()):
+        geometry = ee.Geometry.Point([lon, lat])
+        if buffer:
+            geometry = geometry.buffer(buffer)
+        features.append(ee.Feature(geometry, {'site_id': site_id}))
+    return ee.FeatureCollection(features)
+
+
+def sample_collection(collection, sites_fc, reducer, scale, projection, not_null=None):
+    """Samples every image of a collection over all sites on the server side
+
+    Parameters
+    ----------
+    collection : ee.ImageCollection
+        The collection to sample.
+    sites_fc : ee.FeatureCollection
+        The site features built by ``sites_feature_collection``.
+    reducer : ee.Reducer
+        The reducer applied over each site geometry, e.g.
+        ``ee.Reducer.first()`` for points. It is applied to each band, the
+        reduced values are named after the bands also for a single band.
+    scale : float
+        The scale of the extract.
+    projection : str or ee.Projection
+        The projection of the extract.
+    not_null : list, optional
+        Drop the rows without a value in these bands on the server side,
+        i.e. the sites an image does not cover. The default is None.
+    Returns
+    -------
+    ee.FeatureCollection
+        One feature without geometry per image and site holding the
+        ``site_id``, the image ``id``, its ``time`` in ms and the bands.
+    """
+    def sample_image(image):
+        # a single band would otherwise be named after the reducer, e.g. 'first'
+        samples = image.reduceRegions(collection=sites_fc, reducer=reducer.forEachBand(image), scale=scale,
+                                      crs=projection)
+        return samples.map(lambda feature: ee.Feature(None, feature.toDictionary()).set(
+            {'time': image.get('system:time_start'), 'id': image.get('system:index')}))
+    samples = collection.filterBounds(sites_fc.geometry()).map(sample_image).flatten()
+    if not_null is not None:
+        samples = samples.filter(ee.Filter.notNull(not_null))
+    return samples
+
+
+def _is_payload_error(error):
+    message = str(error).lower()
+    return any(text in message for text in ('too many', 'too large', 'exceeded', 'limit', 'accumulating', 'payload'))
+
+
+def download_in_chunks(sites, request_chunk, max_rows=MAX_FEATURES, chunk_size=50, executor=None):
+    """Downloads the sites in chunks sized to stay under the payload limit
+
+    The first chunk is requested alone and the number of rows per site it
+    returns sets the size of the other chunks, which are requested
+    concurrently. A chunk exceeding the limit is split in halves.
+
+    Parameters
+    ----------
+    sites : Pandas data frame
+        The table of sites.
+    request_chunk : function
+        Downloads a chunk of the sites table and returns a list of row
+        dictionaries.
+    max_rows : int, optional
+        The maximum rows returned by one request. The default is
+        ``MAX_FEATURES``.
+    chunk_size : int, optional
+        The number of sites in the first request. The default is 50.
+    executor : GeeRequestExecutor, optional
+        The executor running the chunks. The default is the shared one.
+    Returns
+    -------
+    Pandas data frame
+        The rows of all chunks.
+    """
+    if executor is None:
+        executor = default_executor()
+
+    def request_split(chunk):
+        try:
+            return request_chunk(chunk)
+        except ee.EEException as error:
+            if len(chunk) > 1 and _is_payload_error(error):
+                half = len(chunk) // 2
+                return request_split(chunk.iloc[:half]) + request_split(chunk.iloc[half:])
+            raise
+
+    if len(sites) == 0:
+        return pd.DataFrame()
+    first_chunk = sites.iloc[:chunk_size]
+    rows = request_split(first_chunk)
+    rows_per_site = max(len(rows) / len(first_chunk), 1)
+    chunk_size = max(1, int(0.8 * max_rows / rows_per_site))
+    remaining = sites.iloc[len(first_chunk):]
+    chunks = [remaining.iloc[start:start + chunk_size] for start in range(0, len(remaining), chunk_size)]
+    for chunk_rows in executor.map(request_split, chunks):
+        rows.extend(chunk_rows)
+    return pd.DataFrame(rows)
+
+
+def split_sites(data_df, site_ids, columns, bands=None):
+    """Splits the rows of a batch download by site
+
+    Parameters
+    ----------
+    data_df : Pandas data frame
+        The rows of the batch download with a ``site_id`` column.
+    site_ids : list
+        The ids of all requested sites.
+    columns : list
+        The columns kept for each site.
+    bands : list, optional
+        Drop the rows without a value in any of these bands, i.e. images
+        not covering the site. The default is None, all rows are kept.
+    Returns
+    -------
+    dict
+        A data frame of the rows for each site id, empty where the site
+        has no data.
+    """
+    if len(data_df) == 0:
+        data_df = pd.DataFrame(columns=['site_id'] + columns)
+    for column in columns:
+        if column not in data_df:
+            data_df[column] = np.nan  # the band is masked over all sites
+    if bands is not None:
+        data_df = data_df.dropna(subset=bands, how='all')
+    groups = {site_id: group for site_id, group in data_df.groupby('site_id', sort=False)}
+    empty = data_df.iloc[:0]
+    return {site_id: groups.get(site_id, empty)[columns].reset_index(drop=True) for site_id in site_ids}
+
+
+ORBIT_PASSES = ['ASCENDING', 'DESCENDING']  # the orbit_pass codes 0 and 1
+_band_info_memo = {}
+_band_info_lock = threading.Lock()
+
+
+def collection_band_info(product, bands, executor):
+    """Returns the band information of a GEE collection, fetched once per session
+
+    The data type and scale of the bands are the same for all images of a
+    collection, so the first image of the product is used for all
+    extractors and sites.
+
+    Parameters
+    ----------
+    product : str
+        The Google Earth Engine product name.
+    bands : list
+        A list of the band names.
+    executor : GeeRequestExecutor
+        The executor of the request.
+    Returns
+    -------
+    list
+        The ``bands`` information of the image.
+    """
+    key = (product, tuple(bands))
+    with _band_info_lock:
+        if key in _band_info_memo:
+            return _band_info_memo[key]
+    image_info = executor.get_info(ee.ImageCollection(product).select(bands).first(), 'band_info')
+    with _band_info_lock:
+        _band_info_memo[key] = image_info['bands']
+    return image_info['bands']
+
+
+DB_BANDS = ['VV', 'VH', 'HH', 'HV']  # the Sentinel-1 backscatter bands, in dB
+FOOTPRINT_REDUCERS = ['mean', 'median', 'linear_mean']  # linear_mean averages the backscatter in linear power
+
+
+def db_to_linear(values):
+    return 10 ** (np.asarray(values, dtype=np.float64) / 10)
+
+
+def linear_to_db(values):
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(values > 0, 10 * np.log10(values), np.nan)
+
+
+def linear_image(image, bands):
+    """Replaces dB bands of a GEE image by their linear power"""
+    linear = ee.Image.constant(10).pow(image.select(bands).divide(10)).rename(bands)
+    return image.addBands(linear, None, True)
+
+
+def network_site_id(site_name, network=None):
+    """Returns the ``<network>_<station>`` id of a site, the station without a network"""
+    return site_name if network is None else '%s_%s' % (network, site_name)
+
+
+def location_geometry(location):
+    """Returns the GEE geometry of a (lon, lat) or (lon, lat, buffer) location, GEE geometries are kept"""
+    if not isinstance(location, (tuple, list)):
+        return location
+    geometry = ee.Geometry.Point(list(location[:2]))
+    return geometry.buffer(location[2]) if len(location) > 2 and location[2] else geometry
+
+
+class CollectionQuery:
+    """The images of a product an extract reads, for any backend
+
+    Parameters
+    ----------
+    product : str
+        The Google Earth Engine product name.
+    bands : list
+        A list of the band names required.
+    start_date : str
+        The start of the extract window.
+    end_date : str
+        The end of the extract window, excluded.
+    properties : dict, optional
+        The value of the image properties to keep, e.g.
+        ``{'instrumentMode': 'IW'}``. The default is None.
+    property_bands : dict, optional
+        The bands coding an image property as the position of its value
+        in a list, ``{band: (property, values)}``. The default is None.
+    collection : function, optional
+        Returns the filtered ``ee.ImageCollection``, only called by the
+        GEE backend. The default is None.
+    linear_bands : list, optional
+        The dB bands the reductions average in linear power, the reduced
+        values are returned in dB. The raw pixels are not converted. The
+        default is None.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, product, bands, start_date, end_date, properties=None, property_bands=None, collection=None,
+                 linear_bands=None):
+        self.product = product
+        self.bands = list(bands)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.properties = properties or {}
+        self.property_bands = property_bands or {}
+        self.collection = collection
+        self.linear_bands = list(linear_bands or [])
+
+
+class GeeBackend:
+    """Reads the images of a query with Google Earth Engine requests
+
+    The backend of the extractors by default. Another backend (e.g.
+    ``LocalRaster.LocalRasterBackend``) implements the same ``band_info``,
+    ``native_projection``, ``size``, ``region``, ``reduce_region`` and
+    ``sample`` methods, returning the same rows.
+
+    Parameters
+    ----------
+    executor : GeeRequestExecutor, optional
+        The executor the GEE requests are sent through. The default is
+        the executor shared by all extractors.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor if executor is not None else default_executor()
+
+    def band_info(self, product, bands):
+        """Returns the ``bands`` information of the first image of a product"""
+        return collection_band_info(product, bands, self.executor)
+
+    def native_projection(self, query):
+        """Returns the projection of the first image of a query, e.g. the UTM zone of the scenes over a location
+
+        A server side ``ee.Projection`` passed on to ``getRegion`` and
+        ``reduceRegions``, no request is sent.
+        """
+        return query.collection().first().select(0).projection()
+
+    def size(self, query):
+        """Returns the number of images of a query"""
+        return self.executor.get_info(query.collection().size(), 'size')
+
+    def region(self, query, location, scale, projection):
+        """Returns the pixels of all images over a location
+
+        Parameters
+        ----------
+        query : CollectionQuery
+            The images.
+        location : ee.Geometry or tuple
+            The geometry, or the (lon, lat) or (lon, lat, buffer in m) of
+            the location.
+        scale : float
+            The scale of the extract.
+        projection : str or ee.Projection
+            The projection of the extract.
+        Returns
+        -------
+        data_df : Pandas data frame
+            The ``id``, ``longitude``, ``latitude``, ``time`` and band
+            values of the pixels, as returned by ``getRegion``.
+        """
+        data = self.executor.get_info(query.collection().getRegion(location_geometry(location), scale, projection),
+                                      query.product)
+        return pd.DataFrame(data[1:], columns=data[0])
+
+    def _collection(self, query):
+        collection = query.collection()
+        if query.linear_bands:
+            collection = collection.map(lambda image: linear_image(image, query.linear_bands))
+        return collection
+
+    def _rows(self, query, samples):
+        rows = pd.DataFrame([feature['properties'] for feature in self.executor.get_info(samples, query.product)
+                             ['features']])
+        for band in query.linear_bands:
+            if band in rows:
+                rows[band] = linear_to_db(rows[band].astype(float))
+        return rows
+
+    def reduce_region(self, query, location, reducer='mean', scale=None, projection=None):
+        """Reduces each image over a location on the server side
+
+        Only one row per image is returned instead of the pixels of
+        ``region``.
+
+        Parameters
+        ----------
+        query : CollectionQuery
+            The images.
+        location : ee.Geometry or tuple
+            The geometry, or the (lon, lat) or (lon, lat, buffer in m) of
+            the location.
+        reducer : str, optional
+            The ``ee.Reducer`` over the location, 'mean', 'median' or
+            'first'. The default is 'mean'.
+        scale : float, optional
+            The scale of the extract. The default is None.
+        projection : str or ee.Projection, optional
+            The projection of the extract. The default is None.
+        Returns
+        -------
+        Pandas data frame
+            The ``id``, ``time`` in ms and the bands of the images with a
+            value over the location.
+        """
+        location_fc = ee.FeatureCollection([ee.Feature(location_geometry(location), {'site_id': 0})])
+        samples = sample_collection(self._collection(query), location_fc, getattr(ee.Reducer, reducer)(), scale,
+                                    projection, query.bands)
+        rows = self._rows(query, samples)
+        columns = ['id', 'time'] + query.bands + list(query.property_bands)
+        return rows.reindex(columns=columns) if len(rows) else pd.DataFrame(columns=columns)
+
+    def sample(self, query, sites, id_column='site_id', lon_column='lon', lat_column='lat', buffer=0,
+               reducer='first', scale=None, projection=None, not_null=None, max_rows=MAX_FEATURES, chunk_size=50):
+        """Reduces all images over many sites in chunked requests
+
+        Parameters
+        ----------
+        query : CollectionQuery
+            The images.
+        sites : Pandas data frame
+            A table of sites with an id, longitude and latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        lon_column : str, optional
+            The column of the longitudes. The default is 'lon'.
+        lat_column : str, optional
+            The column of the latitudes. The default is 'lat'.
+        buffer : float, optional
+            The buffer of the points in m. The default is 0.
+        reducer : str, optional
+            The ``ee.Reducer`` over each site, 'first', 'mean' or 'median'.
+            The default is 'first'.
+        scale : float, optional
+            The scale of the extract. The default is None.
+        projection : str, optional
+            The projection of the extract. The default is None.
+        not_null : list, optional
+            Drop the rows without a value in these bands. The default is
+            None.
+        max_rows : int, optional
+            The maximum rows returned by one request. The default is
+            ``MAX_FEATURES``.
+        chunk_size : int, optional
+            The number of sites in the first request. The default is 50.
+        Returns
+        -------
+        Pandas data frame
+            One row per image and site with the ``site_id``, the image
+            ``id``, its ``time`` in ms and the bands.
+        """
+        def request_chunk(chunk):
+            sites_fc = sites_feature_collection(chunk, id_column, lon_column, lat_column, buffer)
+            samples = sample_collection(self._collection(query), sites_fc, getattr(ee.Reducer, reducer)(), scale,
+                                        projection, not_null)
+            return self._rows(query, samples).to_dict('records')
+
+        return download_in_chunks(sites, request_chunk, max_rows, chunk_size, self.executor)
+
+
+S1_ORBIT_OFFSETS = {'A': 73, 'B': 27}  # absolute orbit of relative orbit 1, per platform
+S1_ORBIT_CYCLE = 175  # orbits of the 12 day repeat cycle of each platform
+
+
+def decode_s1_ids(ids):
+    """Decodes Sentinel-1 scene ids with array operations
+
+    ``S1A_IW_GRDH_1SDV_<start>_<stop>_<absolute orbit>_<datatake>_<id>``.
+    The ids share one fixed-width layout, so the fields are read from a
+    (ids x characters) byte array at once.
+
+    Parameters
+    ----------
+    ids : array like
+        The scene ids.
+    Returns
+    -------
+    Pandas data frame
+        The ``platform`` (0 Sentinel-1A, -1 Sentinel-1B), ``absolute_orbit``,
+        ``relative_orbit`` and acquisition start ``time`` of each id.
+    """
+    ids = np.asarray(ids, dtype=bytes)
+    if len(ids) == 0:
+        return pd.DataFrame({'platform': np.empty(0, np.int8), 'absolute_orbit': np.empty(0, np.int32),
+                             'relative_orbit': np.empty(0, np.int16), 'time': np.empty(0, 'datetime64[s]')})
+    fields = ids[0].split(b'_')
+    starts = np.cumsum([0] + [len(field) + 1 for field in fields])  # the offset of each field
+    chars = ids.view(np.uint8).reshape(len(ids), -1)
+    if chars.shape[1] != starts[-1] - 1 or not (chars[:, starts[1:-1] - 1] == ord('_')).all():
+        raise ValueError('The Sentinel-1 ids do not share one layout')
+
+    def number(field, first=0, width=None):
+        width = len(fields[field]) - first if width is None else width
+        digits = chars[:, starts[field] + first:starts[field] + first + width].astype(np.int64) - ord('0')
+        return digits @ 10 ** np.arange(width - 1, -1, -1)
+
+    is_a = chars[:, 2] == ord('A')
+    absolute_orbit = number(6).astype(np.int32)
+    offset = np.where(is_a, S1_ORBIT_OFFSETS['A'], S1_ORBIT_OFFSETS['B'])
+    months = (number(4, 0, 4) - 1970) * 12 + number(4, 4, 2) - 1  # the start is YYYYMMDDTHHMMSS
+    time = (months.astype('datetime64[M]').astype('datetime64[D]') + (number(4, 6, 2) - 1)).astype('datetime64[s]')
+    time = time + number(4, 9, 2) * 3600 + number(4, 11, 2) * 60 + number(4, 13, 2)
+    return pd.DataFrame({'platform': np.where(is_a, 0, -1).astype(np.int8),
+                         'absolute_orbit': absolute_orbit,
+                         'relative_orbit': ((absolute_orbit - offset) % S1_ORBIT_CYCLE + 1).astype(np.int16),
+                         'time': time})
+
+
+class OrbitGroups:
+    """Index of the acquisitions of a site by relative orbit
+
+    The positions are sorted once by orbit, so the acquisitions of an
+    orbit are a slice of them instead of a groupby.
+
+    Parameters
+    ----------
+    relative_orbit : array like
+        The relative orbit of each acquisition, in the order of the rows
+        of the site data.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, relative_orbit):
+        relative_orbit = np.asarray(relative_orbit)
+        self.order = np.argsort(relative_orbit, kind='stable')  # the dates stay sorted within an orbit
+        self.orbits, starts = np.unique(relative_orbit[self.order], return_index=True)
+        self.offsets = np.append(starts, len(relative_orbit))
+        self.orbit_pos = {orbit: pos for pos, orbit in enumerate(self.orbits.tolist())}
+
+    def positions(self, orbit):
+        """Returns the row positions of the acquisitions of an orbit"""
+        pos = self.orbit_pos.get(orbit)
+        if pos is None:
+            return self.order[:0]
+        return self.order[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def groups(self):
+        """Returns the row positions of each orbit"""
+        return {orbit: self.order[self.offsets[pos]:self.offsets[pos + 1]] for orbit, pos in self.orbit_pos.items()}
+
+
+def add_orbit_pass_band(image):
+    """Adds the orbit pass code (0 ascending, 1 descending) of a Sentinel-1 image as a band"""
+    orbit_pass = ee.List(ORBIT_PASSES).indexOf(image.get('orbitProperties_pass'))
+    return image.addBands(ee.Image.constant(orbit_pass).rename('orbit_pass').toByte())
+
+
 class GeeS1TimeseriesExtractor:
     """Google Earth Engine Time Series Extractor class
 
@@ -93,18 +702,48 @@ class GeeS1TimeseriesExtractor:
         The start date for the time series.
     end_date : str
         The end date for the time series.
+    point_geometry : ee.Geometry or tuple
+        The location of the extract, or its (lon, lat, buffer in m) as
+        required by a local backend. None when the extractor is only used
+        for ``download_data_batch``.
+    orbit_properties_pass : str, optional
+        'ASCENDING' or 'DESCENDING', the default. None extracts both
+        passes in one request, see ``download_passes``.
     interpolate : str or bool, optional
         DESCRIPTION. The default is True. True for NDVI, False for Sentinel-1
     dir_name : str
         The directory where the extracted files will be stored. The
         default is ''.
+    executor : GeeRequestExecutor, optional
+        The executor the GEE requests are sent through. The default is
+        the executor shared by all extractors.
+    store : PipelineStore, optional
+        The store the extracts are saved to instead of the csv files of
+        ``dir_name``. The default is None.
+    backend : GeeBackend or LocalRasterBackend, optional
+        The source of the images. The default is None, GEE requests sent
+        through ``executor``.
+    footprint_reducer : str, optional
+        'mean', 'median' or 'linear_mean' (the mean of the backscatter in
+        linear power, back in dB) reduce each scene over the buffered
+        location on the server side, only one row per scene is returned.
+        The default is None, all the pixels of the location are returned
+        and averaged on the client side, e.g. for diagnostics.
     Returns
     -------
     None.
     """
 
     def __init__(self, product, start_date, end_date, bands, point_geometry, orbit_properties_pass='DESCENDING',
-                 instrument_mode='IW', dir_name='', save_file = True):
+                 instrument_mode='IW', dir_name='', save_file = True, executor=None, store=None, backend=None,
+                 footprint_reducer=None):
+        if footprint_reducer is not None and footprint_reducer not in FOOTPRINT_REDUCERS:
+            raise ValueError('footprint_reducer must be None or one of %s, not %r' % (FOOTPRINT_REDUCERS,
+                                                                                     footprint_reducer))
+        self.footprint_reducer = footprint_reducer
+        self.executor = executor if executor is not None else default_executor()
+        self.backend = backend if backend is not None else GeeBackend(self.executor)
+        self.store = store
         self.product = product
         self.bands = bands
         self.start_date = start_date
@@ -112,32 +751,84 @@ class GeeS1TimeseriesExtractor:
         self.instrumentMode = instrument_mode
         self.orbit_properties_pass = orbit_properties_pass
         self.point_geometry = point_geometry
-        self.filtered_collection = self.sentinel1_filtered_collection()
-        self.image_size = self.filtered_collection.size().getInfo()
+        self._filtered_collection = None  # only built by the GEE backend
         self.save = save_file
-        if self.image_size > 0:
-            self.save_band_info()
-            self.set_output_dir(dir_name)
-            self.set_default_proj_dir()
+        self.set_output_dir(dir_name)
+        self._image_size = None  # the metadata is only requested when needed
+        self.band_info = None
+        self.projection = None
+        self.scale = None
+
+    @property
+    def filtered_collection(self):
+        """The filtered GEE collection over the location, built on first use"""
+        if self._filtered_collection is None:
+            self._filtered_collection = self.sentinel1_filtered_collection()
+        return self._filtered_collection
+
+    @property
+    def image_size(self):
+        """The number of images over the location, requested on first use"""
+        if self._image_size is None:
+            self._image_size = self.backend.size(self.query())
+        return self._image_size
 
-    def sentinel1_filtered_collection(self):
+    def sentinel1_filtered_collection(self, filter_bounds=True, start_date=None):
         """Filters the GEE collection by date, orbit, location and observation mode
 
+        Parameters
+        ----------
+        filter_bounds : bool, optional
+            Filter by the point geometry of the extractor. The default is
+            True, the filter is skipped without a point geometry.
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
         Returns
         -------
         ee.Collection
             The filtered sentinel1 collection.
         """
-        im_collection = ee.ImageCollection(self.product).filterDate(self.start_date, self.end_date)  # product and date
-        im_collection = im_collection.filter(ee.Filter.eq('orbitProperties_pass', self.orbit_properties_pass))  # orbit
+        start_date = self.start_date if start_date is None else start_date
+        im_collection = ee.ImageCollection(self.product).filterDate(start_date, self.end_date)  # product and date
+        if self.orbit_properties_pass is not None:
+            im_collection = im_collection.filter(ee.Filter.eq('orbitProperties_pass', self.orbit_properties_pass))  # orbit
         im_collection = im_collection.filter(ee.Filter.eq('instrumentMode', self.instrumentMode)).select(
             self.bands)  # IW mode and bands
+        if self.orbit_properties_pass is None:
+            im_collection = im_collection.map(add_orbit_pass_band)  # split on the client side
         im_collection = im_collection.filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV')).filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
         #im_collection = im_collection.filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-        im_collection = im_collection.filterBounds(self.point_geometry)
+        if filter_bounds and self.point_geometry is not None:
+            im_collection = im_collection.filterBounds(location_geometry(self.point_geometry))
 
         return im_collection
 
+    def query(self, start_date=None, filter_bounds=True):
+        """Returns the images of ``sentinel1_filtered_collection`` for any backend
+
+        The polarisation filter is the bands of the query, a local tile
+        must hold all of them.
+        """
+        properties = {'instrumentMode': self.instrumentMode}
+        property_bands = {}
+        if self.orbit_properties_pass is None:
+            property_bands['orbit_pass'] = ('orbitProperties_pass', ORBIT_PASSES)
+        else:
+            properties['orbitProperties_pass'] = self.orbit_properties_pass
+        if start_date is None and filter_bounds:
+            collection = lambda: self.filtered_collection  # the collection of the extractor, built once
+        else:
+            collection = lambda: self.sentinel1_filtered_collection(filter_bounds, start_date)
+        linear_bands = None
+        if self.footprint_reducer == 'linear_mean':
+            linear_bands = [band for band in self.bands if band in DB_BANDS]
+        return CollectionQuery(self.product, self.bands, self.start_date if start_date is None else start_date,
+                               self.end_date, properties, property_bands, collection, linear_bands)
+
+    def _server_reducer(self):
+        return 'median' if self.footprint_reducer == 'median' else 'mean'  # linear_mean is a mean of the linear query
+
     def set_output_dir(self, dir_name):
         """Sets the extract directory
 
@@ -161,25 +852,31 @@ class GeeS1TimeseriesExtractor:
         -------
         None.
         """
-        image_info = self.filtered_collection.first().getInfo()
-        self.band_info = image_info['bands']
+        self.band_info = self.backend.band_info(self.product, self.bands)
         data_type = self.band_info[0]['data_type']  # Assumes all bands have the same data type
         self.data_type = 'Int64' if data_type['precision'] == 'int' else np.float64
 
     def _int_data(self):
+        if self.band_info is None:
+            self.save_band_info()
         return self.data_type == 'Int64'
 
     def set_default_proj_dir(self):
         """Sets the default extract projection and scale
 
         Sets the extract projection and scale to the collection's
-        native projection and scale.
+        native projection and scale. The projection is the one of the
+        first scene over the location (its UTM zone), evaluated on the
+        server side with the extract. Without a location the projection is
+        left to ``reduceRegions``, the native projection of each scene.
         Returns
         -------
         None.
         """
+        if self.band_info is None:
+            self.save_band_info()
         band = self.band_info[0]  # Assumes all bands have the same proj/scale
-        self.projection = band['crs']
+        self.projection = self.backend.native_projection(self.query()) if self.point_geometry is not None else None
         self.scale = abs(band['crs_transform'][0])  # crs_tranform is [+/-scale, 0, x, 0 , +/-scale, y]
 
     def set_proj_scale(self, proj, scale):
@@ -198,7 +895,7 @@ class GeeS1TimeseriesExtractor:
         self.projection = proj
         self.scale = scale
 
-    def download_data(self):
+    def download_data(self, start_date=None):
         """Download the GEE data for a location
 
         Downloads the GEE data for a location, converts it to a data
@@ -206,9 +903,9 @@ class GeeS1TimeseriesExtractor:
 
         Parameters
         ----------
-        location : Pandas series
-            A Pandas series containing the location ``Longitude`` and
-            ``Latitude``.
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
         Returns
         -------
         bands_df : Pandas data frame
@@ -216,22 +913,105 @@ class GeeS1TimeseriesExtractor:
             the dates.
         """
 
-        data = self.filtered_collection.getRegion(
-            self.point_geometry, self.scale, self.projection).getInfo()
-        data_df = pd.DataFrame(data[1:], columns=data[0])
+        if self.orbit_properties_pass is None:
+            return pd.concat(list(self.download_passes(start_date).values())).sort_index()
+        return self.region_to_bands_df(self.download_region(start_date))
+
+    def download_region(self, start_date=None):
+        """Download the pixels of all images over the location in one request
+
+        Parameters
+        ----------
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
+        Returns
+        -------
+        data_df : Pandas data frame
+            The ``id``, ``time``, band values (and ``orbit_pass`` without
+            an orbit filter) of the pixels, as returned by ``getRegion``,
+            or of the scenes reduced with the ``footprint_reducer``.
+        """
+        if self.scale is None:
+            self.set_default_proj_dir()
+        with span('s1.region', product=self.product, reducer=self.footprint_reducer) as stage:
+            if self.footprint_reducer is not None:
+                data_df = self.backend.reduce_region(self.query(start_date), self.point_geometry,
+                                                     self._server_reducer(), self.scale, self.projection)
+            else:
+                data_df = self.backend.region(self.query(start_date), self.point_geometry, self.scale, self.projection)
+            stage.add(rows=len(data_df))
         #self.last_longitude = data_df.longitude[0]
         #self.last_latitude = data_df.latitude[0]
-        bands_index = pd.DatetimeIndex(pd.to_datetime(data_df.time, unit='ms').dt.date)
-        data_df = data_df.set_index(bands_index).rename_axis(index='time').sort_index()
-        bands_df = data_df[self.bands]
-        bands_df = bands_df.groupby(level=0).mean()
-        fname_df = data_df['id'] # parse the relative orbit and platform
-        fname_df = fname_df[~fname_df.index.duplicated(keep='first')]
-        platform_orbit_df = [self.parse_S1_platform_orbit(fname) for fname in fname_df]
-        platform_orbit_df = pd.DataFrame(platform_orbit_df, columns=['platform','relative_orbit'])
-        platform_orbit_df.index = fname_df.index
-        bands_df = pd.concat([bands_df, platform_orbit_df], axis=1)
-        if self.orbit_properties_pass == 'ASCENDING':
+        return data_df
+
+    def download_passes(self, start_date=None):
+        """Download both orbit passes over the location in one request
+
+        Only for an extractor created without an orbit filter.
+
+        Parameters
+        ----------
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
+        Returns
+        -------
+        dict
+            The data frame ``download_data`` returns for each orbit pass,
+            empty without images of the pass.
+        """
+        return self.split_passes(self.download_region(start_date))
+
+    def split_passes(self, data_df):
+        """Splits the pixels of both orbit passes and converts them to the daily band values
+
+        Returns
+        -------
+        dict
+            The data frame of each orbit pass.
+        """
+        if 'orbit_pass' not in data_df:
+            data_df = data_df.assign(orbit_pass=np.nan)
+        return {orbit_pass: self.region_to_bands_df(data_df[data_df['orbit_pass'] == code], orbit_pass)
+                for code, orbit_pass in enumerate(ORBIT_PASSES)}
+
+    def region_to_bands_df(self, data_df, orbit_pass=None):
+        """Converts the pixels of a location to the daily band values
+
+        Parameters
+        ----------
+        data_df : Pandas data frame
+            The ``id``, ``time`` and band values of the pixels, as
+            returned by ``getRegion``.
+        orbit_pass : str, optional
+            The orbit pass of the pixels. The default is the orbit pass
+            of the extractor.
+        Returns
+        -------
+        bands_df : Pandas data frame
+            A data frame. The columns are the bands, platform, relative
+            orbit and orbit pass and the index is the dates.
+        """
+        with span('s1.to_bands', product=self.product) as stage:
+            bands_index = pd.DatetimeIndex(pd.to_datetime(data_df.time, unit='ms').dt.date)
+            data_df = data_df.set_index(bands_index).rename_axis(index='time').sort_index()
+            bands_df = data_df[self.bands].astype(float)
+            bands_df = bands_df.groupby(level=0).mean()
+            fname_df = data_df['id'] # parse the relative orbit and platform
+            fname_df = fname_df[~fname_df.index.duplicated(keep='first')]
+            try:
+                platform_orbit_df = decode_s1_ids(fname_df.to_numpy())
+            except ValueError:  # the ids do not share one layout, they are parsed one at a time
+                platform_orbit_df = pd.DataFrame([self.parse_S1_platform_orbit(fname) for fname in fname_df],
+                                                 columns=['platform', 'relative_orbit'])
+                platform_orbit_df = platform_orbit_df.astype({'platform': np.int8, 'relative_orbit': np.int16})
+            bands_df['platform'] = platform_orbit_df['platform'].to_numpy()
+            bands_df['relative_orbit'] = platform_orbit_df['relative_orbit'].to_numpy()
+            stage.add(rows=len(bands_df))
+        if orbit_pass is None:
+            orbit_pass = self.orbit_properties_pass
+        if orbit_pass == 'ASCENDING':
             bands_df['orbit_pass'] = 0  # use 0 to represent the ASCENDING
         else:
             bands_df['orbit_pass'] = 1  # use 1 to represent the DESCENDING
@@ -241,41 +1021,168 @@ class GeeS1TimeseriesExtractor:
 
         return bands_df
 
-    def get_and_save_data(self, site_name):
+    def download_data_batch(self, sites, id_column='site_id', lon_column='lon', lat_column='lat', buffer=0,
+                            max_rows=MAX_FEATURES, chunk_size=50):
+        """Download the GEE data for many locations in chunked requests
+
+        Each request reduces every image over a chunk of the sites on the
+        server side (the ``footprint_reducer`` over the buffered point, the
+        mean by default), the rows are split by site on the client side.
+
+        Parameters
+        ----------
+        sites : Pandas data frame
+            A table of sites with an id, longitude and latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        lon_column : str, optional
+            The column of the longitudes. The default is 'lon'.
+        lat_column : str, optional
+            The column of the latitudes. The default is 'lat'.
+        buffer : float, optional
+            The buffer of the points in m. The default is 0.
+        max_rows : int, optional
+            The maximum rows returned by one request. The default is
+            ``MAX_FEATURES``.
+        chunk_size : int, optional
+            The number of sites in the first request. The default is 50.
+        Returns
+        -------
+        dict
+            The data frame ``download_data`` returns, for each site id.
+        """
+        if self.scale is None:
+            self.set_default_proj_dir()
+        with span('s1.batch', product=self.product, sites=len(sites)) as stage:
+            data_df = self.backend.sample(self.query(filter_bounds=False), sites, id_column, lon_column, lat_column,
+                                          buffer, self._server_reducer(), self.scale, self.projection, self.bands,
+                                          max_rows, chunk_size)
+            stage.add(rows=len(data_df))
+        columns = ['id', 'time'] + self.bands
+        if self.orbit_properties_pass is None:
+            site_data = split_sites(data_df, sites[id_column].tolist(), columns + ['orbit_pass'], self.bands)
+            return {site_id: pd.concat(list(self.split_passes(site_df).values())).sort_index()
+                    for site_id, site_df in site_data.items()}
+        site_data = split_sites(data_df, sites[id_column].tolist(), columns, self.bands)
+        return {site_id: self.region_to_bands_df(site_df) for site_id, site_df in site_data.items()}
+
+    def get_and_save_data(self, site_name, network=None):
         """Get and save the GEE data for a location
 
         Checks if data has already been extracted for the location (a
-        file called ``<Site>.csv`` already exists). If the file exists,
-        it is read into a data frame and returned. If it doesn't exist,
-        the data for the location will be downloaded, saved to
-        ``<Site>.csv`` and the data frame returned.
+        file called ``<Site>_<orbit pass>.csv`` already exists). If the
+        file exists, it is read into a data frame and returned. If it
+        doesn't exist, the data for the location will be downloaded,
+        saved to ``<Site>_<orbit pass>.csv`` and the data frame returned.
+        With a store, the ``sentinel1_<orbit pass>`` dataset is used
+        instead of the file and only the days after the high-water mark
+        of the site are downloaded.
         Parameters
         ----------
-        location : Pandas series
-            A Pandas series containing the ``Site`` name and location
-            ``Longitude`` and ``Latitude``.
+        site_name : str
+            The name of the site, the station in the store.
+        network : str, optional
+            The network of the site in the store. The default is None.
         Returns
         -------
         point_df : Pands data frame
             A data frame. The columns are the bands and the index is
             the dates.
         """
-        file_name = f'{self.dir_name}{site_name}.csv'
-        '''
-        try:  # If we already have the location data, read it
-            dtypes = {band: self.data_type for band in self.bands}
-            point_df = pd.read_csv(file_name, index_col="id", parse_dates=True, dtype=dtypes)
-        except:  # Otherwise extract it from GEE
-            #print(f'Extracting data for {site_name} ')
-        '''
-        point_df = self.download_data()
+        with span('s1.site', network_site_id(site_name, network), product=self.product):
+            orbit_pass = self.orbit_properties_pass
+            if self.store is not None and self.save:
+                return self.update_saved_passes(site_name, [orbit_pass], network)[orbit_pass]
+            if self.saved_data_exists(site_name, orbit_pass, network):  # If we already have the location data, read it
+                return self.read_saved_data(site_name, orbit_pass, network)
+            return self.add_dates_and_save(self.download_data(), site_name, orbit_pass, network)
+
+    def get_and_save_passes(self, site_name, network=None):
+        """Get and save the GEE data of both orbit passes for a location
+
+        Same as ``get_and_save_data`` for an extractor created without an
+        orbit filter, both passes are downloaded in one request.
+
+        Parameters
+        ----------
+        site_name : str
+            The name of the site.
+        Returns
+        -------
+        dict
+            The data frame ``get_and_save_data`` returns for each orbit
+            pass, empty without images of the pass.
+        """
+        with span('s1.site', network_site_id(site_name, network), product=self.product):
+            if self.store is not None and self.save:
+                return self.update_saved_passes(site_name, ORBIT_PASSES, network)
+            if all(self.saved_data_exists(site_name, orbit_pass, network) for orbit_pass in ORBIT_PASSES):
+                return {orbit_pass: self.read_saved_data(site_name, orbit_pass, network) for orbit_pass in ORBIT_PASSES}
+            passes_df = self.download_passes()
+            return {orbit_pass: self.add_dates_and_save(passes_df[orbit_pass], site_name, orbit_pass, network)
+                    for orbit_pass in ORBIT_PASSES}
+
+    def update_saved_passes(self, site_name, orbit_passes, network=None):
+        """Extends the stored orbit passes of a location to the end date
+
+        Downloads the days after the high-water mark of the passes in one
+        request and appends them to the store.
+
+        Parameters
+        ----------
+        site_name : str
+            The name of the site, the station in the store.
+        orbit_passes : list
+            The orbit passes to update.
+        network : str, optional
+            The network of the site in the store. The default is None.
+        Returns
+        -------
+        dict
+            The stored data frame of each orbit pass.
+        """
+        last_day = pd.Timestamp(self.end_date) - pd.Timedelta(days=1)  # the end date is excluded by filterDate
+        windows = {orbit_pass: self.store.update_window(f'sentinel1_{orbit_pass}', self.start_date, last_day,
+                                                        network, site_name) for orbit_pass in orbit_passes}
+        starts = [start for start, _, _ in windows.values() if start is not None]
+        if starts:
+            if self.orbit_properties_pass is None:
+                passes_df = self.download_passes(min(starts))
+            else:
+                passes_df = {self.orbit_properties_pass: self.download_data(min(starts))}
+            for orbit_pass, (start, end, mode) in windows.items():
+                if start is not None:
+                    point_df = passes_df[orbit_pass]
+                    self.add_dates_and_save(point_df[point_df.index >= start], site_name, orbit_pass, network, mode,
+                                            end)
+        return {orbit_pass: self.read_saved_data(site_name, orbit_pass, network) for orbit_pass in orbit_passes}
+
+    def saved_data_exists(self, site_name, orbit_pass, network=None):
+        if self.store is not None:
+            return self.store.exists(f'sentinel1_{orbit_pass}', network, site_name)
+        return os.path.exists(f'{self.dir_name}{site_name}_{orbit_pass}.csv')
+
+    def read_saved_data(self, site_name, orbit_pass, network=None):
+        if self.store is not None:
+            point_df = self.store.read(f'sentinel1_{orbit_pass}', network=network, station=site_name)
+        else:
+            point_df = pd.read_csv(f'{self.dir_name}{site_name}_{orbit_pass}.csv', index_col='time', parse_dates=True)
+        if self._int_data():
+            point_df[self.bands] = point_df[self.bands].astype(self.data_type)
+        return point_df
+
+    def add_dates_and_save(self, point_df, site_name, orbit_pass, network=None, mode='overwrite',
+                           high_water_mark=None):
         date_obj = DateTool(point_df.index)
         point_df = pd.concat([date_obj.get_all_date_df(), point_df], axis=1)
-        if self.save:
-            point_df.to_csv(file_name)
+        if self.save and self.store is not None:
+            self.store.write(f'sentinel1_{orbit_pass}', point_df, network, site_name, mode, high_water_mark)
+        elif self.save:
+            point_df.to_csv(f'{self.dir_name}{site_name}_{orbit_pass}.csv')
         return point_df
 
     def parse_S1_platform_orbit(self, fname):
+        # a single id, decode_s1_ids decodes a whole column of ids sharing one layout
         platform = fname[2]
         obs_orbit = int(fname.split('_')[6])
         if platform == 'A':
@@ -313,17 +1220,29 @@ class GeeTimeseriesExtractor:
     dir_name : str
         The directory where the extracted files will be stored. The
         default is ''.
+    executor : GeeRequestExecutor, optional
+        The executor the GEE requests are sent through. The default is
+        the executor shared by all extractors.
+    store : PipelineStore, optional
+        The store the extracts are saved to instead of the csv files of
+        ``dir_name``. The default is None.
+    backend : GeeBackend or LocalRasterBackend, optional
+        The source of the images. The default is None, GEE requests sent
+        through ``executor``.
     Returns
     -------
     None.
     """
 
-    def __init__(self, product, bands, start_date, end_date, dir_name='', save_file=True):
+    def __init__(self, product, bands, start_date, end_date, dir_name='', save_file=True, executor=None, store=None,
+                 backend=None):
+        self.executor = executor if executor is not None else default_executor()
+        self.backend = backend if backend is not None else GeeBackend(self.executor)
+        self.store = store
         self.product = product
         self.bands = bands
         self.start_date = start_date
         self.end_date = end_date
-        self.collection = ee.ImageCollection(product).select(bands)
         # self.set_date_range(start_date, end_date, freq, gap_fill, max_gap)
         self.save_band_info()
         self.set_output_dir(dir_name)
@@ -364,15 +1283,26 @@ class GeeTimeseriesExtractor:
         else:
             self.gap_fill = False
 
-    def filtered_collection(self):
+    def filtered_collection(self, start_date=None):
         """Filters the GEE collection by date
 
+        Parameters
+        ----------
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
         Returns
         -------
         ee.Collection
             The filtered GEE collection.
         """
-        return self.collection.filterDate(self.start_date, self.end_date)
+        start_date = self.start_date if start_date is None else start_date
+        return ee.ImageCollection(self.product).select(self.bands).filterDate(start_date, self.end_date)
+
+    def query(self, start_date=None):
+        """Returns the images of ``filtered_collection`` for any backend"""
+        return CollectionQuery(self.product, self.bands, self.start_date if start_date is None else start_date,
+                               self.end_date, collection=lambda: self.filtered_collection(start_date))
 
     def set_output_dir(self, dir_name):
         """Sets the extract directory
@@ -397,10 +1327,9 @@ class GeeTimeseriesExtractor:
         -------
         None.
         """
-        image_info = self.filtered_collection().first().getInfo()
-        self.band_info = image_info['bands']
+        self.band_info = self.backend.band_info(self.product, self.bands)
         data_type = self.band_info[0]['data_type']  # Assumes all bands have the same data type
-        self.data_type = 'Int64' if data_type['precision'] == 'int' else np.float
+        self.data_type = 'Int64' if data_type['precision'] == 'int' else np.float64
 
     def _int_data(self):
         return self.data_type == 'Int64'
@@ -434,7 +1363,7 @@ class GeeTimeseriesExtractor:
         self.projection = proj
         self.scale = scale
 
-    def download_data(self, point_geo):
+    def download_data(self, point_geo, start_date=None):
         """Download the GEE data for a location
 
         Downloads the GEE data for a location, converts it to a data
@@ -442,9 +1371,12 @@ class GeeTimeseriesExtractor:
 
         Parameters
         ----------
-        location : Pandas series
-            A Pandas series containing the location ``Longitude`` and
-            ``Latitude``.
+        point_geo : ee.Geometry or tuple
+            The location, or its (lon, lat) as required by a local
+            backend.
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
         Returns
         -------
         bands_df : Pandas data frame
@@ -452,15 +1384,33 @@ class GeeTimeseriesExtractor:
             the dates.
         """
         #point_geo = ee.Geometry.Point(location[0:2], self.projection)
-        data = self.filtered_collection().getRegion(
-            point_geo, self.scale, self.projection).getInfo()
-        data_df = pd.DataFrame(data[1:], columns=data[0])
+        with span('collection.region', product=self.product) as stage:
+            data_df = self.backend.region(self.query(start_date), point_geo, self.scale, self.projection)
+            stage.add(rows=len(data_df))
         #self.last_longitude = data_df.longitude[0]
         #self.last_latitude = data_df.latitude[0]
-        bands_index = pd.DatetimeIndex(pd.to_datetime(data_df.time, unit='ms').dt.date)
-        bands_df = data_df[self.bands].set_index(bands_index).rename_axis(index='time').sort_index()
-        date_obj = DateTool(bands_df.index)
-        bands_df = pd.concat([date_obj.get_all_date_df(), bands_df], axis=1)
+        return self.region_to_bands_df(data_df)
+
+    def region_to_bands_df(self, data_df):
+        """Converts the pixel values of a location to the band time series
+
+        Parameters
+        ----------
+        data_df : Pandas data frame
+            The ``time`` and band values of the pixel, as returned by
+            ``getRegion``.
+        Returns
+        -------
+        bands_df : Pandas data frame
+            A data frame. The columns are the bands and the index is
+            the dates.
+        """
+        with span('collection.to_bands', product=self.product) as stage:
+            bands_index = pd.DatetimeIndex(pd.to_datetime(data_df.time, unit='ms').dt.date)
+            bands_df = data_df[self.bands].set_index(bands_index).rename_axis(index='time').sort_index()
+            date_obj = DateTool(bands_df.index)
+            bands_df = pd.concat([date_obj.get_all_date_df(), bands_df], axis=1)
+            stage.add(rows=len(bands_df))
         #bands_df = bands_df.groupby(level=0).mean()
         '''
         if self.gap_fill:
@@ -474,37 +1424,323 @@ class GeeTimeseriesExtractor:
             bands_df = bands_df.round().astype(self.data_type)
         return bands_df
 
-    def get_and_save_data(self, location, site_name):
+    def download_data_batch(self, sites, id_column='site_id', lon_column='lon', lat_column='lat',
+                            max_rows=MAX_FEATURES, chunk_size=50, start_date=None):
+        """Download the GEE data for many locations in chunked requests
+
+        Each request samples every image at a chunk of the site points on
+        the server side, the rows are split by site on the client side.
+
+        Parameters
+        ----------
+        sites : Pandas data frame
+            A table of sites with an id, longitude and latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        lon_column : str, optional
+            The column of the longitudes. The default is 'lon'.
+        lat_column : str, optional
+            The column of the latitudes. The default is 'lat'.
+        max_rows : int, optional
+            The maximum rows returned by one request. The default is
+            ``MAX_FEATURES``.
+        chunk_size : int, optional
+            The number of sites in the first request. The default is 50.
+        start_date : str, optional
+            The start of the extract window. The default is None, the
+            start date of the extractor.
+        Returns
+        -------
+        dict
+            The data frame ``download_data`` returns, for each site id.
+        """
+        with span('collection.batch', product=self.product, sites=len(sites)) as stage:
+            data_df = self.backend.sample(self.query(start_date), sites, id_column, lon_column, lat_column, 0, 'first',
+                                          self.scale, self.projection, None, max_rows, chunk_size)
+            stage.add(rows=len(data_df))
+        site_data = split_sites(data_df, sites[id_column].tolist(), ['time'] + self.bands)
+        return {site_id: self.region_to_bands_df(site_df) for site_id, site_df in site_data.items()}
+
+    def get_and_save_data(self, location, site_name, network=None):
         """Get and save the GEE data for a location
 
         Checks if data has already been extracted for the location (a
         file called ``<Site>.csv`` already exists). If the file exists,
         it is read into a data frame and returned. If it doesn't exist,
         the data for the location will be downloaded, saved to
-        ``<Site>.csv`` and the data frame returned.
+        ``<Site>.csv`` and the data frame returned. With a store, the
+        dataset named after the product is used instead of the file and
+        only the days after the high-water mark of the site are
+        downloaded.
         Parameters
         ----------
         location : Pandas series
             A Pandas series containing the ``Site`` name and location
             ``Longitude`` and ``Latitude``.
+        site_name : str
+            The name of the site, the station in the store.
+        network : str, optional
+            The network of the site in the store. The default is None.
         Returns
         -------
         point_df : Pands data frame
             A data frame. The columns are the bands and the index is
             the dates.
         """
-        file_name = f'{self.dir_name}{site_name}.csv'
-        try:  # If we already have the location data, read it
-            dtypes = {band: self.data_type for band in self.bands}
-            point_df = pd.read_csv(file_name, index_col="id", parse_dates=True, dtype=dtypes)
-        except:  # Otherwise extract it from GEE
-            print(f'Extracting data for {site_name}')
-            point_df = self.download_data(location)
-            if self.save:
-                point_df.to_csv(file_name)
+        with span('collection.site', network_site_id(site_name, network), product=self.product):
+            file_name = f'{self.dir_name}{site_name}.csv'
+            if self.store is not None and self.save:
+                start, end, mode = self.update_window(site_name, network)
+                if start is not None:
+                    print(f'Extracting data for {site_name} from {start}')
+                    self.store.write(self.dataset, self.download_data(location, start), network, site_name, mode, end)
+                return self.read_saved_data(site_name, network)
+            if self.store is not None and self.store.exists(self.dataset, network, site_name):
+                point_df = self.read_saved_data(site_name, network)
+            elif self.store is None and os.path.exists(file_name):  # If we already have the location data, read it
+                dtypes = {band: self.data_type for band in self.bands}
+                point_df = pd.read_csv(file_name, index_col='time', parse_dates=True, dtype=dtypes)
+            else:  # Otherwise extract it from GEE
+                print(f'Extracting data for {site_name}')
+                point_df = self.download_data(location)
+                if self.save and self.store is not None:
+                    self.store.write(self.dataset, point_df, network, site_name)
+                elif self.save:
+                    point_df.to_csv(file_name)
+            return point_df
+
+    def get_and_save_batch(self, sites, id_column='site_id', network_column='network', station_column='station',
+                           lon_column='lon', lat_column='lat', pixel_index=None, **batch_args):
+        """Extends the stored data of many locations to the end date in chunked requests
+
+        The sites are grouped by the day after their high-water mark, each
+        group is downloaded with ``download_data_batch`` from that day and
+        appended to the store.
+
+        Parameters
+        ----------
+        sites : Pandas data frame
+            A table of sites with an id, network, station, longitude and
+            latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        network_column : str, optional
+            The column of the networks. The default is 'network'.
+        station_column : str, optional
+            The column of the stations. The default is 'station'.
+        lon_column : str, optional
+            The column of the longitudes. The default is 'lon'.
+        lat_column : str, optional
+            The column of the latitudes. The default is 'lat'.
+        pixel_index : PixelIndex, optional
+            The index of the sites on the grid of the product, each pixel
+            is then downloaded once for all its sites. The default is
+            None, one download per site.
+        **batch_args
+            The other arguments of ``download_data_batch``.
+        Returns
+        -------
+        dict
+            The stored data frame of each site id.
+        """
+        windows = [self.update_window(station, network)
+                   for network, station in zip(sites[network_column], sites[station_column])]
+        todo = pd.DataFrame(windows, columns=['start', 'end', 'mode'], index=sites.index)
+        for start, group in sites[todo['start'].notna()].groupby(todo['start'], sort=False):
+            print(f'Extracting data for {len(group)} sites from {start}')
+            if pixel_index is None:
+                group_data = self.download_data_batch(group, id_column, lon_column, lat_column, start_date=start,
+                                                      **batch_args)
+            else:
+                group_index = pixel_index.subset(group[id_column])
+                group_index.report(self.product)
+                group_data = group_index.apply(lambda pixels: self.download_data_batch(
+                    pixels, 'pixel', lon_column, lat_column, start_date=start, **batch_args))
+            for site_idx, site in group.iterrows():
+                self.store.write(self.dataset, group_data[site[id_column]], site[network_column],
+                                 site[station_column], todo.loc[site_idx, 'mode'], todo.loc[site_idx, 'end'])
+        return {site[id_column]: self.read_saved_data(site[station_column], site[network_column])
+                for _, site in sites.iterrows()}
+
+    @property
+    def dataset(self):
+        """The dataset of the extracts in the store"""
+        return self.product.replace('/', '_')
+
+    def update_window(self, site_name, network=None):
+        last_day = pd.Timestamp(self.end_date) - pd.Timedelta(days=1)  # the end date is excluded by filterDate
+        return self.store.update_window(self.dataset, self.start_date, last_day, network, site_name)
+
+    def read_saved_data(self, site_name, network=None):
+        point_df = self.store.read(self.dataset, network=network, station=site_name)
+        point_df[self.bands] = point_df[self.bands].astype(self.data_type)
         return point_df
 
 
+class GeeStaticExtractor:
+    """Google Earth Engine static attribute extractor
+
+    Stacks static layers (e.g. the landcover of each year, soil, terrain)
+    into one multi-band image and samples all its bands at the sites in
+    chunked server-side requests, so the attributes of all sites take a
+    few requests instead of one per site and layer.
+
+    Parameters
+    ----------
+    scale : float, optional
+        The scale of the extract in m, the layers are sampled at the
+        nearest pixel. The default is None, set from the native scale of
+        a collection by ``set_native_proj_scale``.
+    projection : str, optional
+        The projection of the extract. The default is None, the GEE
+        default.
+    executor : GeeRequestExecutor, optional
+        The executor of the requests. The default is None, the shared
+        executor.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, scale=None, projection=None, executor=None):
+        self.scale = scale
+        self.projection = projection
+        self.executor = executor if executor is not None else default_executor()
+        self.layers = []
+        self.collections = []  # (bands, prefix) of the stacked collections, to name their columns
+
+    def add_image(self, image, names=None):
+        """Adds the bands of an image, optionally renamed
+
+        Returns
+        -------
+        GeeStaticExtractor
+            The extractor, to chain the layers.
+        """
+        self.layers.append(image if names is None else image.rename(names))
+        return self
+
+    def add_product(self, product, bands, prefix=''):
+        """Adds bands of a single image product, the columns are ``<prefix><band>``
+
+        Returns
+        -------
+        GeeStaticExtractor
+            The extractor, to chain the layers.
+        """
+        return self.add_image(ee.Image(product).select(bands), [prefix + band for band in bands])
+
+    def add_collection(self, product, bands, start_date, end_date, prefix=''):
+        """Adds the bands of every image of a collection
+
+        The columns are ``<prefix><image id>``, or
+        ``<prefix><image id>_<band>`` for several bands, e.g. ``LC2016``
+        for the 2016 landcover with the prefix 'LC'.
+
+        Returns
+        -------
+        GeeStaticExtractor
+            The extractor, to chain the layers.
+        """
+        collection = ee.ImageCollection(product).filterDate(start_date, end_date).select(bands)
+        self.layers.append(collection.toBands())  # the bands are named <image id>_<band>
+        self.collections.append((list(bands), prefix))
+        return self
+
+    def set_native_proj_scale(self, product, bands):
+        """Sets the extract projection and scale to the native ones of a collection
+
+        The layers are sampled on the pixels of the collection, e.g. the
+        landcover classes are read at their own pixel rather than the
+        nearest pixel of a grid in the GEE default projection.
+
+        Returns
+        -------
+        GeeStaticExtractor
+            The extractor, to chain the layers.
+        """
+        band = collection_band_info(product, bands, self.executor)[0]  # Assumes all bands have the same proj/scale
+        self.projection = band['crs']
+        self.scale = abs(band['crs_transform'][0])  # crs_tranform is [+/-scale, 0, x, 0 , +/-scale, y]
+        return self
+
+    def stacked_image(self):
+        """Returns the image of all the layers"""
+        image = self.layers[0]
+        for layer in self.layers[1:]:
+            image = image.addBands(layer)
+        return image
+
+    def column_name(self, name):
+        for bands, prefix in self.collections:
+            for band in bands:
+                if name.endswith('_' + band):
+                    image_id = name[:-len(band) - 1]
+                    return prefix + image_id if len(bands) == 1 else f'{prefix}{image_id}_{band}'
+        return name
+
+    def download_data_batch(self, sites, id_column='site_id', lon_column='lon', lat_column='lat',
+                            max_rows=MAX_FEATURES, chunk_size=50):
+        """Samples the layers at all sites in chunked requests
+
+        Parameters
+        ----------
+        sites : Pandas data frame
+            A table of sites with an id, longitude and latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        lon_column : str, optional
+            The column of the longitudes. The default is 'lon'.
+        lat_column : str, optional
+            The column of the latitudes. The default is 'lat'.
+        max_rows : int, optional
+            The maximum sites sampled by one request. The default is
+            ``MAX_FEATURES``.
+        chunk_size : int, optional
+            The number of sites in the first request. The default is 50.
+        Returns
+        -------
+        Pandas data frame
+            The attributes indexed by the site ids, NaN where a layer is
+            masked.
+        """
+        image = self.stacked_image()
+
+        def request_chunk(chunk):
+            sites_fc = sites_feature_collection(chunk, id_column, lon_column, lat_column)
+            samples = image.reduceRegions(collection=sites_fc, reducer=ee.Reducer.first().forEachBand(image),
+                                          scale=self.scale, crs=self.projection)
+            samples = samples.map(lambda feature: ee.Feature(None, feature.toDictionary()))  # no geometry in the reply
+            return [feature['properties'] for feature in self.executor.get_info(samples, 'static')['features']]
+
+        data_df = download_in_chunks(sites, request_chunk, max_rows, chunk_size, self.executor)
+        if len(data_df) == 0:
+            data_df = pd.DataFrame(columns=['site_id'])
+        data_df = data_df.drop_duplicates('site_id').set_index('site_id')
+        data_df = data_df.rename(columns=self.column_name).reindex(sites[id_column].tolist())
+        data_df.index.name = id_column
+        return data_df
+
+    def join(self, sites, id_column='site_id', **batch_args):
+        """Samples the layers at the sites and joins them to the site table
+
+        Parameters
+        ----------
+        sites : Pandas data frame
+            A table of sites with an id, longitude and latitude column.
+        id_column : str, optional
+            The column of the site ids. The default is 'site_id'.
+        **batch_args
+            The other arguments of ``download_data_batch``.
+        Returns
+        -------
+        Pandas data frame
+            The site table with a column per attribute.
+        """
+        data_df = self.download_data_batch(sites, id_column, **batch_args)
+        return sites.join(data_df, on=id_column)
+
+
 class DateTool:
     def __init__(self, time_stamp_list):
         self.time_stamp_list = time_stamp_list
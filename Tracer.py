@@ -0,0 +1,398 @@
+"""Stage level instrumentation of the pipeline"""
+
+import cProfile
+import collections
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+COUNTERS = ['bytes', 'response_json_bytes', 'rows', 'cache_hits']  # the counters the stages add to their span
+PROFILE_MODES = ['cprofile', 'sample']
+
+
+class _NullSpan:
+    """The span of a disabled instrumentation, records nothing
+
+    It is false, the stages skip measuring their counters with
+    ``if span:``.
+    """
+
+    site = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def add(self, **counters):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed run of a pipeline stage
+
+    Created by ``Tracer.span``. The wall time, the CPU time of the thread
+    and the counters added by the stage are recorded on exit.
+
+    Parameters
+    ----------
+    tracer : Tracer
+        The tracer the span is recorded by.
+    stage : str
+        The stage, e.g. 'gee.request' or 'ismn.read_stm'.
+    site : str, optional
+        The site the stage runs for. The default is None.
+    tags : dict, optional
+        Other tags of the span, e.g. the product. The default is None.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, tracer, stage, site=None, tags=None):
+        self.tracer = tracer
+        self.stage = stage
+        self.site = site
+        self.tags = tags or {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.profiler = None
+
+    def __bool__(self):
+        return True
+
+    def add(self, **counters):
+        """Adds to the counters of the span, e.g. ``add(rows=10, bytes=1024)``"""
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        self.profiler = self.tracer._start_profile(self.stage)
+        self.start = time.time()
+        self.cpu_start = time.thread_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        if self.profiler is not None:
+            self.tracer._stop_profile(self.profiler)
+        record = {'stage': self.stage, 'site': self.site, 'start': self.start, 'wall': wall, 'cpu': cpu}
+        record.update(self.counters)
+        record['error'] = None if exc_type is None else exc_type.__name__
+        record['pid'] = os.getpid()
+        record.update(self.tags)
+        self.tracer.emit(record)
+        return False
+
+
+class _Sampler(threading.Thread):
+    """Samples the stack of a thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.defaultdict(lambda: [0, 0])  # (self, total) samples of each function
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            leaf = True
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                function = (code.co_filename, code.co_firstlineno, code.co_name)
+                if function not in seen:  # recursive calls are counted once per sample
+                    seen.add(function)
+                    self.counts[function][1] += 1
+                if leaf:
+                    self.counts[function][0] += 1
+                    leaf = False
+                frame = frame.f_back
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+class Tracer:
+    """Records the spans of the pipeline stages
+
+    The stages of the pipeline (GEE requests, ``.stm`` parsing, SMAP
+    granule reads, the store, reprojection, ...) open a span of the
+    default tracer with ``span``. Without a default tracer they get
+    ``NULL_SPAN`` and nothing is measured. Each span is kept in memory and,
+    with a path, appended to a JSON lines file, one object per span. The
+    spans of worker processes are only written to the file: forked workers
+    inherit the tracer, spawned workers get one from the ``initializer`` of
+    their pool (``init_worker_tracer`` with ``worker_tracer_args()``).
+
+    Used as a context manager, the tracer is the default tracer within the
+    block::
+
+        with Tracer('spans.jsonl', profile_stage='ismn.read_stm') as tracer:
+            ...
+        print(tracer.summary())
+
+    Parameters
+    ----------
+    path : str, optional
+        The JSON lines file of the spans. The default is None, the spans
+        are only kept in memory.
+    profile_stage : str, optional
+        The stage to profile, its spans run under the profiler one at a
+        time. The default is None, no profiling.
+    profile_mode : str, optional
+        'cprofile' for deterministic profiling of all calls or 'sample' to
+        sample the stack of the stage's thread, with a lower overhead. The
+        default is 'cprofile'.
+    sample_interval : float, optional
+        The interval of the stack samples in s. The default is 0.005.
+    Returns
+    -------
+    None.
+    """
+
+    def __init__(self, path=None, profile_stage=None, profile_mode='cprofile', sample_interval=0.005):
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError('profile_mode must be one of %s, not %r' % (PROFILE_MODES, profile_mode))
+        self.path = path
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.sample_interval = sample_interval
+        self.records = []
+        self.lock = threading.Lock()
+        self.profile_lock = threading.Lock()  # a single profiler runs at a time
+        self.profile = None
+        self.samples = collections.defaultdict(lambda: [0, 0])  # (self, total) samples of each function
+        self.file = None
+        self.file_pid = None
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = default_tracer()
+        set_default_tracer(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        set_default_tracer(self.previous)
+        self.close()
+        return False
+
+    def span(self, stage, site=None, **tags):
+        """Returns a span of a stage, to use in a ``with`` statement
+
+        Parameters
+        ----------
+        stage : str
+            The stage.
+        site : str, optional
+            The site the stage runs for. The default is None.
+        **tags
+            Other tags of the span.
+        Returns
+        -------
+        Span
+            The span, its ``add`` method adds to the counters.
+        """
+        return Span(self, stage, site, tags)
+
+    def emit(self, record):
+        """Records a span and appends it to the JSON lines file"""
+        with self.lock:
+            self.records.append(record)
+            if self.path is None:
+                return
+            if self.file_pid != os.getpid():  # a forked worker appends through its own handle
+                self.file = open(self.path, 'a', buffering=1)
+                self.file_pid = os.getpid()
+            self.file.write(json.dumps(record, default=_json_value) + '\n')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and self.file_pid == os.getpid():
+                self.file.close()
+            self.file = None
+            self.file_pid = None
+
+    def _start_profile(self, stage):
+        if stage != self.profile_stage or not self.profile_lock.acquire(blocking=False):
+            return None
+        if self.profile_mode == 'sample':
+            profiler = _Sampler(threading.get_ident(), self.sample_interval)
+            profiler.start()
+            return profiler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active
+            self.profile_lock.release()
+            return None
+        return profiler
+
+    def _stop_profile(self, profiler):
+        if isinstance(profiler, _Sampler):
+            profiler.stop()
+            with self.lock:
+                for function, counts in profiler.counts.items():
+                    self.samples[function][0] += counts[0]
+                    self.samples[function][1] += counts[1]
+        else:
+            profiler.disable()
+            with self.lock:
+                if self.profile is None:
+                    self.profile = pstats.Stats(profiler)
+                else:
+                    self.profile.add(profiler)
+        self.profile_lock.release()
+
+    def span_records(self):
+        """Returns the spans recorded in this process
+
+        Returns
+        -------
+        Pandas data frame
+            The stage, site, start (epoch s), wall and CPU time in s,
+            counters, error type, process and tags of each span.
+        """
+        with self.lock:
+            records = list(self.records)
+        columns = ['stage', 'site', 'start', 'wall', 'cpu'] + COUNTERS + ['error', 'pid']
+        records = pd.DataFrame(records)
+        return records.reindex(columns=columns + [column for column in records.columns if column not in columns])
+
+    def summary(self):
+        """Summarises the spans by stage
+
+        The spans of nested stages are counted in both stages, e.g. the
+        GEE requests of an extract.
+
+        Returns
+        -------
+        Pandas data frame
+            The number of spans and sites, the total, mean and 95th
+            percentile wall time, the total CPU time, the counters and the
+            errors of each stage, the slowest stages first.
+        """
+        records = self.span_records()
+        if not len(records):
+            return pd.DataFrame(columns=['spans', 'sites', 'wall', 'mean', 'p95', 'cpu'] + COUNTERS + ['errors'])
+        summary = records.groupby('stage').agg(spans=('wall', 'size'), sites=('site', 'nunique'), wall=('wall', 'sum'),
+                                               mean=('wall', 'mean'),
+                                               p95=('wall', lambda wall: wall.quantile(0.95)), cpu=('cpu', 'sum'),
+                                               **{counter: (counter, 'sum') for counter in COUNTERS},
+                                               errors=('error', 'count'))
+        return summary.sort_values('wall', ascending=False)
+
+    def profile_stats(self, limit=30):
+        """Returns the profile of the ``profile_stage``
+
+        Parameters
+        ----------
+        limit : int, optional
+            The number of functions of a sampled profile. The default is
+            30.
+        Returns
+        -------
+        pstats.Stats or Pandas data frame
+            The ``pstats.Stats`` of a cProfile profile, None before the
+            stage ran. For a sampled profile, the samples in each function
+            (``self``) and in the functions it calls (``total``), the
+            most sampled functions first.
+        """
+        if self.profile_mode == 'cprofile':
+            return self.profile
+        with self.lock:
+            samples = [(name, file, line, counts[0], counts[1]) for (file, line, name), counts in self.samples.items()]
+        samples = pd.DataFrame(samples, columns=['function', 'file', 'line', 'self', 'total'])
+        return samples.sort_values(['total', 'self'], ascending=False).head(limit).reset_index(drop=True)
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+_default_tracer = None
+
+
+def default_tracer():
+    """Returns the tracer the stages record their spans to, None when disabled"""
+    return _default_tracer
+
+
+def set_default_tracer(tracer):
+    """Sets the tracer the stages record their spans to, None disables the instrumentation"""
+    global _default_tracer
+    _default_tracer = tracer
+
+
+def worker_tracer_args():
+    """Returns the ``initargs`` of ``init_worker_tracer`` for a process pool
+
+    Returns
+    -------
+    tuple
+        The path of the default tracer, None without a tracer or without a
+        path.
+    """
+    tracer = _default_tracer
+    return (None if tracer is None else tracer.path,)
+
+
+def init_worker_tracer(path):
+    """Sets the default tracer of a worker process, the ``initializer`` of a process pool
+
+    A spawned worker (the default on Windows and macOS) does not inherit
+    the default tracer of its parent, its spans are appended to the file of
+    the parent's tracer by a tracer of its own. A forked worker, or a
+    thread, keeps the tracer it already sees.
+
+    Parameters
+    ----------
+    path : str
+        The JSON lines file of the parent's tracer, None to record nothing.
+    Returns
+    -------
+    None.
+    """
+    if path is not None and _default_tracer is None:
+        set_default_tracer(Tracer(path))
+
+
+def span(stage, site=None, **tags):
+    """Returns a span of the default tracer, ``NULL_SPAN`` without a tracer
+
+    Parameters
+    ----------
+    stage : str
+        The stage.
+    site : str, optional
+        The site the stage runs for. The default is None.
+    **tags
+        Other tags of the span.
+    Returns
+    -------
+    Span or _NullSpan
+        The span, to use in a ``with`` statement.
+    """
+    tracer = _default_tracer
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, stage, site, tags)
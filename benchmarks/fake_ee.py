@@ -0,0 +1,445 @@
+"""Offline stand-in of the ``ee`` module for the benchmarks
+
+Only the calls the extractors make to download a location are covered:
+collections filtered by date, property and bounds, ``select``, ``map``,
+``first`` and its ``projection``, ``size``, ``getRegion`` and the
+``reduceRegions`` of the mapped images over a ``FeatureCollection``. The
+``size`` and ``getRegion`` requests ``serialize`` to a description of the
+collection and the location, e.g. the keys of ``GeeCache``.
+``getInfo`` returns payloads shaped like the Earth Engine replies
+(``getRegion`` tables of ids, coordinates, times in ms and band values, one
+row per pixel of the buffered location, or the features of the reductions)
+after a configurable latency. The values are random, seeded by the product
+and the location, so that a location always gets the same reply and the
+reductions reduce the pixels ``getRegion`` returns.
+
+The module is injected by the benchmarks and the tests only, before the
+extractors are imported::
+
+    import fake_ee
+    sys.modules['ee'] = fake_ee
+"""
+
+import math
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+LATENCY = 0.0  # the latency of each getInfo request in s
+S1_REVISIT_DAYS = 6  # the days between two scenes of an orbit pass, Sentinel-1A and B
+COMPOSITE_DAYS = 16  # the days between two composites of the other products, e.g. MOD13Q1
+STATS = {'requests': 0, 'rows': 0}
+_stats_lock = threading.Lock()
+
+# the band information of the first image of the products, as returned by getInfo
+S1_BAND = {'data_type': {'type': 'PixelType', 'precision': 'double'}, 'crs': 'EPSG:32630',
+           'crs_transform': [10, 0, 399960, 0, -10, 4500000]}
+COMPOSITE_BAND = {'data_type': {'type': 'PixelType', 'precision': 'int', 'min': -32768, 'max': 32767},
+                  'crs': 'SR-ORG:6974', 'crs_transform': [231.65635826395825, 0, -20015109.354, 0,
+                                                          -231.65635826395834, 10007554.677]}
+# the distribution of the random band values, normal (mean, sd) or uniform integers [low, high)
+BAND_VALUES = {'VV': ('normal', -12, 2), 'VH': ('normal', -18, 2), 'angle': ('uniform', 30, 45),
+               'NDVI': ('integers', -2000, 9000), 'EVI': ('integers', -2000, 6000)}
+
+
+def configure(latency=None, s1_revisit_days=None, composite_days=None):
+    """Sets the latency of the requests and the revisit of the products"""
+    global LATENCY, S1_REVISIT_DAYS, COMPOSITE_DAYS
+    if latency is not None:
+        LATENCY = latency
+    if s1_revisit_days is not None:
+        S1_REVISIT_DAYS = s1_revisit_days
+    if composite_days is not None:
+        COMPOSITE_DAYS = composite_days
+
+
+def reset_stats():
+    with _stats_lock:
+        STATS.update(requests=0, rows=0)
+
+
+class EEException(Exception):
+    pass
+
+
+def Initialize(*args, **kwargs):
+    pass
+
+
+class ComputedObject:
+    """A value evaluated by ``getInfo``"""
+
+    def __init__(self, info, request=None):
+        self._info = info
+        self.request = request
+
+    def serialize(self):
+        return repr(self.request)
+
+    def getInfo(self):
+        if LATENCY:
+            time.sleep(LATENCY)
+        info = self._info()
+        with _stats_lock:
+            STATS['requests'] += 1
+            if isinstance(info, list):
+                STATS['rows'] += len(info) - 1
+            elif isinstance(info, dict) and 'features' in info:
+                STATS['rows'] += len(info['features'])
+        return info
+
+
+class Projection(ComputedObject):
+    """The projection of an image, ``crs`` is the code of its reply"""
+
+    def __init__(self, crs):
+        super().__init__(lambda: {'type': 'Projection', 'crs': crs})
+        self.crs = crs
+
+
+class FirstImage(ComputedObject):
+    """The first image of a collection, its band information on ``getInfo``"""
+
+    def __init__(self, bands, crs):
+        super().__init__(lambda: {'type': 'Image', 'bands': bands()})
+        self.crs = crs
+
+    def select(self, bands):
+        return self
+
+    def projection(self):
+        return Projection(self.crs)
+
+
+class Filter:
+    def __init__(self, kind, name, value=None):
+        self.kind = kind
+        self.name = name
+        self.value = value
+
+    @staticmethod
+    def eq(name, value):
+        return Filter('eq', name, value)
+
+    @staticmethod
+    def listContains(name, value):
+        return Filter('listContains', name, value)
+
+    @staticmethod
+    def notNull(names):
+        return Filter('notNull', names)
+
+    def test(self, properties):
+        """Whether the properties of a feature pass the filter, only ``notNull`` filters features"""
+        return all(properties.get(name) is not None and not _is_nan(properties.get(name)) for name in self.name)
+
+
+def _is_nan(value):
+    return isinstance(value, float) and math.isnan(value)
+
+
+class Geometry:
+    def __init__(self, coordinates, proj=None, distance=0):
+        self.coordinates = list(coordinates)
+        self.proj = proj
+        self.distance = distance
+
+    @staticmethod
+    def Point(coordinates, proj=None):
+        return Geometry(coordinates[:2], proj)
+
+    def buffer(self, distance):
+        return Geometry(self.coordinates, self.proj, distance)
+
+
+class List:
+    def __init__(self, values):
+        self.values = list(values)
+
+    def indexOf(self, value):
+        return ('indexOf', self.values, value)
+
+
+class Reducer:
+    """The reduction of the pixels of a region by ``reduceRegions``
+
+    As in Earth Engine, the value reduced from an image of a single band is
+    named after the reducer (e.g. 'first'), unless the reducer was repeated
+    for each band by ``forEachBand``. The values of several bands are named
+    after the bands.
+    """
+
+    def __init__(self, kind, for_each_band=False):
+        self.kind = kind
+        self.for_each_band = for_each_band
+
+    @staticmethod
+    def mean():
+        return Reducer('mean')
+
+    @staticmethod
+    def median():
+        return Reducer('median')
+
+    @staticmethod
+    def first():
+        return Reducer('first')
+
+    def forEachBand(self, image):
+        return Reducer(self.kind, True)
+
+    def output_name(self, band, n_bands):
+        return self.kind if n_bands == 1 and not self.for_each_band else band
+
+    def reduce(self, values):
+        if len(values) == 0:
+            return None
+        if self.kind == 'first':
+            return values[0].item()
+        return float(getattr(np, self.kind)(values))
+
+
+class Feature:
+    def __init__(self, geometry, properties=None):
+        self._geometry = geometry
+        self.properties = dict(properties or {})
+
+    def geometry(self):
+        return self._geometry
+
+    def toDictionary(self):
+        return dict(self.properties)
+
+    def set(self, properties):
+        return Feature(self._geometry, dict(self.properties, **properties))
+
+
+class FeatureCollection:
+    """Features, or the samples of a collection evaluated on ``getInfo``"""
+
+    def __init__(self, features):
+        self._features = features if callable(features) else (lambda features=list(features): features)
+
+    def geometry(self):
+        return self
+
+    def map(self, function):
+        return FeatureCollection(lambda: [function(feature) for feature in self._features()])
+
+    def flatten(self):
+        return self
+
+    def filter(self, ee_filter):
+        return FeatureCollection(lambda: [feature for feature in self._features() if ee_filter.test(feature.properties)])
+
+    def getInfo(self):
+        return ComputedObject(lambda: {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': None, 'properties': feature.properties} for feature in self._features()]}
+                              ).getInfo()
+
+
+class Image:
+    """An image of a mapped collection
+
+    The band names and the values of the added bands are kept: constants,
+    orbit pass codes or functions of the raw values of a band (e.g. the dB to
+    linear power of ``pow`` and ``divide``). The images of a collection
+    mapped to samples also know their position and properties.
+    """
+
+    def __init__(self, names=(), value=None, collection=None, position=None, properties=None):
+        self.names = list(names)
+        self.value = value
+        self.collection = collection
+        self.position = position
+        self.properties = properties or {}
+
+    @staticmethod
+    def constant(value):
+        return Image([], value)
+
+    def get(self, name):
+        return self.properties.get(name, ('property', name))
+
+    def rename(self, names):
+        return Image([names] if isinstance(names, str) else names, self.value)
+
+    def toByte(self):
+        return self
+
+    def select(self, bands):
+        return Image([bands] if isinstance(bands, str) else bands, None if isinstance(self.value, dict) else self.value,
+                     self.collection, self.position, self.properties)
+
+    def _expression(self):
+        # the function of the raw values of a band computed by the image, the values themselves for a selected band
+        return self.value if callable(self.value) else (lambda values: values)
+
+    def divide(self, divisor):
+        expression = self._expression()
+        return Image(self.names, lambda values: expression(values) / divisor)
+
+    def pow(self, exponent):
+        expression, base = exponent._expression(), self.value
+        return Image(exponent.names, lambda values: base ** expression(values))
+
+    def addBands(self, image, names=None, overwrite=False):
+        added = dict(self.value or {}) if isinstance(self.value, dict) else {}
+        added.update({name: image.value for name in image.names})
+        return Image(self.names + [name for name in image.names if name not in self.names], added, self.collection,
+                     self.position, self.properties)
+
+    def reduceRegions(self, collection, reducer, scale=None, crs=None):
+        # one feature per feature of the collection with its properties and the reduced bands of the image
+        images, position = self.collection, self.position
+
+        def samples():
+            features = []
+            for feature in collection._features():
+                pixels = images._pixels(feature.geometry(), scale)
+                rows = pixels['image_pos'] == position
+                properties = dict(feature.properties)
+                for name, values in pixels['bands'].items():
+                    value = reducer.reduce(values[rows])
+                    if value is not None:
+                        properties[reducer.output_name(name, len(pixels['bands']))] = value
+                features.append(Feature(None, properties))
+            return features
+        return FeatureCollection(samples)
+
+
+class ImageCollection:
+    """The images of a product, evaluated on ``getInfo``"""
+
+    def __init__(self, product, start=None, end=None, filters=(), bands=None, added=None, bounds=None):
+        self.product = product
+        self.start = start
+        self.end = end
+        self.filters = list(filters)
+        self.bands = bands
+        self.added = dict(added or {})  # the bands added by ``map``, name -> value
+        self.bounds = bounds
+        self._pixel_memo = None  # the pixels of each location, only kept while the samples are evaluated
+
+    def _copy(self, **changes):
+        attributes = dict(product=self.product, start=self.start, end=self.end, filters=self.filters,
+                          bands=self.bands, added=self.added, bounds=self.bounds)
+        attributes.update(changes)
+        return ImageCollection(**attributes)
+
+    def filterDate(self, start, end=None):
+        return self._copy(start=start, end=end)
+
+    def filter(self, ee_filter):
+        return self._copy(filters=self.filters + [ee_filter])
+
+    def filterBounds(self, geometry):
+        return self._copy(bounds=geometry)
+
+    def select(self, bands):
+        return self._copy(bands=[bands] if isinstance(bands, str) else list(bands))
+
+    def map(self, function):
+        image = function(Image(self._bands(), dict(self.added), self))
+        if isinstance(image, FeatureCollection):  # e.g. the samples of reduceRegions, mapped over each image
+            def features():
+                images = self._copy()
+                images._pixel_memo = {}
+                ids, times, _ = images._images()
+                return [feature for position, (image_id, image_time) in enumerate(zip(ids, times.tolist()))
+                        for feature in function(Image(self._bands(), dict(self.added), images, position, {
+                            'system:index': image_id, 'system:time_start': image_time}))._features()]
+            return FeatureCollection(features)
+        return self._copy(added=image.value if isinstance(image.value, dict) else {})
+
+    def _is_s1(self):
+        return self.product.startswith('COPERNICUS/S1')
+
+    def _images(self):
+        """The ids, times in ms and orbit pass codes of the images"""
+        start = pd.Timestamp(self.start or '2015-01-01')
+        end = pd.Timestamp(self.end or '2020-12-31')
+        if not self._is_s1():
+            days = pd.date_range(start, end - pd.Timedelta(microseconds=1), freq='%dD' % COMPOSITE_DAYS)
+            return list(days.strftime('%Y_%m_%d')), days.asi8 // 10 ** 6, np.zeros(len(days), dtype=int)
+        passes = ['ASCENDING', 'DESCENDING']
+        for ee_filter in self.filters:
+            if ee_filter.kind == 'eq' and ee_filter.name == 'orbitProperties_pass':
+                passes = [ee_filter.value]
+        ids, times, codes = [], [], []
+        for orbit_pass in passes:
+            code = ['ASCENDING', 'DESCENDING'].index(orbit_pass)
+            hours = pd.Timedelta(hours=18 if code == 0 else 6)  # the local evening and morning overpasses
+            days = pd.date_range(start + pd.Timedelta(days=code * 3) + hours, end, freq='%dD' % S1_REVISIT_DAYS)
+            for pos, day in enumerate(days):
+                platform = 'AB'[pos % 2]
+                absolute_orbit = 9000 + pos * 87
+                ids.append('S1%s_IW_GRDH_1SDV_%s_%s_%06d_%06X_%04X' % (
+                    platform, day.strftime('%Y%m%dT%H%M%S'), (day + pd.Timedelta(seconds=25)).strftime('%Y%m%dT%H%M%S'),
+                    absolute_orbit, pos, pos % 65536))
+                times.append(day.value // 10 ** 6)
+                codes.append(code)
+        order = np.argsort(times, kind='stable')
+        return [ids[pos] for pos in order], np.asarray(times, dtype=np.int64)[order], np.asarray(codes)[order]
+
+    def _bands(self):
+        return list(self.bands or []) + [name for name in self.added if name not in (self.bands or [])]
+
+    def _request(self, *args):
+        filters = [(ee_filter.kind, ee_filter.name, ee_filter.value) for ee_filter in self.filters]
+        return (self.product, self.start, self.end, filters, self._bands()) + args
+
+    def size(self):
+        return ComputedObject(lambda: len(self._images()[0]), self._request('size'))
+
+    def first(self):
+        band = S1_BAND if self._is_s1() else COMPOSITE_BAND
+        return FirstImage(lambda: [dict(band, id=name) for name in self._bands()], band['crs'])
+
+    def getRegion(self, geometry, scale=None, crs=None):
+        return ComputedObject(lambda: self._region(geometry, scale),
+                              self._request('getRegion', geometry.coordinates, geometry.distance, scale))
+
+    def _pixels(self, geometry, scale):
+        """The image positions, coordinates and band values of the pixels of a location, the same on every call"""
+        lon, lat = geometry.coordinates
+        scale = scale or 30
+        key = (lon, lat, geometry.distance, scale)
+        if self._pixel_memo is not None and key in self._pixel_memo:
+            return self._pixel_memo[key]
+        ids, times, codes = self._images()
+        n_pixels = max(1, int(round(math.pi * (geometry.distance / scale) ** 2)))
+        seed = zlib.crc32(('%s %.6f %.6f' % (self.product, lon, lat)).encode())
+        rng = np.random.default_rng(seed)
+        n_rows = len(ids) * n_pixels
+        image_pos = np.repeat(np.arange(len(ids)), n_pixels)
+        offsets = rng.uniform(-1, 1, (2, n_pixels)) * (geometry.distance or scale) / 111320
+        bands = {}
+        for name in self._bands():
+            value = self.added.get(name)
+            if isinstance(value, tuple) and value[0] == 'indexOf':
+                bands[name] = codes[image_pos]
+                continue
+            if name in self.added and not callable(value):
+                bands[name] = np.full(n_rows, value)
+                continue
+            kind, low, high = BAND_VALUES.get(name, ('uniform', 0, 1))
+            values = getattr(rng, kind)(low, high, n_rows)
+            if kind != 'integers':
+                values = values.round(6)
+            bands[name] = value(values) if callable(value) else values  # e.g. the raw dB in linear power
+        pixels = {'ids': ids, 'times': times, 'image_pos': image_pos, 'lons': np.tile(lon + offsets[0], len(ids)),
+                  'lats': np.tile(lat + offsets[1], len(ids)), 'bands': bands}
+        if self._pixel_memo is not None:
+            self._pixel_memo[key] = pixels
+        return pixels
+
+    def _region(self, geometry, scale):
+        pixels = self._pixels(geometry, scale)
+        image_pos = pixels['image_pos']
+        columns = [[pixels['ids'][pos] for pos in image_pos], pixels['lons'].tolist(), pixels['lats'].tolist(),
+                   pixels['times'][image_pos].tolist()] + [values.tolist() for values in pixels['bands'].values()]
+        return [['id', 'longitude', 'latitude', 'time'] + self._bands()] + [list(row) for row in zip(*columns)]
@@ -0,0 +1,163 @@
+"""Synthetic inputs of the offline benchmarks
+
+Writes realistic stand-ins of the raw inputs of the pipeline: a random
+site table, an ISMN download of hourly ``.stm`` files in both header
+layouts ``utils.readstm_all`` reads, and SPL3SMP granules on the 964 x 406
+EASE 2.0 36 km grid with the AM and PM soil moisture, quality flag and bulk
+density datasets ``SMAPExtractor`` reads.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+
+SMAP_SHAPE = (406, 964)  # rows x columns of the global EASE 2.0 36 km grid
+SMAP_FILL_VALUE = -9999
+QUALITY_FILL_VALUE = 65534
+STM_LAYOUTS = (1, 2)  # 1: the header is repeated on every record, 2: a header line and date value flag records
+
+
+def synthetic_site_table(n_sites, seed=0):
+    """A random site table, the sites spread over the land between 50S and 60N"""
+    rng = np.random.default_rng(seed)
+    networks = ['NET%d' % (site_pos // 50) for site_pos in range(n_sites)]  # 50 stations per network
+    stations = ['ST%d' % site_pos for site_pos in range(n_sites)]
+    sites = pd.DataFrame({'network': networks, 'station': stations,
+                          'lat': rng.uniform(-50, 60, n_sites).round(5),
+                          'lon': rng.uniform(-120, 150, n_sites).round(5)})
+    sites['site_id'] = sites.network + '_' + sites.station
+    return sites
+
+
+def write_stm(path, network, station, lat, lon, layout, start='2016-01-01', days=365, depth=(0.0, 0.05),
+              seed=0):
+    """Writes an hourly ``.stm`` file of random soil moisture records
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    network : str
+        The network of the station.
+    station : str
+        The station.
+    lat : float
+        The latitude of the station.
+    lon : float
+        The longitude of the station.
+    layout : int
+        1 for the header repeated on every record, 2 for a header line
+        followed by ``date time value flag flag`` records.
+    start : str, optional
+        The first day of the records. The default is '2016-01-01'.
+    days : int, optional
+        The number of days of records. The default is 365.
+    depth : tuple, optional
+        The depth from and to of the sensor in m. The default is
+        (0.0, 0.05).
+    seed : int, optional
+        The seed of the random values. The default is 0.
+    Returns
+    -------
+    None.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=days * 24, freq='h').strftime('%Y/%m/%d %H:%M')
+    values = rng.uniform(0, 0.5, len(times)).round(4).astype(str)
+    flags = rng.choice(np.array(['G', 'G', 'G', 'G', 'D01', 'M']), len(times))
+    site = '%s %s %.5f %.5f 100.0 %.2f %.2f' % (network, station, lat, lon, depth[0], depth[1])
+    with open(path, 'w') as file_out:
+        if layout == 1:
+            file_out.writelines('%s %s %s %s %s %s M\n' % (time, time, network, site, value, flag)
+                                for time, value, flag in zip(times, values, flags))
+        else:
+            file_out.write('%s %s Sensor\n' % (network, site))
+            file_out.writelines('%s %s %s M\n' % (time, value, flag) for time, value, flag in zip(times, values, flags))
+
+
+def write_ismn_archive(network_dir, sites, days=365, seed=0):
+    """Writes an ISMN download of the sites, ``<network>/<station>/*.stm``
+
+    Each station gets a surface soil moisture and a soil temperature file,
+    the stations alternate between both header layouts.
+
+    Parameters
+    ----------
+    network_dir : str
+        The root directory of the download.
+    sites : Pandas data frame
+        The ``network``, ``station``, ``lat`` and ``lon`` of the sites.
+    days : int, optional
+        The number of days of hourly records. The default is 365.
+    seed : int, optional
+        The seed of the random values. The default is 0.
+    Returns
+    -------
+    list
+        The paths of the soil moisture files.
+    """
+    end = (pd.Timestamp('2016-01-01') + pd.Timedelta(days=days - 1)).strftime('%Y%m%d')
+    sm_files = []
+    for site_pos, site in enumerate(sites.itertuples()):
+        station_dir = os.path.join(network_dir, site.network, site.station)
+        os.makedirs(station_dir, exist_ok=True)
+        layout = STM_LAYOUTS[site_pos % len(STM_LAYOUTS)]
+        for var_pos, variable in enumerate(['sm', 'ts']):
+            path = os.path.join(station_dir, '%s_%s_%s_%s_0.000000_0.050000_Sensor_20160101_%s.stm' % (
+                site.network, site.network, site.station, variable, end))
+            write_stm(path, site.network, site.station, site.lat, site.lon, layout, days=days,
+                      seed=seed + site_pos * 2 + var_pos)
+            if variable == 'sm':
+                sm_files.append(path)
+    return sm_files
+
+
+def write_smap_granules(data_dir, start='2016-01-01', days=30, seed=0):
+    """Writes daily SPL3SMP granules of random soil moisture
+
+    The datasets are chunked and compressed as in the SMAP products, about
+    30 % of the cells are fill values.
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory of the granules.
+    start : str, optional
+        The first day. The default is '2016-01-01'.
+    days : int, optional
+        The number of daily granules. The default is 30.
+    seed : int, optional
+        The seed of the random values. The default is 0.
+    Returns
+    -------
+    list
+        The paths of the granules.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for day in pd.date_range(start, periods=days):
+        path = os.path.join(data_dir, 'SMAP_L3_SM_P_%s_R18290_001.h5' % day.strftime('%Y%m%d'))
+        with h5py.File(path, 'w') as granule:
+            for group_name, suffix in (('Soil_Moisture_Retrieval_Data_AM', ''), ('Soil_Moisture_Retrieval_Data_PM', '_pm')):
+                group = granule.create_group(group_name)
+                soil_moisture = rng.uniform(0.02, 0.5, SMAP_SHAPE).astype(np.float32)
+                fill = rng.random(SMAP_SHAPE) < 0.3
+                soil_moisture[fill] = SMAP_FILL_VALUE
+                dataset = group.create_dataset('soil_moisture' + suffix, data=soil_moisture, chunks=(58, 138),
+                                               compression='gzip')
+                dataset.attrs['_FillValue'] = np.float32(SMAP_FILL_VALUE)
+                quality = rng.integers(0, 16, SMAP_SHAPE).astype(np.uint16)
+                quality[fill] = QUALITY_FILL_VALUE
+                dataset = group.create_dataset('retrieval_qual_flag' + suffix, data=quality, chunks=(58, 138),
+                                               compression='gzip')
+                dataset.attrs['_FillValue'] = np.uint16(QUALITY_FILL_VALUE)
+                bulk_density = rng.uniform(1.0, 1.8, SMAP_SHAPE).astype(np.float32)
+                bulk_density[fill] = SMAP_FILL_VALUE
+                dataset = group.create_dataset('bulk_density' + suffix, data=bulk_density, chunks=(58, 138),
+                                               compression='gzip')
+                dataset.attrs['_FillValue'] = np.float32(SMAP_FILL_VALUE)
+        paths.append(path)
+    return paths
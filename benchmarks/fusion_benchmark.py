@@ -0,0 +1,109 @@
+"""Benchmark of the batched fusion against the per-site merge loop
+
+Builds synthetic Sentinel-1, NDVI, SMAP and ground series for many sites,
+runs the merge/interpolate loop of ``Extract GEE data.ipynb`` and
+``fusion.fuse_sites`` on them, checks that both give the same input
+records and prints the run times.
+
+    python benchmarks/fusion_benchmark.py --sites 300
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fusion import INPUT_COLUMNS, INTERPOLATE_BANDS, fuse_sites  # noqa: E402
+from SiteCube import Calendar  # noqa: E402
+
+
+def synthetic_sites(n_sites, seed=0):
+    """Synthetic inputs of the fusion, as read by the notebook for each site"""
+    rng = np.random.default_rng(seed)
+    smap_dates = pd.date_range('2015-12-01', '2019-12-31', freq='D').rename('time')
+    s1_dates = pd.date_range('2016-01-01', '2019-12-31', freq='D').rename('time')
+    ground_calendar = Calendar.cached('2016-01-01', '2019-12-31')
+    s1, ndvi, smap, ground = {}, {}, {}, {}
+    for site_pos in range(n_sites):
+        site = 'NET_ST%d' % site_pos
+        passes = {}
+        for code, orbit_pass in enumerate(['ASCENDING', 'DESCENDING']):
+            dates = s1_dates[(site_pos + code * 3) % 6::6][:rng.integers(0, 250)]  # some sites miss a pass
+            dates = dates[np.sort(rng.choice(len(dates), len(dates) * 9 // 10, replace=False))] if len(dates) else dates
+            df = ground_calendar.date_df.loc[dates].copy()
+            df['VV'] = rng.normal(-12, 2, len(dates))
+            df['VH'] = rng.normal(-18, 2, len(dates))
+            df['angle'] = rng.uniform(30, 45, len(dates))
+            df['platform'] = rng.choice([0, -1], len(dates))
+            df['relative_orbit'] = rng.integers(1, 176, len(dates))
+            df['orbit_pass'] = code
+            passes[orbit_pass] = df
+        s1[site] = passes
+        ndvi_dates = pd.date_range('2015-12-03', '2020-01-31', freq='8D').rename('time')
+        df_ndvi = pd.DataFrame({'NDVI': rng.uniform(0.1, 0.9, len(ndvi_dates)),
+                                'EVI': rng.uniform(0.1, 0.6, len(ndvi_dates))}, index=ndvi_dates)
+        df_ndvi[rng.random(len(ndvi_dates)) < 0.1] = np.nan  # masked composites
+        ndvi[site] = df_ndvi
+        sm = rng.uniform(0.05, 0.45, len(smap_dates))
+        sm[rng.random(len(smap_dates)) < 0.5] = np.nan  # no overpass or retrieval
+        smap[site] = pd.Series(sm, index=smap_dates, name='SMAP')
+        df_gt = ground_calendar.date_df.copy()
+        df_gt['sm'] = rng.uniform(0.05, 0.45, len(df_gt))
+        df_gt['ts'] = rng.uniform(-5, 30, len(df_gt))
+        df_gt['sm_count'] = 1.0
+        df_gt.loc[rng.random(len(df_gt)) < 0.2, ['sm', 'ts', 'sm_count']] = np.nan
+        ground[site] = df_gt
+    return s1, ndvi, smap, ground
+
+
+def merge_loop(s1, ndvi, smap, ground):
+    """The per-site merge of the notebook, ``DataFrame.append`` replaced by ``pd.concat``"""
+    inputs = {}
+    for site in s1:
+        df_all = pd.DataFrame(columns=['time'] + INPUT_COLUMNS).set_index('time')
+        for df_S1 in s1[site].values():
+            if len(df_S1) == 0:
+                continue
+            df_pass = pd.concat([df_S1, ndvi[site], smap[site]], axis=1).sort_index()
+            df_pass[INTERPOLATE_BANDS] = df_pass[INTERPOLATE_BANDS].interpolate(limit_area='inside')
+            df_pass = pd.concat([df_pass, ground[site]], axis=1)
+            df_pass = df_pass.loc[df_S1.index]
+            df_pass = df_pass.loc[:, ~df_pass.columns.duplicated()]
+            df_all = pd.concat([df_all, df_pass]) if len(df_all) else df_pass.reindex(columns=INPUT_COLUMNS)
+        inputs[site] = df_all.sort_index(kind='stable')
+    return inputs
+
+
+def check_same(loop_inputs, fused_inputs):
+    for site, expected in loop_inputs.items():
+        actual = fused_inputs[site]
+        if len(expected) == 0 and len(actual) == 0:
+            continue
+        pd.testing.assert_frame_equal(actual.astype(float), expected[INPUT_COLUMNS].astype(float),
+                                      check_exact=True, check_freq=False, check_index_type=False, check_names=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sites', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    inputs = synthetic_sites(args.sites, args.seed)
+    start = time.perf_counter()
+    loop_inputs = merge_loop(*inputs)
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fused_inputs = fuse_sites(*inputs)
+    fused_time = time.perf_counter() - start
+    check_same(loop_inputs, fused_inputs)
+    print('%d sites, %d records' % (args.sites, sum(len(df) for df in fused_inputs.values())))
+    print('merge loop  %8.3f s' % loop_time)
+    print('fuse_sites  %8.3f s  (x%.1f)' % (fused_time, loop_time / fused_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Offline benchmark of the hot paths of the pipeline
+
+Writes synthetic ISMN ``.stm`` files, SPL3SMP granules and site tables
+(``fixtures.py``), replaces the ``ee`` module by the offline ``fake_ee.py``
+and times the ISMN catalog and reader, the reprojection, ``DateTool``, the
+SMAP extractor, the ``download_data`` of both GEE extractors and the site
+merge at several numbers of sites. Each benchmark is run once under
+``tracemalloc`` for its peak memory and ``--repeat`` times without it, the
+best time is kept. The results are printed and written to a JSON file,
+``--baseline`` compares them with the results of a previous run.
+
+    python benchmarks/pipeline_benchmark.py --sites 10 100 2000 --output results.json
+    python benchmarks/pipeline_benchmark.py --latency 0.2 --baseline results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fake_ee  # noqa: E402
+sys.modules['ee'] = fake_ee  # the extractors import the offline ee, only within the benchmarks
+from fixtures import synthetic_site_table, write_ismn_archive, write_smap_granules  # noqa: E402
+from fusion_benchmark import synthetic_sites  # noqa: E402
+from fusion import fuse_sites  # noqa: E402
+from GeeRequestExecutor import GeeRequestExecutor  # noqa: E402
+from SMAPExtractor import QUALITY_FLAG_AM, SOIL_MOISTURE_AM, SOIL_MOISTURE_PM, SMAPExtractor  # noqa: E402
+from TimeseriesExtractor import (EASE_EPSG, DateTool, GeeS1TimeseriesExtractor,  # noqa: E402
+                                 GeeTimeseriesExtractor, PointGeometry)
+from utils import listdir_sm, readstm_all  # noqa: E402
+
+S1_PRODUCT = 'COPERNICUS/S1_GRD'
+S1_BANDS = ['VV', 'VH', 'angle']
+MOD_PRODUCT = 'MODIS/006/MOD13Q1'
+NDVI_BANDS = ['NDVI', 'EVI']
+START_DATE = '2016-01-01'
+END_DATE = '2019-12-31'
+GEE_BENCHMARKS = ['GeeS1TimeseriesExtractor.download_data', 'GeeTimeseriesExtractor.download_data']
+BENCHMARKS = ['listdir_sm', 'readstm_all', 'PointGeometry.re_project', 'PointGeometry.re_project_points',
+              'DateTool.get_all_date_df', 'SMAPExtractor.extract'] + GEE_BENCHMARKS + ['fusion.fuse_sites']
+
+
+def measure(name, n_sites, items, function, setup=None, repeat=1):
+    """Times a benchmark and measures its peak memory
+
+    Returns
+    -------
+    dict
+        The benchmark, number of sites and items, best time in s, items
+        per s and peak memory in MB of the Python allocations.
+    """
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    best = min(seconds)
+    return {'benchmark': name, 'sites': n_sites, 'items': items, 'seconds': best,
+            'throughput': items / best if best > 0 else float('inf'), 'peak_mb': peak / 2 ** 20}
+
+
+def run_sites(n_sites, args, work_dir, smap_dir):
+    results = []
+
+    def add(name, items, function, setup=None):
+        if name not in args.benchmarks:
+            return
+        fake_ee.reset_stats()
+        result = measure(name, n_sites, items, function, setup, args.repeat)
+        if name in GEE_BENCHMARKS:  # the requests and getRegion rows of one run
+            result['requests'] = fake_ee.STATS['requests'] // (args.repeat + 1)
+            result['rows'] = fake_ee.STATS['rows'] // (args.repeat + 1)
+        results.append(result)
+
+    sites = synthetic_site_table(n_sites, args.seed)
+    if {'listdir_sm', 'readstm_all'} & set(args.benchmarks):
+        network_dir = os.path.join(work_dir, 'ismn_%d' % n_sites)
+        sm_files = write_ismn_archive(network_dir, sites, args.stm_days, args.seed)
+        catalog_file = network_dir + '_catalog.pkl'
+
+        def cold_catalog():
+            if os.path.exists(catalog_file):
+                os.remove(catalog_file)
+
+        add('listdir_sm', len(sm_files), lambda: listdir_sm(network_dir), cold_catalog)
+        add('readstm_all', len(sm_files), lambda: [readstm_all(file, 'sm', START_DATE, END_DATE) for file in sm_files])
+        shutil.rmtree(network_dir)
+        cold_catalog()
+
+    geometry = PointGeometry(4326, EASE_EPSG)
+    lons, lats = sites.lon.to_numpy(), sites.lat.to_numpy()
+    add('PointGeometry.re_project', n_sites, lambda: [geometry.re_project(lon, lat) for lon, lat in zip(lons, lats)])
+    add('PointGeometry.re_project_points', n_sites, lambda: geometry.re_project_points(lons, lats))
+    dates = pd.date_range(START_DATE, END_DATE, freq='D')
+    add('DateTool.get_all_date_df', n_sites, lambda: [DateTool(dates).get_all_date_df() for _ in range(n_sites)])
+
+    if smap_dir is not None:
+        rows, columns = geometry.ease_grid_cells(lons, lats)
+        variables = [SOIL_MOISTURE_AM, SOIL_MOISTURE_PM, QUALITY_FLAG_AM]
+        smap_end = (pd.Timestamp(START_DATE) + pd.Timedelta(days=args.smap_days - 1)).strftime('%Y-%m-%d')
+        extractor = SMAPExtractor(smap_dir, np.column_stack([rows, columns]), variables, START_DATE, smap_end,
+                                  use_processes=False)  # the reads of a process pool are not seen by tracemalloc
+        add('SMAPExtractor.extract', n_sites, extractor.extract)
+
+    executor = GeeRequestExecutor(max_in_flight=args.max_in_flight, requests_per_second=None)
+    site_rows = list(sites.itertuples())
+
+    def download_s1(site):
+        s1_extractor = GeeS1TimeseriesExtractor(S1_PRODUCT, START_DATE, END_DATE, S1_BANDS,
+                                                (site.lon, site.lat, args.buffer), None, 'IW', '', False,
+                                                executor=executor)
+        return s1_extractor.download_data()
+
+    add('GeeS1TimeseriesExtractor.download_data', n_sites, lambda: executor.map(download_s1, site_rows))
+    if 'GeeTimeseriesExtractor.download_data' in args.benchmarks:
+        ndvi_extractor = GeeTimeseriesExtractor(MOD_PRODUCT, NDVI_BANDS, START_DATE, END_DATE, '', False,
+                                                executor=executor)
+        add('GeeTimeseriesExtractor.download_data', n_sites,
+            lambda: executor.map(lambda site: ndvi_extractor.download_data((site.lon, site.lat)), site_rows))
+
+    if 'fusion.fuse_sites' in args.benchmarks:
+        inputs = synthetic_sites(n_sites, args.seed)
+        add('fusion.fuse_sites', n_sites, lambda: fuse_sites(*inputs))
+    return results
+
+
+def compare(results, baseline_file):
+    """Adds the speedup and memory ratio to the results of a previous run"""
+    with open(baseline_file) as file_in:
+        baseline = {(record['benchmark'], record['sites']): record for record in json.load(file_in)['results']}
+    for result in results:
+        previous = baseline.get((result['benchmark'], result['sites']))
+        if previous is not None:
+            result['speedup'] = previous['seconds'] / result['seconds'] if result['seconds'] > 0 else float('inf')
+            result['memory_ratio'] = result['peak_mb'] / previous['peak_mb'] if previous['peak_mb'] > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sites', type=int, nargs='+', default=[10, 100, 2000])
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs of each benchmark, the best is kept')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of each fake GEE request in s')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='concurrent GEE requests')
+    parser.add_argument('--buffer', type=float, default=50, help='buffer of the Sentinel-1 locations in m')
+    parser.add_argument('--stm-days', type=int, default=365, help='days of hourly records of each .stm file')
+    parser.add_argument('--smap-days', type=int, default=30, help='daily SMAP granules')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='directory of the synthetic inputs, a temporary one by '
+                                                         'default')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file of the results')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare with')
+    args = parser.parse_args()
+    fake_ee.configure(latency=args.latency)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        smap_dir = None
+        if 'SMAPExtractor.extract' in args.benchmarks:
+            smap_dir = os.path.join(work_dir, 'smap')
+            write_smap_granules(smap_dir, START_DATE, args.smap_days, args.seed)
+        results = []
+        for n_sites in args.sites:
+            for result in run_sites(n_sites, args, work_dir, smap_dir):
+                results.append(result)
+                print('%-40s %6d sites %10.3f s %12.1f items/s %9.1f MB' % (
+                    result['benchmark'], n_sites, result['seconds'], result['throughput'], result['peak_mb']),
+                    flush=True)
+        if smap_dir is not None:
+            shutil.rmtree(smap_dir)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if args.baseline is not None:
+        compare(results, args.baseline)
+        for result in results:
+            if 'speedup' in result:
+                print('%-40s %6d sites  x%.2f speed  x%.2f memory' % (
+                    result['benchmark'], result['sites'], result['speedup'], result['memory_ratio'] or float('nan')))
+    with open(args.output, 'w') as file_out:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+                   'platform': platform.platform(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                   'args': vars(args), 'results': results}, file_out, indent=1)
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
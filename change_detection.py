@@ -0,0 +1,191 @@
+"""Batched change detection retrieval of soil moisture from Sentinel-1
+
+The STCD (short term change detection, the total VV backscatter) and ACD
+(the backscatter of the soil once the water cloud model vegetation term is
+removed) methods scale the SMAP prior of a window of acquisitions of a
+relative orbit by their backscatter ratios. The acquisitions of all sites
+and orbits are packed into (series x acquisitions) arrays (``pack_series``)
+and retrieved at once (``retrieve``); ``retrieve_store`` runs the input
+dataset of a PipelineStore in chunks of sites across a process pool.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from TimeseriesExtractor import OrbitGroups
+from Tracer import init_worker_tracer, worker_tracer_args
+from utils import Calculate_SMAP_VWC
+
+# water cloud model coefficients of VV for the vegetation water content (kg/m2), the vegetation term is
+# A*VWC*cos(angle)*(1-tau2) and the two way attenuation tau2=exp(-2*B*VWC/cos(angle))
+WCM_A = 0.0012
+WCM_B = 0.091
+MV_MIN = 0.02 # lower bound of the retrieved soil moisture (m3/m3)
+MV_MAX = 0.5 # upper bound without the porosity of the site
+PARTICLE_DENSITY = 2.65 # g/cm3, the porosity is 1-bulk density/particle density
+FOREST_CLASSES = range(111, 127) # Copernicus landcover forests, the woody vegetation of Calculate_SMAP_VWC
+METHODS = {'STCD': {'window': 3, 'vegetation': False}, # short windows of the total backscatter
+           'ACD': {'window': 7, 'vegetation': True}} # longer windows of the vegetation corrected soil backscatter
+COLUMNS = ['VV', 'angle', 'NDVI', 'SMAP']
+
+
+def site_parameters(site_info):
+    # porosity and vegetation type of each site_id from the site_info table (roh_b and the LC<year> landcover)
+    site_id=site_info['network']+'_'+site_info['station']
+    porosity=np.full(len(site_info), MV_MAX)
+    if 'roh_b' in site_info:
+        porosity=1-site_info['roh_b'].to_numpy(dtype=float)/PARTICLE_DENSITY
+    veg_type=np.zeros(len(site_info), dtype=int)
+    lc_columns=sorted(column for column in site_info.columns if column.startswith('LC'))
+    if lc_columns: # the latest year
+        veg_type=pd.to_numeric(site_info[lc_columns[-1]], errors='coerce').isin(FOREST_CLASSES).to_numpy().astype(int)
+    return pd.DataFrame({'porosity': porosity, 'veg_type': veg_type}, index=site_id.to_numpy())
+
+
+def pack_series(frames, sites, columns=COLUMNS):
+    # stack the acquisitions of each (site, relative orbit) into (series x acquisitions) arrays, NaN padded
+    # returns the arrays of each column, the site position of each series and the (site, row) of each cell
+    series_site, series_len, row_pos, site_start=[], [], [], [0]
+    for site_pos, site in enumerate(sites):
+        df=frames[site]
+        valid=np.flatnonzero(df['VV'].notna().to_numpy() & df['relative_orbit'].notna().to_numpy())
+        for rows in OrbitGroups(df['relative_orbit'].to_numpy()[valid]).groups().values():
+            series_site.append(site_pos)
+            series_len.append(len(rows))
+            row_pos.append(valid[rows])
+        site_start.append(site_start[-1]+len(df))
+    n_series=len(series_len)
+    length=max(series_len, default=0)
+    series_len=np.asarray(series_len, dtype=np.int64)
+    series_idx=np.repeat(np.arange(n_series), series_len)
+    pos_idx=np.arange(series_len.sum())-np.repeat(np.cumsum(series_len)-series_len, series_len)
+    row_pos=np.concatenate(row_pos) if row_pos else np.empty(0, np.int64)
+    series_site=np.asarray(series_site, dtype=np.int64)
+    all_rows=row_pos+np.asarray(site_start[:-1], dtype=np.int64)[series_site[series_idx]] # rows of the frames stacked
+    cells=(series_idx, pos_idx)
+    values={}
+    for column in columns:
+        stacked=[pd.to_numeric(frames[site][column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                 for site in sites]
+        values[column]=np.full((n_series, length), np.nan)
+        if stacked:
+            values[column][cells]=np.concatenate(stacked)[all_rows]
+    return values, series_site, cells, row_pos
+
+
+def soil_backscatter(vv_db, angle, ndvi, veg_type, a=WCM_A, b=WCM_B):
+    # remove the vegetation contribution of the water cloud model from the VV backscatter (dB) -> linear
+    sigma=10**(vv_db/10)
+    vwc=np.where(veg_type==1, Calculate_SMAP_VWC(ndvi, 1), Calculate_SMAP_VWC(ndvi, 0))
+    vwc=np.maximum(vwc, 0)
+    cos=np.cos(np.deg2rad(angle))
+    tau2=np.exp(-2*b*vwc/cos)
+    soil=(sigma-a*vwc*cos*(1-tau2))/tau2
+    return np.where(soil>0, soil, np.nan)
+
+
+def _forward_sum(values, window):
+    # sum over the windows starting at each acquisition, NaN counted as 0 (shorter windows at the end)
+    length=values.shape[1]
+    cum=np.pad(np.cumsum(np.nan_to_num(values), axis=1), ((0, 0), (1, 0)))
+    starts=np.arange(length)
+    return cum[:, np.minimum(starts+window, length)]-cum[:, starts]
+
+
+def _backward_sum(values, window):
+    # sum over the windows ending at each acquisition
+    length=values.shape[1]
+    cum=np.pad(np.cumsum(np.nan_to_num(values), axis=1), ((0, 0), (1, 0)))
+    ends=np.arange(length)+1
+    return cum[:, ends]-cum[:, np.maximum(ends-window, 0)]
+
+
+def change_detection(log_sigma, prior, window, mv_min, mv_max, sensitivity=1.0):
+    # the soil moisture ratio of two acquisitions of an orbit is the backscatter ratio**(1/sensitivity): within a
+    # window of consecutive acquisitions log(mv)=c+log(sigma)/sensitivity, c is the least squares fit to the prior
+    # (SMAP) of the window. The estimate of an acquisition averages the c of all windows holding it.
+    # log_sigma, prior: (series x acquisitions), mv_min/mv_max: scalars or (series x 1) bounds
+    y=log_sigma/sensitivity
+    offset=np.log(np.clip(prior, mv_min, mv_max))-y
+    fitted=~np.isnan(offset)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c=_forward_sum(offset, window)/_forward_sum(fitted.astype(float), window)
+        c_mean=_backward_sum(c, window)/_backward_sum((~np.isnan(c)).astype(float), window)
+    return np.clip(np.exp(y+c_mean), mv_min, mv_max)
+
+
+def retrieve(frames, method='ACD', parameters=None, sensitivity=1.0):
+    # retrieve the soil moisture of all sites and relative orbits at once from their input/ frames
+    # frames: {site_id: input data frame}, parameters: site_parameters of the sites (default porosity MV_MAX)
+    # returns {site_id: data frame of sm_<method> indexed like the input}, NaN where no retrieval
+    settings=METHODS[method]
+    sites=list(frames)
+    values, series_site, cells, row_pos=pack_series(frames, sites)
+    if parameters is None:
+        parameters=pd.DataFrame({'porosity': MV_MAX, 'veg_type': 0}, index=sites)
+    parameters=parameters.reindex(sites)
+    porosity=parameters['porosity'].fillna(MV_MAX).clip(MV_MIN, MV_MAX).to_numpy()[series_site][:, None]
+    veg_type=parameters['veg_type'].fillna(0).to_numpy()[series_site][:, None]
+    if settings['vegetation']:
+        sigma=soil_backscatter(values['VV'], values['angle'], values['NDVI'], veg_type)
+    else:
+        sigma=10**(values['VV']/10)
+    mv=change_detection(np.log(sigma), values['SMAP'], settings['window'], MV_MIN, porosity, sensitivity)
+    column='sm_'+method
+    out={}
+    flat=mv[cells]
+    bounds=np.searchsorted(series_site[cells[0]], np.arange(len(sites)+1))
+    for site_pos, site in enumerate(sites):
+        sm=np.full(len(frames[site]), np.nan)
+        sm[row_pos[bounds[site_pos]:bounds[site_pos+1]]]=flat[bounds[site_pos]:bounds[site_pos+1]]
+        out[site]=pd.DataFrame({column: sm}, index=frames[site].index)
+    return out
+
+
+def _retrieve_chunk(store_dir, sites, methods, parameters, sensitivity):
+    # read, retrieve and write the sites of a chunk, only one chunk of inputs is held in memory by a worker
+    from PipelineStore import PipelineStore
+    store=PipelineStore(store_dir)
+    frames={}
+    for network, station in sites: # only the partition of each site is opened
+        df=store.read('input', network=network, station=station)
+        if len(df):
+            frames[network+'_'+station]=df
+    if not frames:
+        return 0
+    results=[retrieve(frames, method, parameters, sensitivity) for method in methods]
+    for network, station in sites:
+        site_id=network+'_'+station
+        if site_id in frames:
+            site_out=pd.concat([frames[site_id][['sm']]]+[result[site_id] for result in results], axis=1)
+            store.write('retrieval', site_out, network, station)
+    return len(frames)
+
+
+def retrieve_store(store_dir, sites=None, methods=('STCD', 'ACD'), n_workers=None, chunk_size=64, sensitivity=1.0):
+    # run the retrieval over the input dataset of a PipelineStore across a process pool, chunk_size sites per task
+    # bound the memory of each worker. The ground sm and the sm_<method> of each site go to the retrieval dataset.
+    # n_workers=1 runs in the current process. Returns the number of sites and the throughput in sites per second
+    from PipelineStore import PipelineStore
+    store=PipelineStore(store_dir)
+    site_info=store.read_table('site_info')
+    parameters=site_parameters(site_info) if len(site_info) else None
+    if sites is None:
+        sites=store.sites('input')
+    keys=list(zip(sites['network'], sites['station']))
+    chunks=[keys[start:start+chunk_size] for start in range(0, len(keys), chunk_size)]
+    args=[(store_dir, chunk, list(methods), parameters, sensitivity) for chunk in chunks]
+    start=time.perf_counter()
+    if n_workers==1:
+        counts=[_retrieve_chunk(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(), initializer=init_worker_tracer,
+                                 initargs=worker_tracer_args()) as executor:
+            counts=list(executor.map(_retrieve_chunk, *zip(*args))) if args else []
+    elapsed=time.perf_counter()-start
+    n_sites=sum(counts)
+    rate=n_sites/elapsed if elapsed>0 else float('nan')
+    print('%d sites retrieved in %.1f s, %.1f sites/s' % (n_sites, elapsed, rate))
+    return n_sites, rate
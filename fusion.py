@@ -0,0 +1,169 @@
+"""Batched fusion of the extracted data into the input records of the sites
+
+The per-site loop of ``Extract GEE data.ipynb`` merged, for each orbit pass
+of a site, the Sentinel-1 acquisitions with the NDVI and SMAP series,
+interpolated these inside their valid days and read the ground data on the
+acquisition dates. ``fuse_sites`` does the same for all sites at once on
+(sites x days) arrays of a shared calendar, and only fuses the tail of the
+records an update changes for the sites given a high-water mark.
+"""
+
+import numpy as np
+import pandas as pd
+from SiteCube import Calendar
+from Tracer import span
+
+# the columns of the input/ records of each site
+INPUT_COLUMNS = ['Excel_day', 'DoY', 'VV', 'VH', 'angle', 'relative_orbit', 'platform', 'orbit_pass', 'NDVI', 'EVI',
+                 'SMAP', 'sm', 'ts', 'sm_count']
+INTERPOLATE_BANDS = ['NDVI', 'EVI', 'SMAP']
+
+
+def _span(frames):
+    starts=[frame.index.min() for frame in frames if len(frame)]
+    ends=[frame.index.max() for frame in frames if len(frame)]
+    return min(starts), max(ends)
+
+
+def _columns(frames, exclude=()):
+    # union of the columns of the frames, in order of appearance
+    columns=[]
+    for frame in frames:
+        columns.extend(column for column in frame.columns if column not in columns and column not in exclude)
+    return columns
+
+
+def _planes(frames, sites, columns, calendar):
+    # (columns x sites x days) values of per site frames and the days each site has a row on
+    values=np.full((len(columns), len(sites), len(calendar)), np.nan)
+    rows=np.zeros((len(sites), len(calendar)), dtype=bool)
+    for site_pos, site in enumerate(sites):
+        frame=frames.get(site)
+        if frame is None or not len(frame):
+            continue
+        days=calendar.day_index(frame.index)
+        rows[site_pos, days]=True
+        for col_pos, column in enumerate(columns):
+            if column in frame:
+                values[col_pos, site_pos, days]=pd.to_numeric(frame[column], errors='coerce').to_numpy(
+                    dtype=np.float64, na_value=np.nan)
+    return values, rows
+
+
+def interpolate_inside(values, rows, site_idx, day_idx):
+    # linear interpolation of the (sites x days) values at the target days, as DataFrame.interpolate(limit_area='inside')
+    # does on a frame holding the rows: the distance between two days is the number of rows between them
+    n_days=values.shape[1]
+    valid=~np.isnan(values)
+    days=np.arange(n_days)
+    prev_valid=np.maximum.accumulate(np.where(valid, days, -1), axis=1)
+    next_valid=np.minimum.accumulate(np.where(valid, days, n_days)[:, ::-1], axis=1)[:, ::-1]
+    position=np.cumsum(rows, axis=1) # row number of each day
+    out=values[site_idx, day_idx]
+    prev_day=prev_valid[site_idx, day_idx]
+    next_day=next_valid[site_idx, day_idx]
+    fill=np.isnan(out) & (prev_day>=0) & (next_day<n_days)
+    s, d, p, n=site_idx[fill], day_idx[fill], prev_day[fill], next_day[fill]
+    x0, x1=position[s, p].astype(float), position[s, n].astype(float)
+    y0, y1=values[s, p], values[s, n]
+    slope=(y1-y0)/(x1-x0) # the same arithmetic as numpy.interp
+    out[fill]=slope*(position[s, d]-x0)+y0
+    return out
+
+
+def _tail_start(values, calendar, mark):
+    # first day whose records may change once days after the mark are added: the interpolation of a band only
+    # reaches back to its last valid day up to the mark
+    if mark is None:
+        return calendar.dates[0]
+    end=int((pd.Timestamp(mark)-calendar.dates[0]).days)+1
+    if end<=0:
+        return calendar.dates[0]
+    valid=~np.isnan(values[:, :end])
+    if not valid.any(axis=1).all():
+        return calendar.dates[0]
+    last_valid=end-1-np.argmax(valid[:, ::-1], axis=1)
+    return calendar.dates[min(int(last_valid.min()), len(calendar)-1)]
+
+
+def fuse_sites(s1, ndvi, smap, ground, interpolate_bands=INTERPOLATE_BANDS, columns=INPUT_COLUMNS, since=None):
+    # merge the Sentinel-1, NDVI, SMAP and ground data of all sites at once: NDVI and SMAP are interpolated
+    # (inside only) on the acquisition dates of each orbit pass and the ground data is read on them
+    # s1: {site: {orbit pass: data frame}}, ndvi/smap/ground: {site: data frame or series}, all indexed by the dates
+    # returns the input/ records of each site, the rows of both passes sorted by date
+    # since: {site: high-water mark of its stored records}, only the tail that an update changes is fused for these
+    # sites, from the last valid day of the interpolated bands up to the mark
+    with span('fusion.fuse', sites=len(s1)) as stage:
+        fused=_fuse_sites(s1, ndvi, smap, ground, interpolate_bands, columns, since)
+        if stage:
+            stage.add(rows=sum(len(df) for df in fused.values()))
+        return fused
+
+
+def _fuse_sites(s1, ndvi, smap, ground, interpolate_bands, columns, since):
+    sites=list(s1)
+    smap={site: series.to_frame('SMAP') if isinstance(series, pd.Series) else series for site, series in smap.items()}
+    passes={}
+    for site in sites:
+        for orbit_pass, df_S1 in s1[site].items():
+            if len(df_S1):
+                passes.setdefault(orbit_pass, {})[site]=df_S1
+    all_frames=[df for frames in passes.values() for df in frames.values()]
+    if not all_frames:
+        return {site: pd.DataFrame(columns=columns).rename_axis('time') for site in sites}
+    calendar=Calendar.cached(*_span(all_frames+list(ndvi.values())+list(smap.values())+list(ground.values())))
+    s1_columns=_columns(all_frames)
+    ndvi_columns=_columns(list(ndvi.values()), exclude=s1_columns)
+    smap_columns=_columns(list(smap.values()), exclude=s1_columns+ndvi_columns)
+    aux_columns=ndvi_columns+smap_columns
+    ground_columns=_columns(list(ground.values()), exclude=s1_columns+aux_columns)
+    ndvi_values, ndvi_rows=_planes(ndvi, sites, ndvi_columns, calendar)
+    smap_values, smap_rows=_planes(smap, sites, smap_columns, calendar)
+    aux_values=np.concatenate([ndvi_values, smap_values])
+    aux_rows=ndvi_rows | smap_rows # the rows of the NDVI and SMAP frames merged on the dates
+    ground_values, _=_planes(ground, sites, ground_columns, calendar)
+
+    site_pos={site: pos for pos, site in enumerate(sites)}
+    # first day of each site whose records are fused, the days before the tail of the sites in since are skipped
+    start_day=np.zeros(len(sites), dtype=np.int64)
+    if since:
+        band_pos=[col_pos for col_pos, column in enumerate(aux_columns) if column in interpolate_bands]
+        for site, mark in since.items():
+            if site in site_pos:
+                start=_tail_start(aux_values[band_pos, site_pos[site]], calendar, mark)
+                start_day[site_pos[site]]=calendar.day_index([start])[0]
+    records=[]
+    for frames in passes.values():
+        pass_sites=list(frames)
+        lengths=[len(frames[site]) for site in pass_sites]
+        all_site_idx=np.array([site_pos[site] for site in pass_sites]).repeat(lengths)
+        all_day_idx=np.concatenate([calendar.day_index(frames[site].index) for site in pass_sites])
+        rows=aux_rows.copy()
+        rows[all_site_idx, all_day_idx]=True # all the acquisitions are rows of the merged frame of the pass
+        keep=all_day_idx>=start_day[all_site_idx]
+        if not keep.any():
+            continue
+        if not keep.all(): # only the tail is fused, the positions of the rows still count the earlier acquisitions
+            keeps=np.split(keep, np.cumsum(lengths)[:-1])
+            frames={site: frames[site][site_keep] for site, site_keep in zip(pass_sites, keeps)}
+        s1_df=pd.concat(frames.values(), keys=pass_sites, names=['site', 'time']).reset_index(level='site')
+        site_idx, day_idx=all_site_idx[keep], all_day_idx[keep]
+        for col_pos, column in enumerate(aux_columns):
+            if column in interpolate_bands:
+                s1_df[column]=interpolate_inside(aux_values[col_pos], rows, site_idx, day_idx)
+            else:
+                s1_df[column]=aux_values[col_pos, site_idx, day_idx]
+        for col_pos, column in enumerate(ground_columns):
+            s1_df[column]=ground_values[col_pos, site_idx, day_idx]
+        s1_df['_site_pos']=site_idx
+        records.append(s1_df)
+    if not records:
+        return {site: pd.DataFrame(columns=columns).rename_axis('time') for site in sites}
+    records=pd.concat(records)
+    order=np.lexsort((records.index.to_numpy(), records['_site_pos'].to_numpy()))
+    records=records.iloc[order]
+    bounds=np.searchsorted(records['_site_pos'].to_numpy(), np.arange(len(sites)+1))
+    records=records.drop(columns=['site', '_site_pos'])
+    if columns is not None:
+        records=records.reindex(columns=columns)
+    return {site: records.iloc[bounds[pos]:bounds[pos+1]] for pos, site in enumerate(sites)}
@@ -0,0 +1,165 @@
+"""Validation metrics of the soil moisture estimates against the ground data
+
+The (ground sm, estimate) pairs of each network, station, orbit pass and
+year unit are reduced to sufficient statistics once (``unit_sums``), the R,
+bias, RMSE, ubRMSE and anomaly R of any grouping of the units then follow
+from their sums (``metrics_from_sums``): per site (``site_metrics``) or per
+network, landcover or orbit pass with bootstrap confidence intervals over
+the sites of each group (``group_metrics``).
+"""
+
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# sufficient statistics of the (reference x, estimate y) pairs of a unit, the metrics of any group of units
+# (site, network, landcover, bootstrap replicate) follow from their sums. a* are the anomalies from the
+# monthly climatology of the site
+SUMS = ['n', 'sx', 'sy', 'sxx', 'syy', 'sxy', 'sax', 'say', 'saxx', 'sayy', 'saxy']
+METRICS = ['R', 'bias', 'RMSE', 'ubRMSE', 'R_anom']
+UNIT_KEYS = ['network', 'station', 'orbit_pass', 'year']
+BOOT_BLOCK = 50 # the bootstrap replicates drawn from one seed, the same whatever the number of workers
+
+
+def read_records(store, estimates=('SMAP', 'sm_STCD', 'sm_ACD'), reference='sm'):
+    # all records of the store in one long table: the input data (SMAP, orbit pass) joined with the retrievals
+    keys=['network', 'station']
+    records=store.read('input', columns=keys+['orbit_pass', reference]+[estimate for estimate in estimates if estimate=='SMAP'])
+    retrieved=[estimate for estimate in estimates if estimate not in records]
+    if retrieved and store.exists('retrieval'):
+        retrieval=store.read('retrieval', columns=keys+retrieved)
+        keys=keys+['time']
+        records=records.reset_index().merge(retrieval.reset_index(), on=keys, how='left').set_index('time')
+    return records
+
+
+def unit_sums(records, site_info=None, estimates=('SMAP', 'sm_STCD', 'sm_ACD'), reference='sm'):
+    # sufficient statistics of each (network, station, orbit pass, year) unit and estimate, all units at once
+    # site_info adds the landcover class of the year (LC<year>) of each unit
+    records=records[records[reference].notna()]
+    time=pd.DatetimeIndex(records.index)
+    frame=pd.DataFrame({'network': records['network'].astype(str).to_numpy(),
+                        'station': records['station'].astype(str).to_numpy(),
+                        'orbit_pass': records['orbit_pass'].to_numpy() if 'orbit_pass' in records else np.nan,
+                        'year': time.year.to_numpy()})
+    units, unit_idx=_codes(frame, UNIT_KEYS)
+    sites, site_idx=_codes(frame, ['network', 'station'])
+    month_idx=site_idx*12+time.month.to_numpy()-1 # the climatology of a site is its monthly mean
+    x_all=records[reference].to_numpy(dtype=np.float64)
+    out=[]
+    for estimate in estimates:
+        if estimate not in records:
+            continue
+        y=records[estimate].to_numpy(dtype=np.float64)
+        valid=~np.isnan(y)
+        x=np.where(valid, x_all, 0.0)
+        y=np.where(valid, y, 0.0)
+        ax=np.where(valid, x-_group_mean(x, valid, month_idx, len(sites)*12), 0.0)
+        ay=np.where(valid, y-_group_mean(y, valid, month_idx, len(sites)*12), 0.0)
+        weights={'n': valid.astype(float), 'sx': x, 'sy': y, 'sxx': x*x, 'syy': y*y, 'sxy': x*y, 'sax': ax,
+                 'say': ay, 'saxx': ax*ax, 'sayy': ay*ay, 'saxy': ax*ay}
+        sums=units.copy()
+        for name in SUMS:
+            sums[name]=np.bincount(unit_idx, weights=weights[name], minlength=len(units))
+        sums.insert(0, 'estimate', estimate)
+        out.append(sums[sums['n']>0])
+    sums=pd.concat(out, ignore_index=True) if out else pd.DataFrame(columns=['estimate']+UNIT_KEYS+SUMS)
+    if site_info is not None:
+        sums['landcover']=_landcover(sums, site_info)
+    return sums
+
+
+def _codes(frame, keys):
+    # the unique rows of the key columns and the code of each row
+    codes, uniques=pd.MultiIndex.from_frame(frame[keys]).factorize()
+    return pd.DataFrame(list(uniques), columns=keys), codes
+
+
+def _group_mean(values, valid, group_idx, n_groups):
+    sums=np.bincount(group_idx, weights=np.where(valid, values, 0.0), minlength=n_groups)
+    counts=np.bincount(group_idx, weights=valid.astype(float), minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums/counts)[group_idx]
+
+
+def _landcover(sums, site_info):
+    # landcover class of the site in the year of each unit, the latest year for the years after the LC<year> columns
+    lc_columns=sorted(column for column in site_info.columns if str(column).startswith('LC'))
+    if not lc_columns:
+        return np.full(len(sums), np.nan)
+    years=np.array([int(column[2:]) for column in lc_columns])
+    classes=site_info.set_index(site_info['network'].astype(str)+'\t'+site_info['station'].astype(str))[lc_columns]
+    classes=classes[~classes.index.duplicated()].apply(pd.to_numeric, errors='coerce')
+    rows=classes.index.get_indexer(sums['network']+'\t'+sums['station'])
+    columns=np.clip(np.searchsorted(years, sums['year'].to_numpy(), side='right')-1, 0, len(years)-1)
+    values=classes.to_numpy()[np.maximum(rows, 0), columns]
+    return np.where(rows>=0, values, np.nan)
+
+
+def metrics_from_sums(sums):
+    # R, bias (estimate - reference), RMSE, ubRMSE and anomaly R from the sums, rows (or any leading axes) at once
+    sums=np.asarray(sums, dtype=np.float64)
+    n, sx, sy, sxx, syy, sxy, sax, say, saxx, sayy, saxy=np.moveaxis(sums, -1, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bias=(sy-sx)/n
+        mse=(sxx-2*sxy+syy)/n
+        r=(n*sxy-sx*sy)/np.sqrt((n*sxx-sx*sx)*(n*syy-sy*sy))
+        r_anom=(n*saxy-sax*say)/np.sqrt((n*saxx-sax*sax)*(n*sayy-say*say))
+        return np.stack([r, bias, np.sqrt(mse), np.sqrt(np.maximum(mse-bias*bias, 0)), r_anom], axis=-1)
+
+
+def site_metrics(sums, by=('network', 'station')):
+    # metrics of each site (or of the units grouped by other keys), pooling the records of its units
+    table=sums.groupby(['estimate']+list(by), sort=True, dropna=False)[SUMS].sum().reset_index()
+    table[METRICS]=metrics_from_sums(table[SUMS].to_numpy())
+    return table.drop(columns=SUMS[1:])
+
+
+def _bootstrap_part(site_sums, group_sites, blocks):
+    # metrics of the replicates of each group: the sites of the group are resampled with replacement, i.e. the sums
+    # of a replicate are the site sums weighted by multinomial counts, one matrix product per group and block. Each
+    # (n_boot, seed) block draws its replicates from its own seed, whichever worker runs it
+    out=[[] for _ in group_sites]
+    for n_boot, seed in blocks:
+        rng=np.random.default_rng(seed)
+        for group, sites in enumerate(group_sites):
+            counts=rng.multinomial(len(sites), np.full(len(sites), 1/len(sites)), size=n_boot)
+            out[group].append(metrics_from_sums(counts@site_sums[sites]))
+    return [np.concatenate(replicates) for replicates in out]
+
+
+def group_metrics(sums, by='network', n_boot=1000, alpha=0.05, n_workers=None, seed=0):
+    # metrics of the pooled records of each group (e.g. 'network', 'landcover', 'orbit_pass' or a list of keys)
+    # and their bootstrap confidence intervals, resampling the sites of the group. The blocks of replicates are split
+    # over a process pool, the intervals of a seed do not depend on n_workers. n_workers=1 runs in the current process
+    by=[by] if isinstance(by, str) else list(by)
+    site_keys=['estimate']+by+[key for key in ('network', 'station') if key not in by]
+    site_sums=sums.groupby(site_keys, sort=True, dropna=False)[SUMS].sum().reset_index()
+    group_keys=['estimate']+by
+    groups=site_sums.groupby(group_keys, sort=True, dropna=False)
+    table=groups[SUMS].sum().reset_index()
+    table.insert(len(group_keys), 'n_sites', groups.size().to_numpy())
+    table[METRICS]=metrics_from_sums(table[SUMS].to_numpy())
+    if n_boot:
+        values=site_sums[SUMS].to_numpy(dtype=np.float64)
+        group_sites=list(groups.indices.values())
+        sizes=[min(BOOT_BLOCK, n_boot-start) for start in range(0, n_boot, BOOT_BLOCK)]
+        blocks=list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+        n_workers=min(n_workers or os.cpu_count(), len(blocks))
+        parts=np.array_split(np.arange(len(blocks)), n_workers)
+        args=[(values, group_sites, [blocks[pos] for pos in part]) for part in parts]
+        if n_workers==1:
+            results=[_bootstrap_part(*arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results=list(executor.map(_bootstrap_part, *zip(*args)))
+        replicates=[np.concatenate([result[group] for result in results]) for group in range(len(group_sites))]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # groups of a single site or without pairs
+            for bound, q in (('low', alpha/2), ('high', 1-alpha/2)):
+                limits=np.array([np.nanquantile(replicate, q, axis=0) for replicate in replicates])
+                for pos, metric in enumerate(METRICS):
+                    table[metric+'_'+bound]=limits[:, pos] if len(limits) else np.nan
+    return table.drop(columns=SUMS[1:])
@@ -0,0 +1,501 @@
+"""Resumable runner of the whole pipeline
+
+Runs the steps of the notebooks as stages: ``ismn`` (daily averages of the
+ISMN download), ``smap`` (EASE cells, SMAP soil moisture and bulk density),
+``static`` (landcover and terrain from GEE), ``gee`` (Sentinel-1 and MODIS
+extraction fused into the input records) and ``retrieval`` (STCD/ACD). Each
+task (a station, a site or the SMAP granules) is keyed by a hash of its
+inputs and parameters and checkpointed in the store once its outputs are
+written, a rerun only executes the tasks whose key changed. The stages
+without a dependency between them run at the same time.
+
+    python pipeline.py --store STORE --ismn-dir ISMN_raw --smap-dir SMAP/36km
+    python pipeline.py --store STORE --stages retrieval --dry-run
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import streaming
+import utils
+from ISMNCatalog import ISMNCatalog
+from PipelineStore import PipelineStore
+from Tracer import init_worker_tracer, worker_tracer_args
+
+# the modules of GEE (ee), SMAP (h5py) and the retrieval are imported by their stages only, e.g. a dry run or the
+# ismn stage need neither
+
+STAGES = {'ismn': [], 'smap': ['ismn'], 'static': ['ismn'], 'gee': ['ismn', 'smap'],
+          'retrieval': ['smap', 'static', 'gee']} # the stages each stage reads the outputs of
+SITE_TABLES = ['ismn_sites', 'smap_sites', 'static_sites'] # the per-site outputs of the stages, joined in site_info
+KEYS = ['network', 'station']
+SOURCE_EPSG = 4326 # WGS 84
+AUX_MARGIN = pd.DateOffset(months=1) # SMAP and NDVI are extracted a month around the period for the interpolation
+S1_PRODUCT = 'COPERNICUS/S1_GRD'
+S1_BANDS = ['VV', 'VH', 'angle']
+IN_MOD = 'IW'
+MOD_PRODUCT = 'MODIS/006/MOD13Q1'
+MYD_PRODUCT = 'MODIS/006/MYD13Q1'
+NDVI_BANDS = ['NDVI', 'EVI']
+NDVI_SCALE = 10000
+LC_PRODUCT = 'COPERNICUS/Landcover/100m/Proba-V-C3/Global'
+LC_BANDS = ['discrete_classification']
+DEM_PRODUCT = 'USGS/SRTMGL1_003'
+STATIC_PROJECTION = 'landcover' # the static layers are sampled in the native projection and scale of the landcover
+
+
+def task_key(*parts):
+    # hash of the inputs and parameters of a task
+    text=json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_state(path):
+    # a file changes its key when it is replaced or edited
+    stat=os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+def stale_tasks(store, stage, keys, force=False):
+    # the tasks whose inputs changed since their checkpoint, or never completed
+    if force:
+        return list(keys)
+    stale=[]
+    for task, key in keys.items():
+        checkpoint=store.checkpoint(stage, task)
+        if checkpoint is None or checkpoint['key']!=key:
+            stale.append(task)
+    return stale
+
+
+def stage_order(targets):
+    # the targets and the stages they depend on, grouped in levels of independent stages
+    needed=set()
+    pending=list(targets)
+    while pending:
+        stage=pending.pop()
+        if stage not in needed:
+            needed.add(stage)
+            pending.extend(STAGES[stage])
+    levels=[]
+    done=set()
+    while needed-done:
+        level=[stage for stage in STAGES if stage in needed-done and set(STAGES[stage])<=done]
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+def site_ids(sites):
+    return (sites['network'].astype(str)+'_'+sites['station'].astype(str)).tolist()
+
+
+def _checkpoint_key(checkpoint):
+    return None if checkpoint is None else checkpoint['key']
+
+
+def assemble_site_info(store):
+    # site_info is the join of the per-site tables of the stages on the sites of the ISMN download
+    site_info=store.read_table('ismn_sites')
+    if not len(site_info):
+        return site_info
+    for table in SITE_TABLES[1:]:
+        site_df=store.read_table(table)
+        if len(site_df):
+            site_info=site_info.merge(site_df, on=KEYS, how='left')
+    store.write_table('site_info', site_info)
+    return site_info
+
+
+def _records_table(store, stage, tasks):
+    # the records kept with the checkpoints of the tasks, one row each
+    records=[store.checkpoint(stage, task) for task in tasks]
+    return pd.DataFrame([checkpoint['record'] for checkpoint in records if checkpoint and checkpoint['record']])
+
+
+# ---- ismn: one task per station directory, keyed by the state of its files
+
+def ismn_tasks(store, config):
+    catalog=ISMNCatalog(config.ismn_dir).refresh()
+    stations=utils.group_sm_by_station(catalog, config.max_depth)
+    keys, args={}, {}
+    for station_dir, file_pairs in stations.items():
+        task=os.path.relpath(station_dir, config.ismn_dir).replace(os.sep, '/')
+        files=[path for pair in file_pairs for path in pair if path is not None]
+        files+=sorted(glob.glob(os.path.join(station_dir, '*.csv'))) # the soil texture of the site
+        keys[task]=task_key([file_state(path) for path in files], config.start, config.end, config.max_depth)
+        args[task]=(station_dir, file_pairs)
+    return keys, args
+
+
+def _ismn_task(store_dir, task, key, station_dir, file_pairs, s_time, e_time):
+    # parse and overwrite all days of a station, the header of the site is kept with the checkpoint
+    store=PipelineStore(store_dir)
+    header=utils._ingest_station(station_dir, file_pairs, None, s_time, e_time, store, incremental=False)
+    record=None if header is None else header.iloc[0].to_dict()
+    store.set_checkpoint('ismn', task, key, record)
+    return task
+
+
+def run_ismn(store, config, keys, args, stale):
+    task_args=[(store.root_dir, task, keys[task])+args[task]+(config.start, config.end) for task in stale]
+    if config.workers==1:
+        for arg in task_args:
+            _ismn_task(*arg)
+    elif task_args:
+        with ProcessPoolExecutor(max_workers=config.workers, initializer=init_worker_tracer,
+                                 initargs=worker_tracer_args()) as executor:
+            list(executor.map(_ismn_task, *zip(*task_args)))
+    sites=_records_table(store, 'ismn', keys)
+    if len(sites):
+        sites=sites.drop_duplicates(KEYS, keep='first')
+    store.write_table('ismn_sites', sites)
+
+
+# ---- smap: the EASE cells of the sites and one task over the SMAP granules
+
+def _ease_cells(sites, resolution):
+    from TimeseriesExtractor import EASE_EPSG, PointGeometry
+    if not len(sites):
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    return PointGeometry(SOURCE_EPSG, EASE_EPSG).ease_grid_cells(sites['lon'].to_numpy(float),
+                                                                 sites['lat'].to_numpy(float), resolution)
+
+
+def _smap_window(config):
+    return pd.Timestamp(config.start)-AUX_MARGIN, pd.Timestamp(config.end)
+
+
+def smap_tasks(store, config):
+    from SMAPExtractor import build_file_index
+    sites=store.read_table('ismn_sites')
+    rows, columns=_ease_cells(sites, config.ease_resolution)
+    cells=sorted(set(zip(rows.tolist(), columns.tolist())))
+    start, end=_smap_window(config)
+    granules={date: file_state(path) for date, path in build_file_index(config.smap_dir).items()
+              if start<=pd.Timestamp(date)<=end}
+    keys={'granules': task_key(cells, granules, str(start.date()), str(end.date()), config.ease_resolution)}
+    return keys, {'granules': (sites, rows, columns, cells, granules)}
+
+
+def _add_smap_cells(store, config, cells, start, end):
+    # the soil moisture and bulk density of cells added to the stored days, merged into the stored SMAP and bulk
+    # density. Only the new cells are read from the granules, the stored tables (days x cells) are small next to them
+    from SMAPExtractor import BULK_DENSITY, SOIL_MOISTURE_AM, SMAPExtractor
+    extractor=SMAPExtractor(config.smap_dir, cells, [SOIL_MOISTURE_AM, BULK_DENSITY], start, end,
+                            n_workers=config.workers)
+    frames=extractor.to_frames(extractor.extract())
+    new_sm=frames[SOIL_MOISTURE_AM]
+    new_density=frames[BULK_DENSITY].astype(np.float64).mean().to_frame().T
+    sm=store.read('SMAP')
+    sm=sm.drop(columns=[name for name in new_sm.columns if name in sm]).join(new_sm) # a cell may come back
+    store.write('SMAP', sm, high_water_mark=end)
+    density=store.read('bulk_density') if store.exists('bulk_density') else pd.DataFrame(index=[0])
+    density=density.drop(columns=[name for name in new_density.columns if name in density]).reset_index(drop=True)
+    store.write('bulk_density', pd.concat([density, new_density], axis=1))
+
+
+def run_smap(store, config, keys, args, stale):
+    from SMAPExtractor import BULK_DENSITY, SOIL_MOISTURE_AM, SMAPExtractor
+    sites, rows, columns, cells, granules=args['granules']
+    if stale:
+        start, end=_smap_window(config)
+        checkpoint=store.checkpoint('smap', 'granules')
+        previous=checkpoint['record'] if checkpoint and checkpoint['key']!=keys['granules'] else None # not forced
+        mark=store.high_water_mark('SMAP')
+        # the stored days are kept when the stored granules did not change, the granules after the mark are appended
+        append=(previous is not None and mark is not None and
+                all(granules.get(date)==state for date, state in previous['granules'].items()) and
+                all(pd.Timestamp(date)>mark for date in granules if date not in previous['granules']))
+        if append:
+            stored_cells={tuple(cell) for cell in previous['cells']}
+            new_cells=[cell for cell in cells if cell not in stored_cells]
+            if new_cells and start<=mark: # only the new cells are extracted over the stored days
+                _add_smap_cells(store, config, new_cells, start, mark)
+        variables=[SOIL_MOISTURE_AM] if append else [SOIL_MOISTURE_AM, BULK_DENSITY]
+        first=mark+pd.Timedelta(days=1) if append else start
+        if first<=end and cells:
+            # the granules are read a block of days ahead of the writes, the mark follows the last granule written
+            extractor=SMAPExtractor(config.smap_dir, cells, variables, first, end, n_workers=config.workers)
+            if append: # the days after the mark were stored without a granule
+                store.truncate('SMAP', first)
+            blocks=streaming.bounded(streaming.smap_blocks(extractor, config.smap_days), int(config.max_memory*2**20))
+            bulk_density=streaming.write_smap_blocks(store, blocks, SOIL_MOISTURE_AM, None if append else BULK_DENSITY,
+                                                     'append' if append else 'overwrite', list(extractor.file_index))
+            if not append:
+                store.write('bulk_density', bulk_density)
+        store.set_checkpoint('smap', 'granules', keys['granules'], {'cells': cells, 'granules': granules})
+    smap_sites=sites[KEYS].copy()
+    smap_sites['EASE_row']=rows
+    smap_sites['EASE_column']=columns
+    bulk_density=store.read('bulk_density') if store.exists('bulk_density') else pd.DataFrame()
+    cell_names=['r%sc%s' % (row, column) for row, column in zip(rows, columns)]
+    smap_sites['roh_b']=[bulk_density[name].iloc[0] if name in bulk_density else np.nan for name in cell_names]
+    store.write_table('smap_sites', smap_sites)
+
+
+# ---- static: one task per site, the stale sites are sampled in chunked requests
+
+def static_tasks(store, config):
+    sites=store.read_table('ismn_sites')
+    keys={site_id: task_key(lon, lat, LC_PRODUCT, LC_BANDS, DEM_PRODUCT, STATIC_PROJECTION, config.start, config.end)
+          for site_id, lon, lat in zip(site_ids(sites), sites['lon'], sites['lat'])} if len(sites) else {}
+    return keys, {'sites': sites}
+
+
+def run_static(store, config, keys, args, stale):
+    import ee
+    from TimeseriesExtractor import GeeStaticExtractor
+    sites=args['sites']
+    if stale:
+        todo=sites[KEYS+['lon', 'lat']].assign(site_id=site_ids(sites))
+        todo=todo[todo['site_id'].isin(stale)]
+        dem=ee.Image(DEM_PRODUCT).select('elevation')
+        static_extractor=(GeeStaticExtractor() # the landcover of each year, the elevation and slope
+                          .set_native_proj_scale(LC_PRODUCT, LC_BANDS)
+                          .add_collection(LC_PRODUCT, LC_BANDS, config.start, config.end, prefix='LC')
+                          .add_image(dem)
+                          .add_image(ee.Terrain.slope(dem)))
+        for start in range(0, len(todo), config.chunk_size): # a crash only loses the current chunk
+            chunk=static_extractor.join(todo.iloc[start:start+config.chunk_size])
+            for record in chunk.drop(columns=['lon', 'lat']).to_dict('records'):
+                site_id=record.pop('site_id')
+                store.set_checkpoint('static', site_id, keys[site_id], record)
+    store.write_table('static_sites', _records_table(store, 'static', keys))
+
+
+# ---- gee: one task per site, Sentinel-1 and MODIS NDVI fused with SMAP and the ground data into input/
+
+def _gee_params(config):
+    return [S1_PRODUCT, S1_BANDS, IN_MOD, config.buffer, config.footprint_reducer, MOD_PRODUCT, MYD_PRODUCT,
+            NDVI_BANDS, config.start, config.end]
+
+
+def _extract_keys(config, lon, lat):
+    # the parameters the stored Sentinel-1 and MODIS extracts of a site depend on, the days after their high-water
+    # mark are only appended while these stay the same. The end date is left out, a later end extends the extracts
+    return {'s1': task_key(lon, lat, S1_PRODUCT, S1_BANDS, IN_MOD, config.buffer, config.footprint_reducer,
+                           config.start),
+            'modis': task_key(lon, lat, MOD_PRODUCT, MYD_PRODUCT, NDVI_BANDS, config.start)}
+
+
+def _reset_extracts(store, site, previous, current):
+    # clear the data and marks of the extracts whose parameters changed since the last run of the site, they are
+    # extracted again from the start in overwrite mode
+    from TimeseriesExtractor import ORBIT_PASSES
+    datasets={'s1': ['sentinel1_'+orbit_pass for orbit_pass in ORBIT_PASSES],
+              'modis': [product.replace('/', '_') for product in (MOD_PRODUCT, MYD_PRODUCT)]}
+    for name, key in current.items():
+        if previous.get(name)!=key:
+            for dataset in datasets[name]:
+                store.clear(dataset, site.network, site.station)
+
+
+def gee_tasks(store, config):
+    sites=store.read_table('site_info')
+    if not len(sites) or 'EASE_row' not in sites:
+        return {}, {'sites': sites}
+    ismn_keys={} # the key of the station of each site
+    for checkpoint in store.checkpoints('ismn').values():
+        if checkpoint['record']:
+            ismn_keys[checkpoint['record']['network']+'_'+checkpoint['record']['station']]=checkpoint['key']
+    smap_checkpoint=store.checkpoint('smap', 'granules')
+    keys={}
+    if smap_checkpoint is None or not smap_checkpoint['record']:
+        return keys, {'sites': sites}
+    # a site depends on the SMAP of its own cell and the granules of the window, not on the cells of the other sites
+    granules_key=task_key(smap_checkpoint['record']['granules'])
+    smap_cells={tuple(cell) for cell in smap_checkpoint['record']['cells']}
+    for site_id, lon, lat, row, column in zip(site_ids(sites), sites['lon'], sites['lat'], sites['EASE_row'],
+                                              sites['EASE_column']):
+        if site_id in ismn_keys and pd.notna(row) and pd.notna(column) and (int(row), int(column)) in smap_cells:
+            keys[site_id]=task_key(lon, lat, int(row), int(column), ismn_keys[site_id], granules_key,
+                                   _gee_params(config))
+    return keys, {'sites': sites}
+
+
+def _read_inputs(store, config, sites, backend):
+    # the (s1, ndvi, smap, ground) data of a chunk of sites fuse_sites reads, the extracts after the high-water mark
+    # of each site are appended to the store
+    from GeeRequestExecutor import default_executor
+    from PixelIndex import PixelGrid, PixelIndex
+    from TimeseriesExtractor import GeeS1TimeseriesExtractor, GeeTimeseriesExtractor
+    ndvi_start=(pd.Timestamp(config.start)-AUX_MARGIN).strftime('%Y-%m-%d')
+    ndvi_end=(pd.Timestamp(config.end)+AUX_MARGIN).strftime('%Y-%m-%d')
+    extractors=[GeeTimeseriesExtractor(product, NDVI_BANDS, ndvi_start, ndvi_end, '', True, store=store,
+                                       backend=backend) for product in (MYD_PRODUCT, MOD_PRODUCT)]
+    modis_index=PixelIndex(sites, PixelGrid.from_band_info(extractors[1].band_info[0]))
+    ndvi_frames=[extractor.get_and_save_batch(sites, pixel_index=modis_index) for extractor in extractors]
+
+    def extract_s1(site):
+        s1_extractor=GeeS1TimeseriesExtractor(S1_PRODUCT, config.start, config.end, S1_BANDS,
+                                              (site.lon, site.lat, config.buffer), None, IN_MOD, '', True,
+                                              store=store, backend=backend, footprint_reducer=config.footprint_reducer)
+        return s1_extractor.get_and_save_passes(site.station, site.network)
+
+    s1_all=dict(zip(sites['site_id'], default_executor().map(extract_s1, [site for _, site in sites.iterrows()])))
+    cell_names=['r%sc%s' % (row, column) for row, column in zip(sites['EASE_row'], sites['EASE_column'])]
+    smap_df=store.read('SMAP', columns=sorted(set(cell_names)))
+    ndvi_all, smap_all, ground_all={}, {}, {}
+    for site, cell_name in zip(sites.itertuples(), cell_names):
+        df_ndvi=pd.concat([frames[site.site_id] for frames in ndvi_frames]).sort_index()
+        df_ndvi[NDVI_BANDS]=df_ndvi[NDVI_BANDS].astype('float')/NDVI_SCALE
+        ndvi_all[site.site_id]=df_ndvi.groupby(level=0).mean()
+        smap_all[site.site_id]=smap_df[cell_name].rename('SMAP')
+        ground_all[site.site_id]=store.read('daily_ave', network=site.network, station=site.station)
+    return s1_all, ndvi_all, smap_all, ground_all
+
+
+def run_gee(store, config, keys, args, stale):
+    sites=args['sites']
+    if not stale:
+        return
+    todo=sites.assign(site_id=site_ids(sites))
+    todo=todo[todo['site_id'].isin(stale)].reset_index(drop=True)
+    extract_keys={site.site_id: _extract_keys(config, site.lon, site.lat) for site in todo.itertuples()}
+    for site in todo.itertuples():
+        checkpoint=store.checkpoint('gee', site.site_id)
+        if checkpoint is not None: # the site ran before, e.g. with another buffer or start
+            _reset_extracts(store, site, checkpoint['record'] or {}, extract_keys[site.site_id])
+    # the next chunks are extracted while a chunk is fused and written, a crash only loses the chunks in flight
+    backend=getattr(config, 'backend', None)
+    reads=streaming.site_blocks(todo, lambda chunk: _read_inputs(store, config, chunk, backend), config.chunk_size)
+    inputs=streaming.fuse_blocks(streaming.bounded(reads, int(config.max_memory*2**20)))
+    for chunk in streaming.write_blocks(store, 'input', inputs, config.end):
+        for site_id in chunk['site_id']:
+            store.set_checkpoint('gee', site_id, keys[site_id], extract_keys[site_id])
+
+
+# ---- retrieval: one task per site, keyed by its input records and parameters
+
+def retrieval_tasks(store, config):
+    from change_detection import site_parameters
+    sites=store.read_table('site_info')
+    if not len(sites):
+        return {}, {'sites': sites}
+    parameters=site_parameters(sites)
+    keys={}
+    for site_id in site_ids(sites):
+        gee_key=_checkpoint_key(store.checkpoint('gee', site_id))
+        if gee_key is not None:
+            keys[site_id]=task_key(gee_key, parameters.loc[site_id].tolist(), config.methods, config.sensitivity)
+    return keys, {'sites': sites}
+
+
+def run_retrieval(store, config, keys, args, stale):
+    import change_detection
+    if not stale:
+        return
+    sites=args['sites'][KEYS].assign(site_id=site_ids(args['sites']))
+    sites=sites[sites['site_id'].isin(stale)].drop_duplicates('site_id')
+    batch=config.chunk_size*(config.workers or os.cpu_count()) # a chunk for each worker between the checkpoints
+    for start in range(0, len(sites), batch):
+        chunk=sites.iloc[start:start+batch]
+        change_detection.retrieve_store(store.root_dir, chunk[KEYS], config.methods, config.workers, config.chunk_size,
+                                        config.sensitivity)
+        for site_id in chunk['site_id']:
+            store.set_checkpoint('retrieval', site_id, keys[site_id])
+
+
+STAGE_FUNCTIONS = {'ismn': (ismn_tasks, run_ismn), 'smap': (smap_tasks, run_smap),
+                   'static': (static_tasks, run_static), 'gee': (gee_tasks, run_gee),
+                   'retrieval': (retrieval_tasks, run_retrieval)}
+
+
+def run_stage(store, config, stage, force=False, dry_run=False):
+    # run the stale tasks of a stage, returns the number of tasks and of stale tasks
+    make_tasks, run=STAGE_FUNCTIONS[stage]
+    keys, args=make_tasks(store, config)
+    stale=stale_tasks(store, stage, keys, force)
+    # a single write, the stages of a level report at the same time
+    print('%s: %d tasks, %d to run\n' % (stage, len(keys), len(stale)), end='')
+    if not dry_run:
+        run(store, config, keys, args, stale)
+    return len(keys), len(stale)
+
+
+def run_pipeline(config, targets=tuple(STAGES), force=(), dry_run=False):
+    # run the target stages and the stages they depend on, the independent stages of a level run in parallel
+    store=PipelineStore(config.store)
+    counts={}
+    for level in stage_order(targets):
+        if dry_run or len(level)==1:
+            results=[run_stage(store, config, stage, stage in force, dry_run) for stage in level]
+        else:
+            with ThreadPoolExecutor(max_workers=len(level)) as executor:
+                results=list(executor.map(lambda stage: run_stage(store, config, stage, stage in force), level))
+        counts.update(zip(level, results))
+        if not dry_run:
+            assemble_site_info(store)
+    return counts
+
+
+def parse_args(argv=None):
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', required=True, help='the directory of the PipelineStore')
+    parser.add_argument('--ismn-dir', help='the raw ISMN download')
+    parser.add_argument('--smap-dir', help='the raw SPL3SMP granules')
+    parser.add_argument('--start', default='2016-01-01', help='the first day of the study period')
+    parser.add_argument('--end', default='2019-12-31', help='the last day of the study period')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help='the stages to run, with the stages they depend on')
+    parser.add_argument('--force', nargs='+', choices=list(STAGES), default=[],
+                        help='rerun all the tasks of these stages')
+    parser.add_argument('--dry-run', action='store_true', help='only report the tasks to run')
+    parser.add_argument('--workers', type=int, default=None, help='the processes of the parallel stages')
+    parser.add_argument('--chunk-size', type=int, default=64, help='the sites checkpointed together')
+    parser.add_argument('--smap-days', type=int, default=streaming.SMAP_BLOCK_DAYS,
+                        help='the days of SMAP granules read together')
+    parser.add_argument('--max-memory', type=float, default=streaming.DEFAULT_MAX_BYTES/2**20,
+                        help='the MB of the chunks read ahead of the writes')
+    parser.add_argument('--max-depth', type=float, default=0.051, help='the deepest ISMN sensor in m')
+    parser.add_argument('--ease-resolution', default='36km', help='the EASE 2.0 grid of the SMAP granules')
+    parser.add_argument('--buffer', type=float, default=50, help='the buffer of the Sentinel-1 footprint in m')
+    parser.add_argument('--footprint-reducer', default='mean', help="the server side reducer of the footprint, "
+                                                                    "'none' for the pixels")
+    parser.add_argument('--methods', nargs='+', default=['STCD', 'ACD'], help='the retrieval methods')
+    parser.add_argument('--sensitivity', type=float, default=1.0, help='the backscatter sensitivity')
+    parser.add_argument('--cache-dir', help='the cache of the GEE responses')
+    parser.add_argument('--mirror', nargs=2, action='append', default=[], metavar=('PRODUCT', 'DIR'),
+                        help='a product mirrored as local GeoTIFF/COG tiles')
+    parser.add_argument('--trace', help='the JSON lines file of the stage spans')
+    config=parser.parse_args(argv)
+    if config.footprint_reducer.lower()=='none':
+        config.footprint_reducer=None
+    return config
+
+
+def main(argv=None):
+    config=parse_args(argv)
+    targets=stage_order(config.stages)
+    stages={stage for level in targets for stage in level}
+    config.backend=None
+    if stages & {'static', 'gee'} and not config.dry_run:
+        import ee
+        from GeeCache import GeeCache
+        from GeeRequestExecutor import GeeRequestExecutor, set_default_executor
+        from TimeseriesExtractor import GeeBackend
+        ee.Initialize()
+        if config.cache_dir:
+            set_default_executor(GeeRequestExecutor(cache=GeeCache(config.cache_dir)))
+        if config.mirror:
+            from LocalRaster import LocalRasterBackend
+            config.backend=LocalRasterBackend(dict(config.mirror), fallback=GeeBackend())
+    if config.trace:
+        from Tracer import Tracer
+        with Tracer(config.trace) as tracer:
+            run_pipeline(config, config.stages, config.force, config.dry_run)
+        print(tracer.summary().to_string())
+    else:
+        run_pipeline(config, config.stages, config.force, config.dry_run)
+
+
+if __name__ == '__main__':
+    main()
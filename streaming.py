@@ -0,0 +1,166 @@
+"""Bounded-memory streaming of the pipeline
+
+The sources yield blocks: the SMAP frames of a block of days
+(``smap_blocks``) or the extracts of a chunk of sites (``site_blocks``, e.g.
+the Sentinel-1 and MODIS extractors).
+``bounded`` reads the blocks of a source ahead of their consumer in a
+thread and blocks it once the blocks waiting hold ``max_bytes``, the
+consumers (``fuse_blocks``, ``write_blocks``, ``write_smap_blocks``) take one
+block at a time. The memory depends on the size of a block and the ceiling,
+not on the size of the archive::
+
+    reads=site_blocks(sites, read_chunk, chunk_size=64)
+    for sites in write_blocks(store, 'input', fuse_blocks(bounded(reads, 256*2**20))):
+        ...  # the sites of the block are written
+"""
+
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+from fusion import fuse_sites
+
+DEFAULT_MAX_BYTES = 512*2**20 # the blocks read ahead of their consumer
+SMAP_BLOCK_DAYS = 90
+_END = object()
+
+
+def block_bytes(block):
+    # the memory held by a block: frames, series, indexes, arrays and the tuples, lists and dicts of them
+    if isinstance(block, pd.DataFrame):
+        return int(block.memory_usage(deep=True).sum())
+    if isinstance(block, (pd.Series, pd.Index)):
+        return int(block.memory_usage(deep=True))
+    if isinstance(block, np.ndarray):
+        return block.nbytes
+    if isinstance(block, dict):
+        return sum(block_bytes(value) for value in block.values())
+    if isinstance(block, (list, tuple)):
+        return sum(block_bytes(value) for value in block)
+    return 0
+
+
+class MemoryBudget:
+    # the bytes of the blocks in flight, acquire waits while the ceiling is reached. A block larger than the ceiling
+    # is let through once nothing else is held, it never waits forever
+    def __init__(self, max_bytes):
+        self.max_bytes=max_bytes
+        self.used=0
+        self.peak=0
+        self.condition=threading.Condition()
+
+    def acquire(self, size, stop):
+        # False when stopped while waiting
+        with self.condition:
+            while self.used and self.used+size>self.max_bytes:
+                if stop.is_set():
+                    return False
+                self.condition.wait(0.1)
+            self.used+=size
+            self.peak=max(self.peak, self.used)
+            return True
+
+    def release(self, size):
+        with self.condition:
+            self.used-=size
+            self.condition.notify_all()
+
+
+def bounded(blocks, max_bytes=DEFAULT_MAX_BYTES):
+    # iterate the blocks of a source read ahead in a thread. The block being consumed and the blocks waiting hold at
+    # most max_bytes (or a single larger block): the source is paused once they reach it, the backpressure of a
+    # slow consumer. An error of the source is raised in the consumer, closing the iteration stops the source
+    budget=MemoryBudget(max_bytes)
+    pending=queue.Queue()
+    stop=threading.Event()
+
+    def produce():
+        try:
+            for block in blocks:
+                size=block_bytes(block)
+                if not budget.acquire(size, stop):
+                    return
+                pending.put((block, size, None))
+                if stop.is_set():
+                    return
+            pending.put((_END, 0, None))
+        except BaseException as error:
+            pending.put((None, 0, error))
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+
+    producer=threading.Thread(target=produce, daemon=True)
+    producer.start()
+    held=0
+    try:
+        while True:
+            budget.release(held) # the previous block is done with
+            held=0
+            block, held, error=pending.get()
+            if error is not None:
+                raise error
+            if block is _END:
+                return
+            yield block
+    finally:
+        stop.set()
+        budget.release(held)
+        producer.join()
+
+
+def site_chunks(sites, chunk_size):
+    # the site table in chunks of chunk_size rows
+    for start in range(0, len(sites), chunk_size):
+        yield sites.iloc[start:start+chunk_size]
+
+
+def site_blocks(sites, read_chunk, chunk_size=64):
+    # (chunk, data) blocks of the sites, read_chunk(chunk) returns the data of a chunk of the site table, e.g. the
+    # Sentinel-1 passes and MODIS batches of the sites
+    for chunk in site_chunks(sites, chunk_size):
+        yield chunk, read_chunk(chunk)
+
+
+def smap_blocks(extractor, days=SMAP_BLOCK_DAYS):
+    # {variable: (dates x cells) frame} of an SMAPExtractor for each block of days
+    for dates, values in extractor.extract_blocks(days):
+        yield extractor.to_frames(values, dates)
+
+
+def fuse_blocks(blocks, **fuse_args):
+    # fuse each (chunk, (s1, ndvi, smap, ground)) block of a chunk of sites, yields (chunk, input records of the sites)
+    for chunk, (s1, ndvi, smap, ground) in blocks:
+        yield chunk, fuse_sites(s1, ndvi, smap, ground, **fuse_args)
+
+
+def write_blocks(store, dataset, blocks, high_water_mark=None, id_column='site_id'):
+    # write the {site_id: records} of each (chunk, records) block to the site partitions of a dataset, yields each
+    # chunk once its sites are written, e.g. to checkpoint them
+    for chunk, records in blocks:
+        for site_id, network, station in zip(chunk[id_column], chunk['network'], chunk['station']):
+            store.write(dataset, records[site_id], network, station, high_water_mark=high_water_mark)
+        yield chunk
+
+
+def write_smap_blocks(store, blocks, soil_moisture, bulk_density=None, mode='overwrite', granule_dates=None):
+    # write the soil moisture frame of each block of days to the SMAP dataset, the high-water mark follows the
+    # blocks written up to the last day with a granule (YYYYMMDD in granule_dates, all the days without), the days
+    # after it are read again by the next update. Nothing is written without soil_moisture. Returns the mean bulk
+    # density of each cell over all the blocks as a one row frame, None without bulk_density
+    sums, counts=None, None
+    for frames in blocks:
+        if soil_moisture is not None:
+            sm=frames[soil_moisture]
+            dates=sm.index if granule_dates is None else sm.index[sm.index.strftime('%Y%m%d').isin(granule_dates)]
+            store.write('SMAP', sm, mode=mode, high_water_mark=dates[-1] if len(dates) else None)
+            mode='append'
+        if bulk_density is not None:
+            values=frames[bulk_density].astype(np.float64)
+            sums=values.sum() if sums is None else sums+values.sum()
+            counts=values.count() if counts is None else counts+values.count()
+    if sums is None:
+        return None
+    return (sums/counts.where(counts>0)).to_frame().T
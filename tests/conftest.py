@@ -0,0 +1,9 @@
+"""The tests run offline, the ``ee`` module is replaced by benchmarks/fake_ee.py"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+import fake_ee  # noqa: E402
+sys.modules['ee'] = fake_ee  # before the extractors are imported by the tests
@@ -0,0 +1,121 @@
+"""Multi-site batched extraction: download_in_chunks, split_sites and GeeBackend.sample"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ee
+from GeeRequestExecutor import GeeRequestExecutor
+from TimeseriesExtractor import CollectionQuery, GeeBackend, download_in_chunks, split_sites
+
+NDVI_PRODUCT = 'MODIS/006/MOD13Q1'
+NDVI_BANDS = ['NDVI', 'EVI']
+
+
+def site_table(n_sites):
+    return pd.DataFrame({'site_id': ['S%d' % pos for pos in range(n_sites)],
+                         'lon': np.linspace(-100, 100, n_sites).round(5), 'lat': np.linspace(-40, 50, n_sites).round(5)})
+
+
+def ndvi_query(start='2017-01-01', end='2017-07-01'):
+    return CollectionQuery(NDVI_PRODUCT, NDVI_BANDS, start, end,
+                           collection=lambda: ee.ImageCollection(NDVI_PRODUCT).filterDate(start, end).select(NDVI_BANDS))
+
+
+class PayloadLimitedServer:
+    """Returns rows_per_site rows per site, a chunk over max_rows rows is aborted as by Earth Engine"""
+
+    def __init__(self, rows_per_site, max_rows):
+        self.rows_per_site = rows_per_site
+        self.max_rows = max_rows
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def __call__(self, chunk):
+        rows = len(chunk) * self.rows_per_site
+        with self.lock:
+            self.sent.append((len(chunk), rows <= self.max_rows))
+        if rows > self.max_rows:
+            raise ee.EEException('Collection query aborted after accumulating over %d elements.' % self.max_rows)
+        return [{'site_id': site_id, 'row': row} for site_id in chunk.site_id for row in range(self.rows_per_site)]
+
+
+def test_download_in_chunks_splits_and_sizes_chunks():
+    sites = site_table(100)
+    server = PayloadLimitedServer(rows_per_site=10, max_rows=200)
+    executor = GeeRequestExecutor(max_in_flight=4, requests_per_second=None)
+    data_df = download_in_chunks(sites, server, max_rows=200, chunk_size=50, executor=executor)
+    # the first chunk of 50 sites is halved down to chunks under the limit
+    assert server.sent[:7] == [(50, False), (25, False), (12, True), (13, True), (25, False), (12, True), (13, True)]
+    # its 10 rows per site size the other chunks, 0.8 * 200 / 10 sites
+    assert sorted(size for size, _ in server.sent[7:]) == [2, 16, 16, 16]
+    assert all(accepted for _, accepted in server.sent[7:])
+    assert data_df.groupby('site_id', sort=False).size().to_dict() == {site_id: 10 for site_id in sites.site_id}
+    assert data_df.site_id.unique().tolist() == sites.site_id.tolist()
+
+
+def test_download_in_chunks_raises_other_errors():
+    def request_chunk(chunk):
+        raise ee.EEException('Image.select: Pattern VV did not match any bands.')
+
+    with pytest.raises(ee.EEException, match='did not match'):
+        download_in_chunks(site_table(10), request_chunk, executor=GeeRequestExecutor(requests_per_second=None))
+
+
+def test_download_in_chunks_raises_a_single_site_over_the_limit():
+    server = PayloadLimitedServer(rows_per_site=300, max_rows=200)
+    with pytest.raises(ee.EEException, match='accumulating'):
+        download_in_chunks(site_table(4), server, max_rows=200, executor=GeeRequestExecutor(requests_per_second=None))
+    assert server.sent == [(4, False), (2, False), (1, False)]
+
+
+def test_download_in_chunks_without_sites():
+    assert download_in_chunks(site_table(0), PayloadLimitedServer(1, 10)).empty
+
+
+def test_split_sites():
+    data_df = pd.DataFrame({'site_id': ['b', 'a', 'b', 'a'], 'time': [1, 1, 2, 2], 'NDVI': [0.5, 0.1, np.nan, 0.2]})
+    sites = split_sites(data_df, ['a', 'b', 'c'], ['time', 'NDVI', 'EVI'], bands=['NDVI', 'EVI'])
+    assert list(sites) == ['a', 'b', 'c']
+    expected_a = pd.DataFrame({'time': [1, 2], 'NDVI': [0.1, 0.2], 'EVI': [np.nan, np.nan]})
+    pd.testing.assert_frame_equal(sites['a'], expected_a)
+    # the row without any band value is dropped, EVI is masked over all sites
+    pd.testing.assert_frame_equal(sites['b'], pd.DataFrame({'time': [1], 'NDVI': [0.5], 'EVI': [np.nan]}))
+    assert sites['c'].empty and list(sites['c'].columns) == ['time', 'NDVI', 'EVI']
+
+
+def test_split_sites_without_rows():
+    sites = split_sites(pd.DataFrame(), ['a'], ['time', 'NDVI'])
+    assert sites['a'].empty and list(sites['a'].columns) == ['time', 'NDVI']
+
+
+def test_sample_matches_the_extract_of_each_site():
+    sites = site_table(5)
+    query = ndvi_query()
+    backend = GeeBackend(GeeRequestExecutor(max_in_flight=4, requests_per_second=None))
+    ee.reset_stats()
+    data_df = backend.sample(query, sites, reducer='first', max_rows=30, chunk_size=2)
+    assert ee.STATS['requests'] == 3  # 12 images per site, chunks of 2 sites after the first
+    columns = ['id', 'time'] + NDVI_BANDS
+    for site in sites.itertuples():
+        site_df = data_df[data_df.site_id == site.site_id][columns].reset_index(drop=True)
+        expected = backend.reduce_region(query, (site.lon, site.lat), 'first')
+        assert len(site_df) == 12
+        pd.testing.assert_frame_equal(site_df, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('reducer', ['first', 'mean'])
+def test_sample_names_a_single_band_after_the_band(reducer):
+    sites = site_table(3)
+    query = CollectionQuery(NDVI_PRODUCT, ['NDVI'], '2017-01-01', '2017-07-01',
+                            collection=lambda: ee.ImageCollection(NDVI_PRODUCT).filterDate(
+                                '2017-01-01', '2017-07-01').select(['NDVI']))
+    backend = GeeBackend(GeeRequestExecutor(requests_per_second=None))
+    data_df = backend.sample(query, sites, reducer=reducer, not_null=['NDVI'])
+    site_dfs = split_sites(data_df, sites.site_id.tolist(), ['time', 'NDVI'], bands=['NDVI'])
+    for site in sites.itertuples():
+        pixels = backend.region(query, (site.lon, site.lat), None, None)
+        assert len(site_dfs[site.site_id]) == len(pixels) == 12
+        np.testing.assert_allclose(site_dfs[site.site_id]['NDVI'].astype(float), pixels['NDVI'].astype(float))
@@ -0,0 +1,88 @@
+"""Change detection retrieval on synthetic inputs: pack_series, change_detection, retrieve and retrieve_store"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from change_detection import MV_MAX, MV_MIN, change_detection, pack_series, retrieve, retrieve_store
+from PipelineStore import PipelineStore
+
+
+def site_frame(n_days, orbits, seed):
+    """Daily acquisitions alternating between the orbits, VV (dB) is the SMAP prior scaled by a gain per orbit"""
+    rng = np.random.default_rng(seed)
+    smap = rng.uniform(0.05, 0.45, n_days)
+    orbit_pos = np.resize(np.arange(len(orbits)), n_days)
+    relative_orbit = np.asarray(orbits, dtype=float)[orbit_pos]
+    vv = 10 * np.log10(smap * 0.1 * (orbit_pos + 1))
+    return pd.DataFrame({'VV': vv, 'angle': 38.0, 'NDVI': 0.4, 'SMAP': smap, 'relative_orbit': relative_orbit,
+                         'sm': smap + 0.01}, index=pd.date_range('2017-01-01', periods=n_days, name='time'))
+
+
+def test_pack_series_stacks_each_orbit_of_each_site():
+    frames = {'A': site_frame(8, [10, 20], 0), 'B': site_frame(4, [30], 1)}
+    frames['A'].iloc[2, frames['A'].columns.get_loc('VV')] = np.nan  # not an acquisition
+    frames['B'].iloc[1, frames['B'].columns.get_loc('relative_orbit')] = np.nan
+    values, series_site, cells, row_pos = pack_series(frames, ['A', 'B'])
+    assert series_site.tolist() == [0, 0, 1]
+    assert values['VV'].shape == (3, 4)
+    expected_rows = [[0, 4, 6], [1, 3, 5, 7], [0, 2, 3]]  # the rows of each series in its site frame
+    for series, (site, rows) in enumerate(zip(['A', 'A', 'B'], expected_rows)):
+        np.testing.assert_array_equal(values['SMAP'][series, :len(rows)], frames[site]['SMAP'].to_numpy()[rows])
+        assert np.isnan(values['SMAP'][series, len(rows):]).all()  # padded
+    assert row_pos.tolist() == sum(expected_rows, [])
+    np.testing.assert_array_equal(values['VV'][cells], np.concatenate(
+        [frames[site]['VV'].to_numpy()[rows] for site, rows in zip(['A', 'A', 'B'], expected_rows)]))
+
+
+@pytest.mark.parametrize('sensitivity', [1.0, 2.0])
+@pytest.mark.parametrize('window', [3, 7])
+def test_constant_backscatter_ratio_recovers_the_prior(window, sensitivity):
+    rng = np.random.default_rng(2)
+    prior = rng.uniform(0.05, 0.45, (4, 12))
+    log_sigma = sensitivity * np.log(prior) + np.log([[0.1], [0.3], [1.0], [2.0]])  # one gain per series
+    np.testing.assert_allclose(change_detection(log_sigma, prior, window, MV_MIN, MV_MAX, sensitivity), prior)
+    prior_gaps = prior.copy()
+    prior_gaps[:, 1::3] = np.nan  # the prior of these acquisitions is recovered from the backscatter ratios
+    np.testing.assert_allclose(change_detection(log_sigma, prior_gaps, window, MV_MIN, MV_MAX, sensitivity), prior)
+
+
+def test_change_detection_handles_missing_backscatter_and_bounds():
+    prior = np.array([[0.2, 0.25, 0.3, 0.35, np.nan, np.nan]])
+    log_sigma = np.log([[0.2, 0.25, np.nan, 0.35, 0.8, 0.01]])
+    mv = change_detection(log_sigma, prior, 3, MV_MIN, 0.4)
+    np.testing.assert_allclose(mv[0, [0, 1, 3]], prior[0, [0, 1, 3]])
+    assert np.isnan(mv[0, 2])
+    assert mv[0, 4] == 0.4 and mv[0, 5] == MV_MIN  # clipped to the porosity and to MV_MIN
+
+
+@pytest.mark.parametrize('method', ['STCD', 'ACD'])
+def test_retrieve_recovers_the_prior_of_each_orbit(method):
+    frames = {'NET_A': site_frame(30, [10, 20, 35], 3), 'NET_B': site_frame(12, [40], 4)}
+    frames['NET_A'].iloc[[4, 9], frames['NET_A'].columns.get_loc('VV')] = np.nan
+    out = retrieve(frames, method)
+    assert list(out) == ['NET_A', 'NET_B']
+    for site, df in frames.items():
+        pd.testing.assert_index_equal(out[site].index, df.index)
+        sm = out[site]['sm_' + method]
+        valid = df['VV'].notna()
+        assert sm[~valid].isna().all()
+        if method == 'STCD':  # the ratios of the total backscatter are the ratios of the prior
+            np.testing.assert_allclose(sm[valid], df['SMAP'][valid])
+        else:  # the same vegetation term on every acquisition, the ratios are close to the prior ratios
+            assert sm[valid].notna().all() and sm[valid].corr(df['SMAP'][valid]) > 0.95
+
+
+def test_retrieve_store_matches_retrieve(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    frames = {'NET_A': site_frame(20, [10, 20], 5), 'NET_B': site_frame(15, [30], 6), 'NET_C': site_frame(9, [40], 7)}
+    for site_id, df in frames.items():
+        store.write('input', df, *site_id.split('_'))
+    n_sites, _ = retrieve_store(str(tmp_path), n_workers=1, chunk_size=2)
+    assert n_sites == 3
+    expected = {method: retrieve(frames, method) for method in ['STCD', 'ACD']}
+    for site_id, df in frames.items():
+        retrieval = store.read('retrieval', network='NET', station=site_id.split('_')[1])
+        np.testing.assert_allclose(retrieval['sm'], df['sm'])
+        for method in ['STCD', 'ACD']:
+            np.testing.assert_allclose(retrieval['sm_' + method], expected[method][site_id]['sm_' + method])
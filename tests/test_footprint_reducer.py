@@ -0,0 +1,95 @@
+"""Server side reduction of the buffered Sentinel-1 footprints against the pixels of getRegion"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ee
+from GeeRequestExecutor import GeeRequestExecutor
+from TimeseriesExtractor import (CollectionQuery, GeeBackend, GeeS1TimeseriesExtractor, db_to_linear,
+                                 linear_to_db)
+
+S1_PRODUCT = 'COPERNICUS/S1_GRD'
+S1_BANDS = ['VV', 'VH', 'angle']
+START_DATE = '2017-01-01'
+END_DATE = '2017-05-01'
+LOCATION = (5.1, 45.2, 50)  # lon, lat, buffer in m
+SCALE = 10
+
+
+@pytest.fixture
+def executor():
+    return GeeRequestExecutor(requests_per_second=None)
+
+
+def s1_query(linear_bands=None):
+    collection = lambda: ee.ImageCollection(S1_PRODUCT).filterDate(START_DATE, END_DATE).filter(
+        ee.Filter.eq('orbitProperties_pass', 'DESCENDING')).select(S1_BANDS)
+    return CollectionQuery(S1_PRODUCT, S1_BANDS, START_DATE, END_DATE, collection=collection,
+                           linear_bands=linear_bands)
+
+
+def s1_extractor(executor, footprint_reducer):
+    return GeeS1TimeseriesExtractor(S1_PRODUCT, START_DATE, END_DATE, S1_BANDS, LOCATION, 'DESCENDING', 'IW', '',
+                                    False, executor=executor, footprint_reducer=footprint_reducer)
+
+
+@pytest.mark.parametrize('reducer', ['mean', 'median'])
+def test_reduce_region_matches_the_pixels(executor, reducer):
+    backend = GeeBackend(executor)
+    pixels = backend.region(s1_query(), LOCATION, SCALE, None)
+    assert pixels.groupby('id').size().min() > 1  # the buffer holds several pixels
+    rows = backend.reduce_region(s1_query(), LOCATION, reducer, SCALE)
+    assert rows.columns.tolist() == ['id', 'time'] + S1_BANDS
+    assert rows.id.is_unique and len(rows) == pixels.id.nunique()  # one row per scene
+    expected = pixels.groupby('id').agg(dict(time='first', **{band: reducer for band in S1_BANDS}))
+    pd.testing.assert_frame_equal(rows.set_index('id').sort_index(), expected.sort_index(), check_dtype=False)
+
+
+def test_linear_mean_averages_the_power(executor):
+    backend = GeeBackend(executor)
+    pixels = backend.region(s1_query(), LOCATION, SCALE, None)
+    rows = backend.reduce_region(s1_query(['VV', 'VH']), LOCATION, 'mean', SCALE).set_index('id').sort_index()
+    groups = pixels.groupby('id')
+    for band in ['VV', 'VH']:
+        expected = groups[band].agg(lambda values: 10 * np.log10(np.mean(10 ** (values / 10))))
+        np.testing.assert_allclose(rows[band], expected.sort_index(), rtol=1e-9)
+        assert (rows[band] > groups[band].mean().sort_index()).all()  # the mean power is over the mean dB
+    np.testing.assert_allclose(rows['angle'], groups['angle'].mean().sort_index(), rtol=1e-9)  # not in dB
+
+
+def test_db_linear_round_trip():
+    values = np.array([-25.0, -12.5, 0.0, 3.2])
+    np.testing.assert_allclose(db_to_linear(values), [10 ** -2.5, 10 ** -1.25, 1, 10 ** 0.32])
+    np.testing.assert_allclose(linear_to_db(db_to_linear(values)), values)
+    assert np.isnan(linear_to_db([0.0, -1.0])).all()
+
+
+@pytest.mark.parametrize('footprint_reducer', ['mean', 'linear_mean'])
+def test_download_data_with_a_footprint_reducer(executor, footprint_reducer):
+    pixels_df = s1_extractor(executor, None).download_data()
+    reduced_df = s1_extractor(executor, footprint_reducer).download_data()
+    pd.testing.assert_index_equal(reduced_df.index, pixels_df.index)
+    pd.testing.assert_frame_equal(reduced_df[['platform', 'relative_orbit', 'orbit_pass']],
+                                  pixels_df[['platform', 'relative_orbit', 'orbit_pass']])
+    if footprint_reducer == 'mean':  # the client side mean of the pixels of each scene
+        pd.testing.assert_frame_equal(reduced_df[S1_BANDS], pixels_df[S1_BANDS])
+    else:
+        assert (reduced_df[['VV', 'VH']] > pixels_df[['VV', 'VH']]).all().all()
+        np.testing.assert_allclose(reduced_df['angle'], pixels_df['angle'])
+
+
+@pytest.mark.parametrize('footprint_reducer', [None, 'mean'])
+def test_located_extract_is_one_request_in_the_native_projection(executor, footprint_reducer):
+    s1_extractor(executor, footprint_reducer).set_default_proj_dir()  # the band information is shared
+    ee.reset_stats()
+    extractor = s1_extractor(executor, footprint_reducer)
+    extractor.download_region()
+    assert ee.STATS['requests'] == 1
+    assert extractor.projection.getInfo()['crs'] == ee.S1_BAND['crs'] and extractor.scale == SCALE
+
+
+@pytest.mark.parametrize('footprint_reducer', ['max', 'linear_median', ''])
+def test_invalid_footprint_reducer(footprint_reducer):
+    with pytest.raises(ValueError, match='footprint_reducer'):
+        s1_extractor(None, footprint_reducer)
@@ -0,0 +1,41 @@
+"""fuse_sites against the per-site interpolate/merge loop of the notebook"""
+
+import pandas as pd
+import pytest
+
+from fusion import INPUT_COLUMNS, fuse_sites
+from fusion_benchmark import check_same, merge_loop, synthetic_sites
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    return synthetic_sites(12, seed=3)
+
+
+def cut(frames, mark):
+    """The frames (or the frames of each pass) of each site up to a date"""
+    return {site: {key: df[df.index <= mark] for key, df in value.items()} if isinstance(value, dict)
+            else value[value.index <= mark] for site, value in frames.items()}
+
+
+def test_fuse_sites_matches_the_merge_loop(inputs):
+    fused = fuse_sites(*inputs)
+    assert list(fused) == list(inputs[0])
+    check_same(merge_loop(*inputs), fused)
+
+
+@pytest.mark.parametrize('mark', ['2016-03-31', '2017-06-30', '2019-12-31'])
+def test_fused_tail_completes_the_records_up_to_the_mark(inputs, mark):
+    mark = pd.Timestamp(mark)
+    stored = merge_loop(*[cut(frames, mark) for frames in inputs])  # the records of a run ending at the mark
+    tail = fuse_sites(*inputs, since={site: mark for site in inputs[0]})
+    expected = merge_loop(*inputs)
+    assert sum(len(df) for df in tail.values()) < sum(len(df) for df in expected.values())  # only the tail is fused
+    for site, records in expected.items():
+        if not len(tail[site]):
+            assert len(records) == len(stored[site])
+            continue
+        start = tail[site].index.min()
+        merged = pd.concat([stored[site][stored[site].index < start].reindex(columns=INPUT_COLUMNS), tail[site]])
+        pd.testing.assert_frame_equal(merged.astype(float), records[INPUT_COLUMNS].astype(float), check_exact=True,
+                                      check_freq=False, check_index_type=False, check_names=False)
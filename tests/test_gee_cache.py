@@ -0,0 +1,59 @@
+"""GeeCache on the requests of the fake ee module: keys, LRU eviction and the cache-only mode"""
+
+import os
+
+import pytest
+
+import ee
+from GeeCache import CacheMissError, GeeCache
+
+
+def region_request(lon, distance=100):
+    images = ee.ImageCollection('COPERNICUS/S1_GRD').filterDate('2016-01-01', '2016-02-01').select(['VV', 'angle'])
+    return images.getRegion(ee.Geometry.Point([lon, 45.0]).buffer(distance), 10)
+
+
+def get_info(computed_object):
+    return computed_object.getInfo()
+
+
+def test_keys_follow_the_request():
+    assert GeeCache.key(region_request(2.0)) == GeeCache.key(region_request(2.0))
+    assert GeeCache.key(region_request(2.0)) != GeeCache.key(region_request(2.5))
+    assert GeeCache.key(region_request(2.0)) != GeeCache.key(region_request(2.0, distance=200))
+
+
+def test_cached_response_is_returned_without_a_request(tmp_path):
+    cache = GeeCache(str(tmp_path))
+    ee.reset_stats()
+    response = cache.get_info(region_request(2.0), get_info)
+    assert cache.get_info(region_request(2.0), get_info) == response
+    assert ee.STATS['requests'] == 1
+    assert GeeCache(str(tmp_path)).get_info(region_request(2.0), get_info) == response  # kept on disk
+    assert ee.STATS['requests'] == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = GeeCache(str(tmp_path))
+    requests = [region_request(lon) for lon in (1.0, 2.0, 3.0)]
+    for request in requests[:2]:
+        cache.get_info(request, get_info)
+    entry_size = max(size for size, _ in cache.entries.values())
+    cache.max_bytes = int(2.5 * entry_size)
+    cache.get_info(requests[0], get_info)  # the first entry is used again, the second is the oldest
+    cache.get_info(requests[2], get_info)
+    assert cache.stats()['evictions'] == 1 and cache.size <= cache.max_bytes
+    assert set(cache.entries) == {GeeCache.key(requests[0]), GeeCache.key(requests[2])}
+    assert not os.path.exists(cache._path(GeeCache.key(requests[1])))
+    assert set(GeeCache(str(tmp_path)).entries) == set(cache.entries)
+
+
+def test_cache_only_raises_on_a_miss(tmp_path):
+    GeeCache(str(tmp_path)).get_info(region_request(2.0), get_info)
+    cache = GeeCache(str(tmp_path), cache_only=True)
+    ee.reset_stats()
+    assert cache.get_info(region_request(2.0), get_info)
+    with pytest.raises(CacheMissError):
+        cache.get_info(region_request(3.0), get_info)
+    assert ee.STATS['requests'] == 0
@@ -0,0 +1,75 @@
+"""Validation metrics from sufficient statistics against direct numpy computations"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics import METRICS, SUMS, group_metrics, metrics_from_sums, site_metrics, unit_sums
+
+
+def records_table(n_sites=6, n_days=400, seed=0):
+    """Daily ground sm and estimates of sites in two networks, some estimates missing"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for site in range(n_sites):
+        time = pd.date_range('2016-06-01', periods=n_days, name='time')
+        sm = rng.uniform(0.05, 0.4, n_days)
+        smap = sm + 0.03 + rng.normal(0, 0.04, n_days)
+        smap[rng.random(n_days) < 0.2] = np.nan
+        frames.append(pd.DataFrame({'network': 'NET%d' % (site % 2), 'station': 'ST%d' % site,
+                                    'orbit_pass': np.where(np.arange(n_days) % 2, 'ASCENDING', 'DESCENDING'),
+                                    'sm': sm, 'SMAP': smap, 'sm_STCD': sm + rng.normal(0, 0.02, n_days)},
+                                   index=time))
+    return pd.concat(frames)
+
+
+def direct_metrics(x, y):
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    x, y = x[valid], y[valid]
+    bias = np.mean(y - x)
+    rmse = np.sqrt(np.mean((y - x) ** 2))
+    ubrmse = np.sqrt(np.mean(((y - y.mean()) - (x - x.mean())) ** 2))
+    return np.corrcoef(x, y)[0, 1], bias, rmse, ubrmse
+
+
+def test_metrics_from_sums_match_numpy():
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0.05, 0.4, 200)
+    y = 0.8 * x + 0.05 + rng.normal(0, 0.03, 200)
+    sums = [len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum(), 0, 0, 0, 0, 0]
+    r, bias, rmse, ubrmse, _ = metrics_from_sums(sums)
+    np.testing.assert_allclose([r, bias, rmse, ubrmse], direct_metrics(x, y), rtol=1e-9)
+    stacked = metrics_from_sums(np.array([sums, sums]).reshape(1, 2, len(SUMS)))  # any leading axes
+    assert stacked.shape == (1, 2, len(METRICS))
+
+
+def test_site_metrics_pool_the_units_of_each_site():
+    records = records_table()
+    table = site_metrics(unit_sums(records, estimates=('SMAP', 'sm_STCD')))
+    assert len(table) == 12 and table.columns.tolist() == ['estimate', 'network', 'station', 'n'] + METRICS
+    for _, row in table.iterrows():
+        site = records[records['station'] == row['station']]
+        expected = direct_metrics(site['sm'].to_numpy(), site[row['estimate']].to_numpy())
+        np.testing.assert_allclose(row[['R', 'bias', 'RMSE', 'ubRMSE']].to_numpy(dtype=float), expected, rtol=1e-9)
+        assert row['n'] == (site[row['estimate']].notna() & site['sm'].notna()).sum()
+
+
+def test_group_metrics_pool_the_records_of_each_group():
+    records = records_table()
+    table = group_metrics(unit_sums(records), by='network', n_boot=0)
+    for _, row in table[table['estimate'] == 'SMAP'].iterrows():
+        network = records[records['network'] == row['network']]
+        expected = direct_metrics(network['sm'].to_numpy(), network['SMAP'].to_numpy())
+        np.testing.assert_allclose(row[['R', 'bias', 'RMSE', 'ubRMSE']].to_numpy(dtype=float), expected, rtol=1e-9)
+        assert row['n_sites'] == 3
+
+
+@pytest.mark.parametrize('by', ['network', ['network', 'orbit_pass']])
+def test_group_metrics_intervals_do_not_depend_on_the_workers(by):
+    sums = unit_sums(records_table())
+    one = group_metrics(sums, by=by, n_boot=120, n_workers=1, seed=7)
+    two = group_metrics(sums, by=by, n_boot=120, n_workers=2, seed=7)
+    pd.testing.assert_frame_equal(one, two)
+    assert (one['RMSE_low'] <= one['RMSE']).all() and (one['RMSE'] <= one['RMSE_high']).all()
+    other = group_metrics(sums, by=by, n_boot=120, n_workers=1, seed=8)
+    assert not np.allclose(other['RMSE_low'], one['RMSE_low'])
@@ -0,0 +1,120 @@
+"""The resumable pipeline runner, offline on the fixtures and the fake ee module"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+from fixtures import synthetic_site_table, write_ismn_archive, write_smap_granules
+from PipelineStore import PipelineStore
+
+START_DATE = '2016-03-01'
+END_DATE = '2016-03-20'
+S1_DATASETS = ['sentinel1_ASCENDING', 'sentinel1_DESCENDING']
+
+
+@pytest.fixture(scope='module')
+def inputs(tmp_path_factory):
+    """An ISMN download of three sites and the SMAP granules of the window"""
+    root = tmp_path_factory.mktemp('inputs')
+    sites = synthetic_site_table(3, seed=5)
+    write_ismn_archive(str(root / 'ismn'), sites, days=100, seed=5)
+    write_smap_granules(str(root / 'smap'), '2016-02-01', days=50, seed=5)
+    return root
+
+
+@pytest.fixture
+def run(inputs, tmp_path):
+    """Runs stages of the pipeline on a copy of the inputs, returns the task counts of the stages"""
+    ismn_dir = str(tmp_path / 'ismn')
+    shutil.copytree(str(inputs / 'ismn'), ismn_dir)
+
+    def run(*args, stages=('gee',), force=()):
+        config = pipeline.parse_args(['--store', str(tmp_path / 'store'), '--ismn-dir', ismn_dir, '--smap-dir',
+                                      str(inputs / 'smap'), '--start', START_DATE, '--end', END_DATE,
+                                      '--workers', '1', '--chunk-size', '2'] + list(args))
+        config.backend = None
+        return pipeline.run_pipeline(config, stages, force)
+    run.store_dir = str(tmp_path / 'store')
+    run.ismn_dir = ismn_dir
+    return run
+
+
+def read_site(store_dir, dataset, site):
+    # a fresh store, the schema cached by a long lived one may hold the columns of removed files
+    return PipelineStore(store_dir).read(dataset, network=site.network, station=site.station)
+
+
+def sites_of(store_dir):
+    return PipelineStore(store_dir).read_table('site_info')
+
+
+def test_fresh_tasks_are_skipped(run):
+    counts = run()
+    assert counts == {'ismn': (3, 3), 'smap': (1, 1), 'gee': (3, 3)}
+    assert len(sites_of(run.store_dir)) == 3
+    assert run() == {'ismn': (3, 0), 'smap': (1, 0), 'gee': (3, 0)}
+    assert run(force=('gee',))['gee'] == (3, 3)
+
+
+def test_changed_station_file_reruns_its_tasks(run):
+    run()
+    site = sites_of(run.store_dir).iloc[0]
+    sm_file = [name for name in os.listdir(os.path.join(run.ismn_dir, site.network, site.station)) if '_sm_' in name]
+    path = os.path.join(run.ismn_dir, site.network, site.station, sm_file[0])
+    with open(path) as file_in:
+        text = file_in.read()
+    with open(path, 'w') as file_out:  # a new version of the download, the same dates
+        file_out.write(text.replace(' G', ' M', 50))
+    assert run() == {'ismn': (3, 1), 'smap': (1, 0), 'gee': (3, 1)}
+
+
+def test_interrupted_stage_only_reruns_the_unfinished_sites(run):
+    run()
+    store = PipelineStore(run.store_dir)
+    site_id = sorted(store.checkpoints('gee'))[0]
+    os.remove(store._checkpoint_file('gee', site_id))  # the site was extracted but not checkpointed
+    leftover = store._checkpoint_file('gee', site_id) + '.0123abcd.tmp'
+    with open(leftover, 'w') as file_out:  # an interrupted checkpoint write
+        file_out.write('{"key":')
+    assert store.checkpoint('gee', site_id) is None
+    assert run()['gee'] == (3, 1)
+    assert store.checkpoint('gee', site_id)['key'] is not None
+
+
+@pytest.mark.parametrize('change', [['--buffer', '200'], ['--footprint-reducer', 'median']])
+def test_extraction_parameter_change_extracts_again(run, tmp_path, change):
+    run()
+    site = sites_of(run.store_dir).iloc[0]
+    before = read_site(run.store_dir, 'sentinel1_ASCENDING', site)
+    modis = read_site(run.store_dir, 'MODIS_006_MOD13Q1', site)
+    assert run(*change)['gee'] == (3, 3)
+    after = read_site(run.store_dir, 'sentinel1_ASCENDING', site)
+    pd.testing.assert_index_equal(after.index, before.index)
+    assert not np.allclose(after['VV'], before['VV'])  # a new extract, not the stored one
+    pd.testing.assert_frame_equal(read_site(run.store_dir, 'MODIS_006_MOD13Q1', site), modis)  # not a MODIS parameter
+    fresh = str(tmp_path / 'fresh')
+    shutil.copytree(run.store_dir, fresh)
+    for dataset in S1_DATASETS + ['input']:
+        shutil.rmtree(os.path.join(fresh, dataset))
+    shutil.rmtree(os.path.join(fresh, '_checkpoints', 'gee'))
+    config = pipeline.parse_args(['--store', fresh, '--ismn-dir', run.ismn_dir, '--smap-dir', 'unused',
+                                  '--start', START_DATE, '--end', END_DATE, '--workers', '1'] + change)
+    config.backend = None
+    pipeline.run_stage(PipelineStore(fresh), config, 'gee')
+    for dataset in S1_DATASETS + ['input']:
+        pd.testing.assert_frame_equal(read_site(run.store_dir, dataset, site), read_site(fresh, dataset, site))
+
+
+def test_earlier_start_extracts_again_from_the_start(run):
+    run('--start', '2016-03-10')
+    site = sites_of(run.store_dir).iloc[0]
+    assert read_site(run.store_dir, 'sentinel1_DESCENDING', site).index.min() >= pd.Timestamp('2016-03-10')
+    run()
+    s1 = read_site(run.store_dir, 'sentinel1_DESCENDING', site)
+    assert s1.index.min() < pd.Timestamp('2016-03-10') and s1.index.is_unique
+    records = read_site(run.store_dir, 'input', site)
+    assert records.index.min() < pd.Timestamp('2016-03-10')
@@ -0,0 +1,89 @@
+"""PipelineStore round trips of the site partitions, the high-water marks and the checkpoints"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from PipelineStore import PipelineStore
+
+
+def site_data(start, days, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'sm': rng.uniform(0.05, 0.4, days), 'flag': rng.integers(0, 3, days)},
+                        index=pd.date_range(start, periods=days, name='time'))
+
+
+def assert_same(stored, df):
+    # the store keeps the times in ms
+    pd.testing.assert_frame_equal(stored, df, check_freq=False, check_index_type=False)
+
+
+def test_write_read_round_trip(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    frames = {('NET', 'A'): site_data('2016-01-01', 10, 0), ('NET', 'B'): site_data('2016-01-05', 4, 1)}
+    for (network, station), df in frames.items():
+        store.write('daily_ave', df, network, station)
+    for (network, station), df in frames.items():
+        assert_same(store.read('daily_ave', network=network, station=station), df)
+    everything = store.read('daily_ave')
+    assert len(everything) == 14 and set(everything['station']) == {'A', 'B'}
+    window = store.read('daily_ave', start='2016-01-06', end='2016-01-07', network='NET', station='A')
+    assert window.index.tolist() == list(pd.date_range('2016-01-06', '2016-01-07'))
+    assert sorted(map(tuple, store.sites('daily_ave')[['network', 'station']].to_numpy())) == sorted(frames)
+    store.write('daily_ave', site_data('2017-01-01', 3, 2), 'NET', 'A')  # overwrite
+    assert len(store.read('daily_ave', network='NET', station='A')) == 3
+    with pytest.raises(ValueError):
+        store.write('daily_ave', frames['NET', 'A'], 'NET', 'A', mode='update')
+
+
+def test_marks_drive_the_update_window(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    assert store.high_water_mark('s1', 'NET', 'A') is None
+    assert store.update_window('s1', '2016-01-01', '2016-03-31', 'NET', 'A') == ('2016-01-01', '2016-03-31',
+                                                                                 'overwrite')
+    store.write('s1', site_data('2016-01-01', 31, 0), 'NET', 'A', high_water_mark='2016-01-31')
+    assert store.high_water_mark('s1', 'NET', 'A') == pd.Timestamp('2016-01-31')
+    assert store.update_window('s1', '2016-01-01', '2016-03-31', 'NET', 'A') == ('2016-02-01', '2016-03-31', 'append')
+    assert store.update_window('s1', '2016-01-01', '2016-01-31', 'NET', 'A')[0] is None  # up to date
+    assert store.high_water_mark('s1', 'NET', 'B') is None  # per site
+
+
+def test_truncate_then_append_rebuilds_the_tail(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    full = site_data('2016-01-01', 60, 3)
+    store.write('s1', full.iloc[:20], 'NET', 'A', high_water_mark='2016-01-20')
+    store.write('s1', full.iloc[20:40], 'NET', 'A', mode='append', high_water_mark='2016-02-09')
+    assert len(os.listdir(store.dataset_dir('s1', 'NET', 'A'))) == 3  # two parts and the mark
+    assert store.truncate('s1', '2016-02-01', 'NET', 'A') == 9
+    assert store.truncate('s1', '2016-02-01', 'NET', 'A') == 0
+    assert_same(store.read('s1', network='NET', station='A'), full.iloc[:31])
+    store.write('s1', full.iloc[31:], 'NET', 'A', mode='append', high_water_mark='2016-02-29')
+    assert_same(store.read('s1', network='NET', station='A'), full)
+    assert store.high_water_mark('s1', 'NET', 'A') == pd.Timestamp('2016-02-29')
+
+
+def test_clear_drops_the_data_and_the_mark(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    store.write('s1', site_data('2016-01-01', 10, 4), 'NET', 'A', high_water_mark='2016-01-10')
+    store.write('s1', site_data('2016-01-01', 10, 5), 'NET', 'B', high_water_mark='2016-01-10')
+    store.read('s1')  # the schema is cached
+    assert store.clear('s1', 'NET', 'A') == 1
+    assert not store.exists('s1', 'NET', 'A') and store.high_water_mark('s1', 'NET', 'A') is None
+    assert store.update_window('s1', '2016-01-01', '2016-01-10', 'NET', 'A')[2] == 'overwrite'
+    assert set(store.read('s1')['station']) == {'B'}
+    assert store.clear('s1', 'NET', 'A') == 0
+
+
+def test_checkpoints_round_trip(tmp_path):
+    store = PipelineStore(str(tmp_path))
+    assert store.checkpoint('gee', 'NET_A') is None and store.checkpoints('gee') == {}
+    store.set_checkpoint('gee', 'NET_A', 'abc', {'lon': 1.5})
+    store.set_checkpoint('gee', 'NET/B', 'def')  # quoted in the file name
+    checkpoints = store.checkpoints('gee')
+    assert sorted(checkpoints) == ['NET/B', 'NET_A']
+    assert checkpoints['NET_A']['key'] == 'abc' and checkpoints['NET_A']['record'] == {'lon': 1.5}
+    assert checkpoints['NET/B']['record'] is None
+    assert not [name for name in os.listdir(os.path.dirname(store._checkpoint_file('gee', 'NET_A')))
+                if name.endswith('.tmp')]
@@ -0,0 +1,122 @@
+"""GeeRequestExecutor: retryable errors, backoff, retries, rate limit and requests in flight"""
+
+import http.client
+import random
+import threading
+import time
+
+import pytest
+
+import ee
+from GeeRequestExecutor import GeeRequestExecutor, RateLimiter, is_retryable
+
+
+def failing(errors, result='ok'):
+    """A GEE object raising the errors on its first getInfo calls, then returning result"""
+    errors = list(errors)
+
+    def info():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return ee.ComputedObject(info)
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (ee.EEException('Too many concurrent aggregations.'), True),
+    (ee.EEException('User memory limit exceeded. Quota exceeded.'), True),
+    (ee.EEException('Computation timed out.'), True),
+    (ee.EEException('HTTP 503: Service Unavailable'), True),
+    (ee.EEException('Image.select: Pattern VV did not match any bands.'), False),
+    (ConnectionError('reset by peer'), True),
+    (TimeoutError(), True),
+    (http.client.IncompleteRead(b''), True),
+    (ValueError('too many requests'), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) is retryable
+
+
+def test_backoff_is_a_full_jitter_up_to_max_delay():
+    random.seed(0)
+    executor = GeeRequestExecutor(base_delay=0.5, max_delay=4)
+    for attempt in range(8):
+        delays = [executor.backoff(attempt) for _ in range(200)]
+        ceiling = min(4, 0.5 * 2 ** attempt)
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert max(delays) > 0.8 * ceiling
+
+
+def test_retries_retryable_errors_with_backoff():
+    executor = GeeRequestExecutor(requests_per_second=None, base_delay=1, max_delay=60)
+    delays = []
+    executor.sleep = delays.append
+    computed_object = failing([ee.EEException('Too many concurrent aggregations.'), ConnectionError()], [1, 2])
+    assert executor.get_info(computed_object, 'region') == [1, 2]
+    assert len(delays) == 2 and 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+    records = executor.latency_records()
+    assert records.attempt.tolist() == [0, 1, 2]
+    assert records.error.fillna('').tolist() == ['EEException', 'ConnectionError', '']
+    assert executor.latency_summary().loc['region', ['requests', 'retries', 'errors']].tolist() == [3, 2, 2]
+
+
+def test_does_not_retry_other_errors():
+    executor = GeeRequestExecutor(requests_per_second=None)
+    delays = []
+    executor.sleep = delays.append
+    with pytest.raises(ee.EEException, match='did not match'):
+        executor.get_info(failing([ee.EEException('Image.select: Pattern VV did not match any bands.')]))
+    assert delays == [] and len(executor.latency_records()) == 1
+
+
+def test_gives_up_after_max_retries():
+    executor = GeeRequestExecutor(requests_per_second=None, max_retries=2)
+    delays = []
+    executor.sleep = delays.append
+    with pytest.raises(ee.EEException, match='quota'):
+        executor.get_info(failing([ee.EEException('quota exceeded')] * 5))
+    assert len(delays) == 2 and len(executor.latency_records()) == 3
+
+
+def test_rate_limiter_spaces_the_requests():
+    limiter = RateLimiter(requests_per_second=20, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # the burst goes at once, the other 4 requests wait 1/20 s each
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+
+
+def test_rate_limiter_without_limit():
+    limiter = RateLimiter(requests_per_second=None)
+    start = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_rate_limit_of_the_executor():
+    executor = GeeRequestExecutor(max_in_flight=4, requests_per_second=25)
+    start = time.monotonic()
+    assert executor.get_info_many([failing([], pos) for pos in range(9)]) == list(range(9))
+    assert time.monotonic() - start >= 5 / 25 * 0.9  # after the burst of max_in_flight requests
+
+
+def test_max_in_flight():
+    executor = GeeRequestExecutor(max_in_flight=3, requests_per_second=None)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def info(pos):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return pos
+
+    computed_objects = [ee.ComputedObject(lambda pos=pos: info(pos)) for pos in range(12)]
+    assert executor.get_info_many(computed_objects) == list(range(12))
+    assert peak[0] == 3
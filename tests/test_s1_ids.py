@@ -0,0 +1,41 @@
+"""Decoding of the Sentinel-1 scene ids: decode_s1_ids and the ids of region_to_bands_df"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from GeeRequestExecutor import GeeRequestExecutor
+from TimeseriesExtractor import GeeS1TimeseriesExtractor, decode_s1_ids
+
+IDS = ['S1A_IW_GRDH_1SDV_20170103T054207_20170103T054232_014672_017DC4_8E6A',
+       'S1B_IW_GRDH_1SDV_20170109T054124_20170109T054149_003801_00686B_2F32']
+
+
+@pytest.fixture
+def extractor():
+    return GeeS1TimeseriesExtractor('COPERNICUS/S1_GRD', '2017-01-01', '2017-05-01', ['VV', 'VH', 'angle'],
+                                    (5.1, 45.2, 50), 'DESCENDING', 'IW', '', False,
+                                    executor=GeeRequestExecutor(requests_per_second=None))
+
+
+def test_decode_s1_ids_matches_the_single_id_parser(extractor):
+    decoded = decode_s1_ids(IDS)
+    assert decoded[['platform', 'relative_orbit']].values.tolist() == [
+        list(extractor.parse_S1_platform_orbit(fname)) for fname in IDS]
+    assert decoded['absolute_orbit'].tolist() == [14672, 3801]
+    assert decoded['time'].tolist() == [pd.Timestamp('2017-01-03 05:42:07'), pd.Timestamp('2017-01-09 05:41:24')]
+
+
+def test_decode_s1_ids_of_mixed_layouts():
+    with pytest.raises(ValueError, match='layout'):
+        decode_s1_ids([IDS[0], IDS[1] + '_COG'])
+
+
+def test_region_to_bands_df_with_ids_of_mixed_layouts(extractor):
+    ids = [IDS[0], IDS[1] + '_COG']  # not one fixed-width layout
+    data_df = pd.DataFrame({'id': ids, 'time': [1483422127000, 1483940484000], 'VV': [-10.0, -11.0],
+                            'VH': [-17.0, -18.0], 'angle': [38.0, 39.0]})
+    bands_df = extractor.region_to_bands_df(data_df)
+    assert bands_df[['platform', 'relative_orbit']].values.tolist() == [
+        list(extractor.parse_S1_platform_orbit(fname)) for fname in ids]
+    assert bands_df['platform'].dtype == np.int8 and bands_df['relative_orbit'].dtype == np.int16
@@ -0,0 +1,96 @@
+"""SMAPExtractor against a full-grid read of the synthetic SPL3SMP granules"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+from fixtures import QUALITY_FILL_VALUE, write_smap_granules
+from SMAPExtractor import (BULK_DENSITY, FILL_VALUE, QUALITY_FLAG_AM, QUALITY_FLAG_PM, SOIL_MOISTURE_AM,
+                          SOIL_MOISTURE_PM, SMAPExtractor, read_granule)
+
+START_DATE = '2016-01-01'
+VARIABLES = [SOIL_MOISTURE_AM, SOIL_MOISTURE_PM, QUALITY_FLAG_AM, QUALITY_FLAG_PM, BULK_DENSITY]
+WINDOW_CELLS = [(120, 300), (121, 305), (122, 298), (121, 300)]  # contiguous rows, a window is read
+POINT_CELLS = [(40, 10), (200, 500), (405, 963), (40, 12)]  # rows apart, the rows are read one by one
+MISSING_DAY = 3
+
+
+@pytest.fixture(scope='module')
+def smap_dir(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('smap'))
+    paths = write_smap_granules(data_dir, START_DATE, days=6, seed=4)
+    os.remove(paths[MISSING_DAY])
+    return data_dir
+
+
+def full_grid(h5_file, variable):
+    # the whole dataset, the fill values are NaN
+    with h5py.File(h5_file, 'r') as granule:
+        dataset = granule[variable]
+        values = dataset[()].astype(np.float32)
+        values[dataset[()] == dataset.attrs['_FillValue']] = np.nan
+    return values
+
+
+def expected_values(extractor, cells):
+    rows, columns = np.asarray(cells).T
+    values = np.full((len(extractor.dates), len(cells), len(extractor.variables)), np.nan, dtype=np.float32)
+    for pos, h5_file in extractor.required_files():
+        for var_idx, variable in enumerate(extractor.variables):
+            values[pos, :, var_idx] = full_grid(h5_file, variable)[rows, columns]
+    return values
+
+
+@pytest.mark.parametrize('cells', [WINDOW_CELLS, POINT_CELLS], ids=['window', 'points'])
+def test_read_granule_matches_the_full_grid(smap_dir, cells):
+    h5_file = sorted(os.path.join(smap_dir, name) for name in os.listdir(smap_dir))[0]
+    rows, columns = np.asarray(cells).T
+    values = read_granule(h5_file, VARIABLES, rows, columns)
+    assert values.shape == (len(cells), len(VARIABLES)) and values.dtype == np.float32
+    for var_idx, variable in enumerate(VARIABLES):
+        np.testing.assert_array_equal(values[:, var_idx], full_grid(h5_file, variable)[rows, columns])
+
+
+def test_fill_values_are_nan(smap_dir):
+    h5_file = sorted(os.path.join(smap_dir, name) for name in os.listdir(smap_dir))[0]
+    with h5py.File(h5_file, 'r') as granule:
+        raw = granule[SOIL_MOISTURE_AM][:50, :50]
+        raw_quality = granule[QUALITY_FLAG_AM][:50, :50]
+    rows, columns = np.nonzero(raw == FILL_VALUE)
+    assert len(rows) and (raw_quality[rows, columns] == QUALITY_FILL_VALUE).all()  # a fill value of its own
+    values = read_granule(h5_file, [SOIL_MOISTURE_AM, QUALITY_FLAG_AM], rows, columns)
+    assert np.isnan(values).all()
+    rows, columns = np.nonzero(raw != FILL_VALUE)
+    values = read_granule(h5_file, [SOIL_MOISTURE_AM, QUALITY_FLAG_AM], rows, columns)
+    np.testing.assert_array_equal(values, np.stack([raw[rows, columns], raw_quality[rows, columns]], axis=1))
+
+
+@pytest.mark.parametrize('use_processes', [False, True], ids=['threads', 'processes'])
+@pytest.mark.parametrize('cells', [WINDOW_CELLS, POINT_CELLS], ids=['window', 'points'])
+def test_extract_matches_the_full_grid(smap_dir, cells, use_processes):
+    extractor = SMAPExtractor(smap_dir, cells, VARIABLES, START_DATE, '2016-01-08', n_workers=2,
+                              use_processes=use_processes)
+    values = extractor.extract()
+    assert values.shape == (8, len(cells), len(VARIABLES))
+    np.testing.assert_array_equal(values, expected_values(extractor, cells))
+    assert np.isnan(values[MISSING_DAY]).all() and np.isnan(values[6:]).all()  # no granule
+    blocks = list(extractor.extract_blocks(days=3))
+    assert [len(dates) for dates, _ in blocks] == [3, 3, 2]
+    np.testing.assert_array_equal(np.concatenate([block for _, block in blocks]), values)
+
+
+def test_to_frames_index_holds_the_missing_days(smap_dir):
+    extractor = SMAPExtractor(smap_dir, WINDOW_CELLS, [SOIL_MOISTURE_AM, QUALITY_FLAG_PM], START_DATE, '2016-01-08',
+                              n_workers=1, use_processes=False)
+    frames = extractor.to_frames(extractor.extract())
+    dates = pd.date_range(START_DATE, '2016-01-08', freq='d', name='time')
+    expected = expected_values(extractor, WINDOW_CELLS)
+    for var_idx, variable in enumerate(extractor.variables):
+        pd.testing.assert_index_equal(frames[variable].index, dates)
+        assert frames[variable].columns.tolist() == ['r120c300', 'r121c305', 'r122c298', 'r121c300']
+        np.testing.assert_array_equal(frames[variable].to_numpy(), expected[:, :, var_idx])
+    assert frames[SOIL_MOISTURE_AM].iloc[MISSING_DAY].isna().all()
+    assert frames[SOIL_MOISTURE_AM].iloc[:MISSING_DAY].notna().any().any()
@@ -1,9 +1,12 @@
+import itertools
 import os
-import re
 import pandas as pd
 import glob
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from TimeseriesExtractor import DateTool
+from ISMNCatalog import ISMNCatalog
+from SiteCube import Calendar
+from Tracer import init_worker_tracer, span, worker_tracer_args
 
 def Calculate_SMAP_VWC(NDVI,veg_type):
     if veg_type==1:
@@ -14,15 +17,128 @@ def Calculate_SMAP_VWC(NDVI,veg_type):
     return VWC
 
 
-def listdir_sm(network_dir):
-    temp_sm_file_list=glob.glob(network_dir+'\\**\\*_sm_*.stm',recursive=True)
-    sm_file_list=[]
-    for file_path in temp_sm_file_list:
-        temp=re.search(r'0.\d{6}_0.\d{6}',file_path)
-        if temp:
-            if float(temp.group().split('_')[1])<=0.051: #the depth label on the file name is 0.0508 for most us sites...
-                sm_file_list.append(file_path)
-    return sm_file_list
+def listdir_sm(network_dir, max_depth=0.051, catalog=None):
+    # the depth label on the file name is 0.0508 for most us sites...
+    with span('ismn.catalog') as stage:
+        if catalog is None:
+            catalog=ISMNCatalog(network_dir).refresh()
+        files=list(catalog.select('sm', max_depth=max_depth)['path'])
+        stage.add(rows=len(files))
+        return files
+
+def _read_station(file_pairs, s_time, e_time, since=None):
+    # read all sm (and ts) layers of a station and average them in memory
+    header=None
+    layers=[]
+    for file_sm, file_ts in file_pairs:
+        h,sm=readstm_all(file_sm,'sm',s_time,e_time,since=since)# read sm
+        if type(sm)!=pd.DataFrame:
+            continue
+        if file_ts is not None:
+            _,ts=readstm_all(file_ts,'ts',s_time,e_time,since=since)# read surface temperature
+        else:
+            ts=[]
+        if type(ts)!=pd.DataFrame:
+            ts = pd.DataFrame(np.nan, index=sm.index, columns=['ts']) # for sites without ts measurements, nan was used
+        layers.append(pd.concat([sm,ts['ts']],axis=1))
+        if header is None:
+            header=h
+    if header is None:
+        return None, None
+    site_out=pd.concat(layers) # the values observated at the same depth or the target layer
+    sm_count=site_out['sm'].groupby(level=0).count().rename('sm_count')
+    site_out=site_out.groupby(level=0).mean()
+    site_out=pd.concat([site_out,sm_count],axis=1) # each row includes the dateframe, sm, ts and number of sm measurements
+    return header, site_out
+
+
+def _stm_site(file):
+    # (network, station) of a .stm file from its header, None for a file without records
+    with open(file) as file_in:
+        lines=list(itertools.islice(file_in, 2))
+    if len(lines)<2:
+        return None
+    header=parse_stm_header(lines)[0]
+    return header.loc[0,'network'], header.loc[0,'station']
+
+
+def _ingest_station(station_dir, file_pairs, out_dir, s_time, e_time, store=None, incremental=True):
+    # incremental=False parses and overwrites all days of a station in the store, e.g. after its files changed
+    since=None
+    if store is not None and incremental: # only the days after the high-water mark of the station are parsed
+        site=_stm_site(file_pairs[0][0])
+        since=None if site is None else store.high_water_mark('daily_ave', *site)
+        if since is not None and since>=pd.Timestamp(e_time):
+            return None # up to date
+    header, site_out = _read_station(file_pairs, s_time, e_time, since)
+    if header is None:
+        return None
+    if store is not None: # All the observations < 5 cm was averaged, the days after the mark are left to the next update
+        network, station=header.loc[0,'network'], header.loc[0,'station']
+        site_out=site_out[site_out.index<=pd.Timestamp(e_time)]
+        observed=site_out.index[site_out['sm_count']>0]
+        mark=observed[-1] if len(observed) else since # the last observed day, the later days are read again next time
+        if since is not None: # the days after the previous mark were stored without observations
+            store.truncate('daily_ave', pd.Timestamp(since)+pd.Timedelta(days=1), network, station)
+        store.write('daily_ave', site_out, network, station, 'overwrite' if since is None else 'append', mark)
+    else:
+        site_file=os.path.join(out_dir,header.loc[0,'network']+'_'+header.loc[0,'station']+'.csv')
+        with span('ismn.write_csv', header.loc[0,'network']+'_'+header.loc[0,'station']) as stage:
+            site_out.to_csv(site_file)
+            if stage:
+                stage.add(rows=len(site_out), bytes=os.path.getsize(site_file))
+    site_static_file=glob.glob(os.path.join(station_dir,'*.csv')) # extract soil texture
+    if site_static_file:
+        clay, sand = parse_site_soil_texture(site_static_file[0])
+    else:
+        clay, sand = np.nan, np.nan
+    header['clay']=clay
+    header['sand']=sand
+    header['slit']=1-clay-sand
+    return header
+
+
+def group_sm_by_station(catalog, max_depth=0.051):
+    # group the (sm, ts) file pairs of each sensor and depth by the station directory they are stored in
+    sm_files=catalog.select('sm', max_depth=max_depth)
+    ts_files=catalog.pair(sm_files['path'], 'ts')
+    stations={}
+    for station_dir, file_sm, file_ts in zip(sm_files['dir'], sm_files['path'], ts_files):
+        stations.setdefault(station_dir,[]).append((file_sm, file_ts))
+    return stations
+
+
+def ingest_ismn(network_dir, out_dir, site_info_file, s_time, e_time, n_workers=None, catalog=None,
+                max_depth=0.051, store=None):
+    # parse all stations of an ISMN download across a process pool, each station file and the site information
+    # table are written once. n_workers=1 runs in the current process. With a PipelineStore the stations go to
+    # its daily_ave dataset and the site information to its site_info table instead of out_dir and site_info_file,
+    # a station ingested before only gets the days after its high-water mark, up to e_time
+    if catalog is None:
+        catalog=ISMNCatalog(network_dir).refresh()
+    if store is None and not os.path.exists(out_dir):
+        os.mkdir(out_dir)
+    stations=group_sm_by_station(catalog, max_depth)
+    args=[(station_dir, file_pairs, out_dir, s_time, e_time, store) for station_dir, file_pairs in stations.items()]
+    if n_workers==1:
+        headers=[_ingest_station(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker_tracer,
+                                 initargs=worker_tracer_args()) as executor:
+            headers=list(executor.map(_ingest_station, *zip(*args))) if args else []
+    headers=[h for h in headers if h is not None]
+    if not headers:
+        return pd.DataFrame() if store is None else store.read_table('site_info')
+    site_info_out=pd.concat(headers, ignore_index=True)
+    if store is not None:
+        site_info_out=pd.concat([store.read_table('site_info'),site_info_out], ignore_index=True).drop_duplicates()
+        store.write_table('site_info', site_info_out)
+        return site_info_out
+    if os.path.exists(site_info_file):
+        site_info_out=pd.concat([pd.read_csv(site_info_file),site_info_out], ignore_index=True)
+    site_info_out=site_info_out.drop_duplicates()
+    site_info_out.to_csv(site_info_file,index=False)
+    return site_info_out
 
 
 def parse_site_soil_texture(site_file):
@@ -47,16 +163,12 @@ def get_path_to_dir(home_dir, folder):
     return target_dir
 
 
-def readstm_all(file,var_name,s_time,e_time):
-    # used to read sm or temperature from standard ISMN data
-    with open(file) as file_in:
-        lines = []
-        for line in file_in:
-            lines.append(line)
-    if len(lines)<=10: # the the length of records is less 10, discard this file 
-        return [],[]
-    
-    #parse header
+STM_CHUNK_SIZE = 100000 # number of records decoded per block by readstm_all
+
+
+def parse_stm_header(lines):
+    # parse the header of a standard ISMN .stm file from its first two lines
+    # returns the header frame, the column of the variable and the G flag, and the number of leading lines to skip
     if (len(lines[0].split())==len(lines[1].split()))|len(lines[1].split())>=13:
         header = lines[0].split()
         network =  header[5]
@@ -67,6 +179,7 @@ def readstm_all(file,var_name,s_time,e_time):
         end_depth = int(float(header[11])*100)
         G_flag=13
         var_flag=12
+        skip_rows=0 # the header is the first record
     else:
         header = lines[0].split()
         network =  header[1]
@@ -75,26 +188,146 @@ def readstm_all(file,var_name,s_time,e_time):
         lon = float(header[4])
         start_depth = int(float(header[6])*100) # cm
         end_depth = int(float(header[7])*100)
-        lines=lines[2:-1]
         G_flag=3
         var_flag=2
-        
+        skip_rows=2
     header=pd.DataFrame({'network':[network],'station': [station],'lat':[lat],'lon':[lon],'s_depth':[start_depth],'e_depth':[end_depth]})
-    timestp=[]
-    obv_var=[] # the variable list, being soil moisture or temperature
-    for line in lines:
-        temp=line.split()
-        if temp[G_flag]=='G':
-            obv_var.append(float(temp[var_flag]))
-            #timestp.append(temp[0]+' '+temp[1])
-            timestp.append(temp[0])
+    return header, var_flag, G_flag, skip_rows
+
+
+def _last_line_is_blank(file):
+    with open(file, 'rb') as file_in:
+        file_in.seek(0, os.SEEK_END)
+        size = file_in.tell()
+        file_in.seek(max(size-2, 0))
+        tail = file_in.read()
+    return size==0 or tail.endswith(b'\n\n') or tail==b'\n'
+
+
+def _daily_mean_blocks(blocks, var_name):
+    # reduce G flagged records to daily means block by block, records of the last (possibly incomplete) day are
+    # carried to the next block. Returns None if the records are not in chronological order
+    done_days=[]
+    done_means=[]
+    carry=None
+    for block in blocks:
+        if carry is not None:
+            block=pd.concat([carry, block], ignore_index=True)
+        days=block['time'].to_numpy()
+        if len(days)==0:
+            carry=block
+            continue
+        if np.any(days[1:]<days[:-1]) or (len(done_days) and days[0]<=done_days[-1][-1]):
+            return None
+        last_day=days[-1]
+        complete=days!=last_day
+        carry=block[~complete]
+        if complete.any():
+            daily=block[complete].groupby('time')[var_name].mean()
+            done_days.append(daily.index.to_numpy())
+            done_means.append(daily.to_numpy())
+    if carry is not None and len(carry):
+        daily=carry.groupby('time')[var_name].mean()
+        done_days.append(daily.index.to_numpy())
+        done_means.append(daily.to_numpy())
+    if not done_days:
+        return [], []
+    return np.concatenate(done_days), np.concatenate(done_means)
+
+
+def _first_record_after(file, mark, skip_rows, drop_last):
+    # the byte offset of the first record dated after mark (YYYY/MM/DD), found from the dates starting the lines
+    # without parsing them. None when the records are not in chronological order
+    buffer=np.memmap(file, dtype=np.uint8, mode='r')
+    ends=np.flatnonzero(buffer==ord('\n'))
+    starts=np.concatenate([[0], ends+1])[skip_rows:]
+    ends=np.append(ends, len(buffer))[skip_rows:]
+    starts=starts[ends-starts>=10] # the blank lines are not records
+    if drop_last:
+        starts=starts[:-1]
+    dates=buffer[starts[:, None]+np.arange(10)].view('S10').ravel()
+    if np.any(dates[1:]<dates[:-1]):
+        return None
+    pos=np.searchsorted(dates, mark.encode(), side='right')
+    return int(starts[pos]) if pos<len(starts) else len(buffer)
+
+
+def _read_stm_blocks(file, var_flag, G_flag, skip_rows, drop_last, chunk_size, offset=None):
+    # decode the date, value and flag columns block by block, the values are parsed exactly as float() does. With
+    # an offset, only the records from the offset on are decoded
+    with open(file, 'rb') as file_in:
+        if offset is not None:
+            if offset>=os.path.getsize(file):
+                return
+            file_in.seek(offset)
+            skip_rows=0
+        reader = pd.read_csv(file_in, sep=r'\s+', header=None, skiprows=skip_rows, usecols=[0, var_flag, G_flag],
+                             dtype={0: str, G_flag: str}, keep_default_na=False, float_precision='round_trip',
+                             chunksize=chunk_size)
+        pending=None
+        for chunk in reader:
+            if pending is not None:
+                yield pending
+            pending=chunk
+        if pending is not None:
+            if drop_last:
+                pending=pending.iloc[:-1]
+            yield pending
+
+
+def _filter_stm_block(chunk, var_name, var_flag, G_flag):
+    # keep the G flagged records only
+    chunk=chunk[chunk[G_flag].to_numpy()=='G']
+    return pd.DataFrame({'time': chunk[0].to_numpy(), var_name: chunk[var_flag].to_numpy().astype(float)})
+
+
+def readstm_all(file,var_name,s_time,e_time,chunk_size=STM_CHUNK_SIZE,since=None):
+    # used to read sm or temperature from standard ISMN data
+    # with since (a high-water mark), only the days after it and up to e_time are returned
+    with span('ismn.read_stm', variable=var_name) as stage:
+        header, obv_var = _readstm(file,var_name,s_time,e_time,chunk_size,since)
+        if stage:
+            stage.add(bytes=os.path.getsize(file), rows=len(obv_var))
+            if len(header):
+                stage.site=header.loc[0,'network']+'_'+header.loc[0,'station']
+        return header, obv_var
+
+
+def _readstm(file,var_name,s_time,e_time,chunk_size,since):
+    with open(file) as file_in:
+        lines = list(itertools.islice(file_in, 11)) # only the first lines are required for the header
+    if len(lines)<=10: # the the length of records is less 10, discard this file 
+        return [],[]
+
+    #parse header
+    header, var_flag, G_flag, skip_rows = parse_stm_header(lines)
+    drop_last = skip_rows>0 and not _last_line_is_blank(file) # the last line of the header-values format is not a record
+
+    mark, offset=None, None
+    if since is not None: # only the records after the high-water mark are decoded and reduced
+        mark=pd.Timestamp(since).strftime('%Y/%m/%d') # the records are dated YYYY/MM/DD
+        offset=_first_record_after(file, mark, skip_rows, drop_last)
+
+    def blocks():
+        for chunk in _read_stm_blocks(file, var_flag, G_flag, skip_rows, drop_last, chunk_size, offset):
+            if mark is not None: # e.g. the records of a file out of chronological order, all decoded
+                chunk=chunk[chunk[0].to_numpy()>mark]
+                if len(chunk)==0:
+                    continue
+            yield _filter_stm_block(chunk, var_name, var_flag, G_flag)
+
+    reduced=_daily_mean_blocks(blocks(), var_name)
+    if reduced is None: # records out of chronological order, reduce all of them at once
+        reduced=pd.concat(list(blocks()), ignore_index=True)
+        reduced=(reduced['time'].to_numpy(), reduced[var_name].to_numpy())
+    timestp, obv_var = reduced
     obv_var=pd.DataFrame({'time':timestp,var_name:obv_var})
     obv_var['time'] = pd.to_datetime(obv_var.time)
     obv_var.set_index('time',inplace=True)
     obv_var=obv_var.groupby(level=0).mean() # daily average
-    
-    df_timeframe = pd.date_range(start="2016-01-01", end="2019-12-31", freq='d').rename('time').to_frame().reset_index(drop=True)
-    df_timeframe.set_index('time',inplace=True)
-    date_obj = DateTool(df_timeframe.index)
-    obv_var = pd.concat([date_obj.get_all_date_df(), obv_var], axis=1)
-    return header, obv_var
\ No newline at end of file
+
+    start=s_time if since is None else pd.Timestamp(since)+pd.Timedelta(days=1)
+    calendar = Calendar.cached(start, e_time) # the dates are built once for all files of a window
+    obv_var = obv_var[(obv_var.index>=calendar.dates[0]) & (obv_var.index<=calendar.dates[-1])]
+    obv_var = pd.concat([calendar.date_df, obv_var], axis=1)
+    return header, obv_var